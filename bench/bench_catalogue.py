@@ -0,0 +1,53 @@
+"""Compares the GenQuery catalogue engine against the collection walker on a
+synthetic tree held by the fake iRODS backend.
+
+Usage: python3 -m bench.bench_catalogue [--collections N] [--objects N]
+    [--latency SECONDS]"""
+
+import argparse
+import time
+
+import core.irods_wrapper as irods_wrapper
+from test.fake_irods import FakeSession
+
+ROOT = '/bench/root'
+
+
+def build_tree(session, num_collections, objects_per_collection):
+    """Populate 'session' with a two-level tree of collections."""
+    for c in range(num_collections):
+        collection = '{}/group{}/coll{}'.format(ROOT, c % 10, c)
+        session.add_collection(collection)
+        for o in range(objects_per_collection):
+            session.add_data_object('{}/file{}.cram'.format(collection, o))
+
+
+def time_listing(session, walk):
+    session.round_trips = 0
+    start = time.perf_counter()
+    catalogue = irods_wrapper.get_irods_catalogue(ROOT, session, walk=walk)
+    elapsed = time.perf_counter() - start
+    return elapsed, session.round_trips, len(catalogue['objects'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark catalogue " +
+        "listing engines on a fake iRODS backend.")
+    parser.add_argument('--collections', type=int, default=1000)
+    parser.add_argument('--objects', type=int, default=20,
+        help="Data objects per collection.")
+    parser.add_argument('--latency', type=float, default=0.0005,
+        help="Simulated seconds per server round-trip.")
+    args = parser.parse_args()
+
+    session = FakeSession(latency=args.latency)
+    build_tree(session, args.collections, args.objects)
+
+    for name, walk in (('genquery', False), ('walker', True)):
+        elapsed, round_trips, count = time_listing(session, walk)
+        print("{:<9} {:>9} objects {:>8} round-trips {:>8.3f} s".format(
+            name, count, round_trips, elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Compares compiled pattern matching against the per-pattern fnmatch/re
+loop generate_plans used to run, over synthetic paths and rules.
+
+The naive loop is timed on a sample of the paths and extrapolated, since
+running it over a million paths and 500 rules takes a very long time.
+
+Usage: python3 -m bench.bench_matcher [--paths N] [--rules N]
+    [--naive_sample N]"""
+
+import argparse
+import random
+import time
+
+from bench.reference import naive_match
+from planner.matcher import PatternMatcher
+
+EXTENSIONS = ['cram', 'bam', 'vcf.gz', 'bcf', 'txt', 'crai', 'tbi', 'json']
+
+
+def make_rules(count, rng):
+    """A mix of the pattern shapes seen in real configurations."""
+    rules = ['*']
+    while len(rules) < count:
+        i = len(rules)
+        kind = i % 5
+        if kind == 0:
+            rule = '*.{}{}'.format(rng.choice(EXTENSIONS), i)
+        elif kind == 1:
+            rule = '/seq/study{}/*'.format(i)
+        elif kind == 2:
+            rule = '*/run{}/*.{}'.format(i, rng.choice(EXTENSIONS))
+        elif kind == 3:
+            rule = r'/sample{}_[0-9]+\.{}$/'.format(i, rng.choice(EXTENSIONS))
+        else:
+            rule = '*.{}'.format(EXTENSIONS[i % len(EXTENSIONS)]) + \
+                ('' if i < len(EXTENSIONS) else str(i))
+        rules.append(rule)
+    return rules
+
+
+def make_paths(count, rng):
+    for i in range(count):
+        yield '/seq/study{}/run{}/sample{}_{}.{}'.format(rng.randrange(1000),
+            rng.randrange(500), rng.randrange(1000), i,
+            rng.choice(EXTENSIONS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark configuration " +
+        "pattern matching.")
+    parser.add_argument('--paths', type=int, default=1000000)
+    parser.add_argument('--rules', type=int, default=500)
+    parser.add_argument('--naive_sample', type=int, default=5000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    rules = make_rules(args.rules, rng)
+    paths = list(make_paths(args.paths, rng))
+
+    start = time.perf_counter()
+    matcher = PatternMatcher(rules)
+    compile_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matches = 0
+    for path in paths:
+        matches += len(matcher.match(path))
+    compiled = time.perf_counter() - start
+
+    sample = paths[:args.naive_sample]
+    start = time.perf_counter()
+    for path in sample:
+        naive_match(rules, path)
+    naive = (time.perf_counter() - start) * len(paths) / len(sample)
+
+    print("{} paths, {} rules, {} matches".format(len(paths), len(rules),
+        matches))
+    print("compiled  {:>10.2f} s (+{:.3f} s to compile)".format(compiled,
+        compile_time))
+    print("naive     {:>10.2f} s (extrapolated from {} paths)".format(naive,
+        len(sample)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Measures the memory held by buffered plans, and the size of pickled plans
+as sent to worker processes, comparing plans that share interned static AVU
+tuples against plans that each own freshly built AVUs.
+
+Usage: python3 -m bench.bench_plans [--plans N]"""
+
+import argparse
+import pickle
+import tracemalloc
+
+import planner.planner as planner
+from planner.object_class import AVU
+
+CONFIG = "test/test_config_1.yaml"
+
+
+def catalogue(count):
+    for i in range(count):
+        yield ('/bench/coll{}/file{}.cram'.format(i % 100, i), False)
+
+
+def measure(build):
+    tracemalloc.start()
+    plans = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return plans, current
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark plan memory.")
+    parser.add_argument('--plans', type=int, default=100000)
+    args = parser.parse_args()
+
+    paths = [path for path, _ in catalogue(args.plans)]
+
+    shared, shared_bytes = measure(lambda: list(
+        planner.generate_plans(catalogue(args.plans), CONFIG)))
+    fresh, fresh_bytes = measure(lambda: [(path, False,
+        [AVU(avu.attribute, avu.value, avu.unit) for avu in plan.metadata])
+        for path, plan in zip(paths, shared)])
+    # Neither representation owns its path, so leave them out of both
+    path_bytes = sum(len(path) + 49 for path in paths)
+
+    print("{} plans".format(args.plans))
+    print("shared static AVUs {:>8.1f} bytes/plan".format(
+        (shared_bytes - path_bytes) / args.plans))
+    print("fresh AVU lists    {:>8.1f} bytes/plan".format(
+        fresh_bytes / args.plans))
+    print("pickled shared     {:>8.1f} bytes/plan".format(
+        len(pickle.dumps(shared)) / args.plans))
+    print("pickled fresh      {:>8.1f} bytes/plan".format(
+        len(pickle.dumps(fresh)) / args.plans))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Compares a catalogue snapshot against a JSON dump of the same listing:
+file size, time to write, and time from opening the file to having iterated
+over every path.
+
+Usage: python3 -m bench.bench_snapshot [--objects N]"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from core.catalogue_snapshot import CatalogueSnapshot, write_snapshot
+
+
+def make_catalogue(count):
+    for i in range(count):
+        run = i // 2000
+        yield ('/seq/illumina/runs/{}/{}/plex{}/{}_{}#{}.cram'.format(
+            run // 100, run, i % 24, run, i % 8, i % 2000), False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark catalogue " +
+        "snapshots.")
+    parser.add_argument('--objects', type=int, default=1000000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot_path = os.path.join(directory, 'catalogue.snap')
+        json_path = os.path.join(directory, 'catalogue.json')
+
+        start = time.perf_counter()
+        for _ in write_snapshot(make_catalogue(args.objects),
+                snapshot_path):
+            pass
+        snapshot_write = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with open(json_path, 'w') as file:
+            json.dump({'objects': [path for path, _ in
+                make_catalogue(args.objects)], 'collections': []}, file)
+        json_write = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with CatalogueSnapshot(snapshot_path) as snapshot:
+            count = sum(1 for _ in snapshot)
+        snapshot_read = time.perf_counter() - start
+        assert count == args.objects
+
+        start = time.perf_counter()
+        with open(json_path) as file:
+            count = len(json.load(file)['objects'])
+        json_read = time.perf_counter() - start
+
+        print("{} objects".format(args.objects))
+        print("          {:>10} {:>10} {:>10}".format("MiB", "write s",
+            "read s"))
+        for name, path, write, read in [
+                ("snapshot", snapshot_path, snapshot_write, snapshot_read),
+                ("json", json_path, json_write, json_read)]:
+            print("{:<10}{:>10.1f} {:>10.2f} {:>10.2f}".format(name,
+                os.path.getsize(path) / 1024 ** 2, write, read))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""End-to-end benchmarks of listing, planning and applying metadata on a
+synthetic tree held by the fake iRODS backend, compared against a baseline
+saved on the same machine so performance regressions show up without a live
+zone. Baselines aren't committed, since they only hold for the machine they
+were measured on.
+
+Each phase runs in its own process, building its own copy of the tree, so
+its peak RSS is its own:
+
+    catalogue   List every object under the root
+    plan        List and plan every object, reading each SAM header
+    apply       List, plan and apply every plan, as a run does
+
+Usage: python3 -m bench.bench_suite [--objects N] [--per_collection N]
+    [--latency SECONDS] [--failure_rate P] [--workers N] [--in_flight N]
+    [--inference_jobs N] [--phases catalogue,plan,apply]
+    [--baseline path] [--save] [--check]"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from functools import partial
+
+import core.irods_wrapper as irods_wrapper
+import core.logger as logger
+import planner.planner as planner
+from executor.executor import Executor
+from test.fake_irods import FakeSession
+
+ROOT = '/bench/root'
+CONFIG = os.path.join(os.path.dirname(__file__), 'bench_config.yaml')
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+PHASES = ('catalogue', 'plan', 'apply')
+
+# Every object is a small SAM file, so planning parses a real header
+CONTENT = (b'@HD\tVN:1.6\tSO:coordinate\n' +
+    b''.join(b'@SQ\tSN:chr%d\tLN:%d\n' % (i, 1000000 * i)
+    for i in range(1, 25)) +
+    b'@RG\tID:rg1\tSM:sample1\n')
+
+# Slower or bigger than the baseline by more than this is a regression
+TOLERANCE = 0.2
+
+
+def build_session(settings):
+    """Returns a fake zone holding the synthetic tree. Worker processes
+    each build their own."""
+    # Failures are only injected into metadata writes, which a run reports
+    # and carries on past; a failed listing page ends the run
+    session = FakeSession(latency=settings['latency'],
+        failure_rate={'metadata': settings['failure_rate']},
+        seed=settings['seed'])
+    per_collection = settings['per_collection']
+    collections = -(-settings['objects'] // per_collection)
+    session.add_synthetic_tree(ROOT, collections, per_collection,
+        name='file{}.sam', content=CONTENT, avus=[('pi', 'ch12')])
+    return session
+
+
+def _plans(session, settings):
+    catalogue = irods_wrapper.iter_irods_catalogue(ROOT, session)
+    return planner.generate_plans(catalogue, CONFIG, session=session,
+        inference_jobs=settings['inference_jobs'])
+
+
+def _catalogue(settings):
+    session = build_session(settings)
+    return sum(1 for _ in irods_wrapper.iter_irods_catalogue(ROOT, session))
+
+
+def _plan(settings):
+    session = build_session(settings)
+    return sum(1 for _ in _plans(session, settings))
+
+
+def _apply(settings):
+    session = build_session(settings)
+    if settings['workers'] > 1:
+        executor = Executor(None, settings['workers'],
+            session_factory=partial(build_session, settings),
+            in_flight=settings['in_flight'])
+    else:
+        executor = Executor(session, 1, in_flight=settings['in_flight'])
+    return sum(1 for _ in executor.execute_plans(_plans(session, settings)))
+
+
+def _measure(phase, settings, results):
+    # Logged as a run logs, but out of the way of the results
+    logger.configure(path=os.devnull)
+    try:
+        start = time.perf_counter()
+        count = globals()['_' + phase](settings)
+        elapsed = time.perf_counter() - start
+    except BaseException as e:
+        results.put({'error': repr(e)})
+        raise
+    # ru_maxrss is in KiB on Linux. Worker processes are counted separately.
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    results.put({'objects': count, 'seconds': elapsed,
+        'objects_per_second': count / elapsed if elapsed else 0,
+        'peak_rss_mib': rss / 1024})
+
+
+def run_phase(phase, settings):
+    """Run one phase in a fresh process and return its results."""
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    process = context.Process(target=_measure,
+        args=(phase, settings, results))
+    process.start()
+    result = results.get()
+    process.join()
+    if 'error' in result:
+        raise RuntimeError("The {} phase failed: {}".format(phase,
+            result['error']))
+    return result
+
+
+def compare(results, baseline):
+    """Print each phase against the baseline, and return the phases which
+    regressed."""
+    regressions = []
+    for phase, result in results.items():
+        old = baseline.get(phase)
+        line = "{:<10} {:>9} objects {:>10.1f} objects/s {:>8.1f} MiB".format(
+            phase, result['objects'], result['objects_per_second'],
+            result['peak_rss_mib'])
+        if old:
+            speed = result['objects_per_second'] / old['objects_per_second']
+            memory = result['peak_rss_mib'] / old['peak_rss_mib']
+            line += "  {:>+6.1%} speed {:>+6.1%} memory".format(speed - 1,
+                memory - 1)
+            if speed < 1 - TOLERANCE or memory > 1 + TOLERANCE:
+                line += "  REGRESSION"
+                regressions.append(phase)
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark listing, " +
+        "planning and applying metadata end-to-end on a fake iRODS backend.")
+    parser.add_argument('--objects', type=int, default=20000,
+        help="Data objects in the synthetic tree.")
+    parser.add_argument('--per_collection', type=int, default=1000,
+        help="Data objects per collection.")
+    parser.add_argument('--latency', type=float, default=0,
+        help="Simulated seconds per server round-trip.")
+    parser.add_argument('--failure_rate', type=float, default=0,
+        help="Probability of each metadata write failing.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--in_flight', type=int, default=1)
+    parser.add_argument('--inference_jobs', type=int, default=1)
+    parser.add_argument('--phases', default=','.join(PHASES),
+        help="Comma separated phases to run.")
+    parser.add_argument('--baseline', default=BASELINE,
+        help="JSON file of results to compare against (default "
+        "bench/baseline.json, saved with --save).")
+    parser.add_argument('--save', action='store_true',
+        help="Store these results as the baseline.")
+    parser.add_argument('--check', action='store_true',
+        help="Exit with an error if any phase regressed.")
+    args = parser.parse_args()
+
+    settings = {key: getattr(args, key) for key in ('objects',
+        'per_collection', 'latency', 'failure_rate', 'seed', 'workers',
+        'in_flight', 'inference_jobs')}
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            stored = json.load(file)
+        if stored['settings'] == settings:
+            baseline = stored['results']
+        else:
+            print("Baseline {} was run with other settings, so isn't "
+                "compared.".format(args.baseline))
+    if args.check and not baseline:
+        parser.error("--check needs a baseline saved on this machine with "
+            "the same settings. Run with --save first.")
+
+    results = {}
+    for phase in args.phases.split(','):
+        results[phase] = run_phase(phase, settings)
+    regressions = compare(results, baseline)
+
+    if args.save:
+        with open(args.baseline, 'w') as file:
+            json.dump({'settings': settings, 'results': results}, file,
+                indent=2)
+            file.write('\n')
+    if args.check and regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Compares parse_variant_header using the regex field splitter against the
+tokenizer-based splitter it replaced, on a synthetic header with many
+contig and INFO/FORMAT lines.
+
+Usage: python3 -m bench.bench_vcf_header [--contigs N] [--info N]"""
+
+import argparse
+import time
+
+import planner.inferrers as inferrers
+from bench.reference import make_header, tokenize_split
+
+
+def timed(header):
+    start = time.perf_counter()
+    parsed = inferrers.parse_variant_header(header)
+    return parsed, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark VCF header " +
+        "parsing.")
+    parser.add_argument('--contigs', type=int, default=50000)
+    parser.add_argument('--info', type=int, default=5000)
+    args = parser.parse_args()
+
+    header = make_header(args.contigs, args.info)
+    print("{} header lines, {:.1f} MiB".format(header.count('\n'),
+        len(header) / 1024 ** 2))
+
+    parsed, fast = timed(header)
+    split = inferrers._split_by_symbol
+    inferrers._split_by_symbol = tokenize_split
+    try:
+        expected, slow = timed(header)
+    finally:
+        inferrers._split_by_symbol = split
+
+    print("regex splitter     {:8.3f}s".format(fast))
+    print("tokenize splitter  {:8.3f}s".format(slow))
+    print("speedup            {:8.1f}x".format(slow / fast))
+    print("identical output   {}".format(parsed == expected))
+
+
+if __name__ == "__main__":
+    main()
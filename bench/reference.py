@@ -0,0 +1,59 @@
+"""Reference implementations of code Asclepius has replaced, which the
+benchmarks time against and the tests check the replacements against, and
+the synthetic inputs they share."""
+
+import fnmatch
+import random
+import re
+from io import StringIO
+from tokenize import generate_tokens
+
+
+def naive_match(patterns, path):
+    """The matching loop generate_plans used before patterns were compiled."""
+    matched = []
+    for pattern in reversed(patterns):
+        if pattern[0] == "/" and pattern[-1] == "/":
+            if re.search(pattern[1:-1], path):
+                matched.append(pattern)
+        elif fnmatch.fnmatch(path, pattern):
+            matched.append(pattern)
+    return matched
+
+
+def tokenize_split(string, symbol):
+    """The tokenizer-based splitter parse_variant_header used to use, kept
+    as a reference."""
+
+    symbols = [-1]
+    symbols.extend(t[2][1] for t in generate_tokens(
+        StringIO(string).readline) if t[1] == symbol)
+    symbols.append(len(string))
+    return [string[symbols[i]+1:symbols[i+1]] for i in range(len(symbols)-1)]
+
+
+def make_header(contigs, info, rng=None):
+    """A VCF header shaped like those of large call sets: many contig lines
+    and INFO/FORMAT lines whose descriptions contain commas, quotes and
+    equals signs."""
+
+    rng = rng or random.Random(0)
+    lines = ['##fileformat=VCFv4.2', '##FILTER=<ID=PASS,Description="All '
+        'filters passed">', '##source=caller', '##source=annotator',
+        '##reference=file:///ref/GRCh38.fa']
+    for i in range(contigs):
+        lines.append('##contig=<ID=chrUn_{},length={},assembly=GRCh38,'
+            'md5={:032x}>'.format(i, rng.randrange(1, 10 ** 8),
+            rng.getrandbits(128)))
+    descriptions = ['Allele count in genotypes, for each ALT allele',
+        'Read depth; "filtered" reads, excluded', 'Mapping quality = 60',
+        'Escaped \\"quote, inside\\" text', 'Plain description',
+        "Sample's depth"]
+    for i in range(info):
+        lines.append('##{}=<ID=F{},Number={},Type={},Description="{}",'
+            'Source="tool, v{}",Version="1">'.format(
+            rng.choice(['INFO', 'FORMAT']), i, rng.choice(['1', 'A', '.']),
+            rng.choice(['Integer', 'String', 'Float']),
+            rng.choice(descriptions), i))
+    lines.append('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,133 @@
+"""The three things Asclepius needs from iRODS, behind one interface so the
+way they're done can be swapped: listing the catalogue, reading the AVUs of
+a collection's contents, and writing an object's AVU changes.
+
+'irodsclient' uses python-irodsclient sessions, through core.irods_wrapper.
+'baton' streams JSON operations to one long-lived baton-do process (see
+core.baton). Anything given a plain iRODSSession wraps it with 'as_backend'.
+"""
+
+import core.irods_wrapper as irods_wrapper
+
+BACKENDS = ('irodsclient', 'baton')
+
+
+class Backend:
+    """Base class of the backends. A backend is used by one process, but
+    may be called from several of its threads at once. 'in_flight' is how
+    many objects an execution process applies at once with it, unless told
+    otherwise."""
+
+    in_flight = 1
+
+    def iter_catalogue(self, path, include_collections=False, walk=False,
+            since=None):
+        """Yield the iRODS path of every data object (and, optionally, every
+        collection) under 'path', as 'irods_wrapper.iter_irods_catalogue'
+        does.
+
+        @return: (iRODS path, is collection) tuples, as a generator
+        @raise irods.exception.CollectionDoesNotExist: If the root is
+            missing"""
+        raise NotImplementedError
+
+    def query_metadata(self, collection, names=None, is_collection=False):
+        """Fetch the AVUs of the data objects, or subcollections, directly in
+        a collection, as 'irods_wrapper.query_metadata' does.
+
+        @return: Dictionary of {iRODS path: [(attribute, value, units), ...]}.
+            Objects without AVUs are absent"""
+        raise NotImplementedError
+
+    def apply_metadata(self, path, to_add, to_remove, is_collection=False):
+        """Remove and then add (attribute, value, units) AVUs on one
+        object."""
+        raise NotImplementedError
+
+    def cleanup(self):
+        """Release the backend's connections. iRODSSession has the same
+        method, so either can be handed to an executor worker."""
+
+
+class IrodsClientBackend(Backend):
+    """Backend using a python-irodsclient session.
+
+    @param session: iRODSSession object. A new session is created, and
+        cleaned up by 'cleanup', if one isn't provided"""
+
+    def __init__(self, session=None):
+        self._owns_session = session is None
+        self.session = session or irods_wrapper.create_session()
+
+    def iter_catalogue(self, path, include_collections=False, walk=False,
+            since=None):
+        return irods_wrapper.iter_irods_catalogue(path, self.session,
+            include_collections, walk, since)
+
+    def query_metadata(self, collection, names=None, is_collection=False):
+        return irods_wrapper.query_metadata(self.session, collection, names,
+            is_collection)
+
+    def apply_metadata(self, path, to_add, to_remove, is_collection=False):
+        irods_wrapper.apply_metadata(self.session, path, to_add, to_remove,
+            is_collection)
+
+    def cleanup(self):
+        if self._owns_session:
+            self.session.cleanup()
+
+
+def as_backend(session):
+    """Returns a backend as it is, or an iRODSSession (or anything which
+    behaves like one) wrapped in an IrodsClientBackend."""
+    if isinstance(session, Backend):
+        return session
+    return IrodsClientBackend(session)
+
+
+def create_backend(name='irodsclient', session=None):
+    """Returns a new backend by name, one of BACKENDS. The caller cleans it
+    up.
+
+    @param session: iRODSSession for the irodsclient backend to share rather
+        than opening its own. Other backends don't use it
+    @raise ValueError: If there's no such backend"""
+
+    if name == 'irodsclient':
+        return IrodsClientBackend(session)
+    if name == 'baton':
+        # Only loaded when used, since it runs an external program
+        from core.baton import BatonBackend
+        return BatonBackend()
+    raise ValueError("Unknown backend {!r}, expected one of {}".format(name,
+        ', '.join(BACKENDS)))
+
+
+def default_in_flight(name='irodsclient'):
+    """Returns how many objects each execution process applies at once with
+    a backend, by name, unless told otherwise. baton answers a stream of
+    operations on one connection, so it needs many outstanding; a
+    python-irodsclient session needs a connection for each."""
+
+    if name == 'baton':
+        from core.baton import BatonBackend
+        return BatonBackend.in_flight
+    return IrodsClientBackend.in_flight
+
+
+def list_catalogue(path, name='irodsclient', include_collections=False,
+        since=None, session=None):
+    """Lists a collection tree with a backend of its own, which is cleaned up
+    once the listing finishes.
+
+    @param path: Root iRODS path string
+    @param name: Name of the backend to list with
+    @param session: iRODSSession for the irodsclient backend to share
+    @return: (iRODS path, is collection) tuples, as a generator"""
+
+    backend = create_backend(name, session)
+    try:
+        yield from backend.iter_catalogue(path, include_collections,
+            since=since)
+    finally:
+        backend.cleanup()
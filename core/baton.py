@@ -0,0 +1,376 @@
+"""A backend which talks to iRODS through baton's baton-do, one long-lived
+process and connection which reads a stream of JSON operations on its stdin
+and answers each, in order, on its stdout:
+
+    {"operation": "metamod", "arguments": {"operation": "add"},
+        "target": {"collection": ..., "data_object": ..., "avus": [...]}}
+    {"operation": "metamod", ..., "result": {"single": ...}}
+
+Requests are written as soon as they're made, without waiting for earlier
+answers, so many operations are in flight on the one connection at once and
+a run pays the round-trip latency once per batch rather than once per
+operation. Responses are matched to requests by their order, so a process
+which answers out of turn or stops answering is killed and another started.
+
+baton's metamod adds or removes AVUs but can't do both at once, so unlike
+python-irodsclient's atomic operations an object's changes are two
+operations, sent together."""
+
+import json
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime, timezone
+
+import irods.exception
+
+import core.irods_wrapper as irods_wrapper
+import core.metrics as metrics
+from core.backend import Backend
+
+DEFAULT_COMMAND = ('baton-do', '--unbuffered')
+
+# Collections listed at once while walking a tree
+WALK_BATCH = 32
+
+# iRODS error codes baton reports for a path which doesn't exist
+# (USER_FILE_DOES_NOT_EXIST, CAT_NO_ROWS_FOUND)
+MISSING_CODES = (-310000, -808000)
+
+# Seconds to wait for baton-do to exit once its input is closed
+EXIT_TIMEOUT = 10
+
+# Seconds to wait for the answers to a batch of requests before giving up
+# on baton-do and restarting it. Listing a big collection with its AVUs is the slowest operation.
+RESPONSE_TIMEOUT = 600
+
+# Objects applied at once by each execution process unless --in_flight is
+# given. Each has its operations outstanding on the one connection, so a
+# deep window is what overlaps their round-trips.
+DEFAULT_IN_FLIGHT = 64
+
+
+class BatonError(Exception):
+    """baton-do reported an error, or stopped answering.
+
+    @param code: The iRODS error code, if baton gave one"""
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+class _Process:
+    # A running baton-do and the requests waiting for its answers
+    def __init__(self, command):
+        self.popen = subprocess.Popen(command, stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, encoding='UTF-8')
+        self.pending = deque()
+        self.closed = False
+
+
+class BatonClient:
+    """Sends operations to a baton-do process, starting it on first use and
+    again if it exits, stops answering, or answers out of turn. It is safe
+    to share between threads.
+
+    @param command: baton-do command line
+    @param timeout: Seconds to wait for the answers to each batch of
+        requests"""
+
+    def __init__(self, command=DEFAULT_COMMAND, timeout=RESPONSE_TIMEOUT):
+        self.command = list(command)
+        self.timeout = timeout
+        self.starts = 0
+        self._process = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        process = _Process(self.command)
+        self.starts += 1
+        threading.Thread(target=self._read, args=(process,),
+            daemon=True).start()
+        return process
+
+    def _read(self, process):
+        # Answers come back in the order requests were written
+        error = None
+        try:
+            for line in process.popen.stdout:
+                with self._lock:
+                    future = process.pending.popleft() if process.pending \
+                        else None
+                if future is None:
+                    # Nothing was waiting for this, so later answers can't
+                    # be trusted to match their requests either
+                    error = BatonError("Unexpected output from {}: {}".format(
+                        self.command[0], line.strip()[:200]))
+                    break
+                try:
+                    future.set_result(json.loads(line))
+                except ValueError as e:
+                    future.set_exception(BatonError("Invalid response from "
+                        "{}: {}".format(self.command[0], e)))
+        except (OSError, ValueError) as e:
+            error = BatonError("Can't read from {}: {}".format(
+                self.command[0], e))
+        finally:
+            if error is not None:
+                self._abandon(process)
+            status = process.popen.wait()
+            with self._lock:
+                process.closed = True
+                error = error or BatonError("{} exited with status {}".format(
+                    self.command[0], status))
+                while process.pending:
+                    process.pending.popleft().set_exception(error)
+
+    def _abandon(self, process):
+        """Stop using a process, which is killed, so the next request
+        starts another. Its reader fails any requests still waiting."""
+        with self._lock:
+            process.closed = True
+            if self._process is process:
+                self._process = None
+        process.popen.kill()
+
+    def submit(self, requests):
+        """Write a batch of requests without waiting for their answers.
+
+        @param requests: List of (operation, target, arguments) tuples
+        @return: List of Futures of the raw responses, in the same order"""
+
+        futures = [Future() for _ in requests]
+        with self._lock:
+            if self._process is None or self._process.closed:
+                self._process = self._start()
+            process = self._process
+            process.pending.extend(futures)
+            try:
+                for operation, target, arguments in requests:
+                    process.popen.stdin.write(json.dumps({
+                        'operation': operation, 'arguments': arguments or {},
+                        'target': target}, separators=(',', ':')) + '\n')
+                process.popen.stdin.flush()
+            except OSError as e:
+                # The reader fails anything still pending once it sees the
+                # process has gone
+                raise BatonError("Can't write to {}: {}".format(
+                    self.command[0], e))
+        return futures
+
+    def result(self, future, deadline=None):
+        """Wait for a response and unwrap its result. If none comes by the
+        deadline, baton-do is restarted.
+
+        @param deadline: time.monotonic() by which the response must come.
+            Defaults to the client's timeout from now
+        @raise BatonError: If the operation failed or timed out"""
+
+        if deadline is None:
+            deadline = time.monotonic() + self.timeout
+        try:
+            response = future.result(max(0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            with self._lock:
+                process = self._process
+                hung = process is not None and future in process.pending
+            if hung:
+                self._abandon(process)
+            raise BatonError("No response from {} in {} seconds".format(
+                self.command[0], self.timeout))
+        if 'error' in response:
+            error = response['error']
+            raise BatonError(error.get('message', "Unknown error"),
+                error.get('code'))
+        result = response.get('result', {})
+        if 'single' in result:
+            return result['single']
+        return result.get('multiple', result)
+
+    def call_all(self, requests):
+        """Send a batch of requests and wait for every answer. The batch
+        counts as one operation against the throttle.
+
+        @param requests: List of (operation, target, arguments) tuples
+        @return: List of results, or of the BatonError each failed with"""
+
+        results = []
+        with irods_wrapper.throttled():
+            futures = self.submit(requests)
+            # One deadline for the whole batch, so answers trickling in can't
+            # hold it for a timeout each
+            deadline = time.monotonic() + self.timeout
+            for future in futures:
+                try:
+                    results.append(self.result(future, deadline))
+                except BatonError as e:
+                    results.append(e)
+        return results
+
+    def call(self, operation, target, arguments=None):
+        """Send one request and return its result.
+
+        @raise BatonError: If the operation failed"""
+
+        result = self.call_all([(operation, target, arguments)])[0]
+        if isinstance(result, BatonError):
+            raise result
+        return result
+
+    def close(self):
+        with self._lock:
+            process, self._process = self._process, None
+        if process is None:
+            return
+        process.popen.stdin.close()
+        try:
+            process.popen.wait(EXIT_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            process.popen.kill()
+            process.popen.wait()
+
+
+def _target(path, is_collection):
+    if is_collection:
+        return {'collection': path}
+    collection, name = path.rsplit('/', 1)
+    return {'collection': collection or '/', 'data_object': name}
+
+
+def _path(item):
+    if 'data_object' in item:
+        return item['collection'].rstrip('/') + '/' + item['data_object']
+    return item['collection']
+
+
+def _avus(item):
+    return [(avu['attribute'], avu['value'], avu.get('units') or None)
+        for avu in item.get('avus', [])]
+
+
+def _modified(item):
+    """Returns when an item was last modified, from baton's timestamps, as a
+    UTC datetime. Data objects have one per replica, and the latest wins."""
+    times = [datetime.fromisoformat(stamp['modified'].replace('Z', '+00:00'))
+        for stamp in item.get('timestamps', []) if 'modified' in stamp]
+    times = [time if time.tzinfo else time.replace(tzinfo=timezone.utc)
+        for time in times]
+    return max(times, default=None)
+
+
+def _modified_since(item, since):
+    # Without timestamps, an item is listed rather than missed
+    modified = _modified(item)
+    return since is None or modified is None or modified >= since
+
+
+class BatonBackend(Backend):
+    """Backend sending every operation to one persistent baton-do process.
+
+    @param command: baton-do command line
+    @param timeout: Seconds to wait for the answers to each batch of
+        requests"""
+
+    in_flight = DEFAULT_IN_FLIGHT
+
+    def __init__(self, command=DEFAULT_COMMAND, timeout=RESPONSE_TIMEOUT):
+        self.client = BatonClient(command, timeout)
+
+    def _list(self, targets, **arguments):
+        return self.client.call_all([('list', target, arguments)
+            for target in targets])
+
+    def iter_catalogue(self, path, include_collections=False, walk=False,
+            since=None):
+        """Walks the tree WALK_BATCH collections at a time, with the contents
+        of each batch listed in one go. baton has no recursive listing, so
+        'walk' makes no difference."""
+
+        path = path.rstrip('/')
+        arguments = {'contents': True}
+        if since is not None:
+            arguments['timestamp'] = True
+
+        collections = [path]
+        collection_paths = []
+        while collections:
+            batch = collections[-WALK_BATCH:]
+            del collections[-WALK_BATCH:]
+            with metrics.CATALOGUE_PAGE_SECONDS.time():
+                listings = self._list([{'collection': collection}
+                    for collection in batch], **arguments)
+            for collection, listing in zip(batch, listings):
+                if isinstance(listing, BatonError):
+                    if collection == path and listing.code in MISSING_CODES:
+                        raise irods.exception.CollectionDoesNotExist(path)
+                    raise listing
+                if include_collections and _modified_since(listing, since):
+                    collection_paths.append(collection)
+                for item in listing.get('contents', []):
+                    if 'data_object' not in item:
+                        collections.append(item['collection'])
+                    elif _modified_since(item, since):
+                        metrics.CATALOGUE_PATHS.inc()
+                        yield (_path(item), False)
+
+        for collection_path in collection_paths:
+            metrics.CATALOGUE_PATHS.inc()
+            yield (collection_path, True)
+
+    def query_metadata(self, collection, names=None, is_collection=False):
+        """Lists the collection's contents with their AVUs, or, given names,
+        each of those objects, all sent at once."""
+
+        collection = collection.rstrip('/') or '/'
+        with metrics.METADATA_READ_SECONDS.time():
+            if names is None:
+                listing = self._list([{'collection': collection}],
+                    contents=True, avu=True)[0]
+                if isinstance(listing, BatonError):
+                    raise listing
+                items = [item for item in listing.get('contents', [])
+                    if ('data_object' in item) != is_collection]
+            else:
+                items = []
+                for listing in self._list([_target(collection.rstrip('/') +
+                        '/' + name, is_collection) for name in names],
+                        avu=True):
+                    if isinstance(listing, BatonError):
+                        # Like a GenQuery, a missing object just isn't there
+                        if listing.code in MISSING_CODES:
+                            continue
+                        raise listing
+                    items.append(listing)
+
+        return {_path(item): _avus(item) for item in items if _avus(item)}
+
+    def apply_metadata(self, path, to_add, to_remove, is_collection=False):
+        """Sends the removals and additions together. They are applied in
+        that order, but aren't atomic: if the additions fail, the removals
+        have still been made. Each call waits for its own answers, so writes
+        are only pipelined across calls from several threads, which the
+        executor makes DEFAULT_IN_FLIGHT of at once by default."""
+
+        requests = []
+        for operation, avus in (('rem', to_remove), ('add', to_add)):
+            if avus:
+                target = _target(path, is_collection)
+                target['avus'] = [dict({'attribute': attribute,
+                    'value': value}, **({'units': units} if units else {}))
+                    for attribute, value, units in avus]
+                requests.append(('metamod', target,
+                    {'operation': operation}))
+        if not requests:
+            return
+
+        with metrics.METADATA_WRITE_SECONDS.time():
+            for result in self.client.call_all(requests):
+                if isinstance(result, BatonError):
+                    raise result
+
+    def cleanup(self):
+        self.client.close()
@@ -0,0 +1,311 @@
+"""A compact on-disk copy of a catalogue listing, so a resumed or repeated run
+can start from it in seconds instead of listing the whole tree again.
+
+The file is written in one pass while the listing streams in, and read back
+through mmap. 'spool_snapshot' writes it on a thread of its own, ahead of
+whatever consumes the listing:
+
+    header      MAGIC, then <QQQQ: collection count, entry count, offset of
+                the collection table, offset of the entries. Then <H (root
+                length) and the root collection listed
+    entries     One per listed path, in listing order: <IHH (collection
+                index, length of the prefix shared with the previous data
+                object name in that collection, length of the rest of the
+                name), then the rest of the name. Collections themselves are
+                entries with a shared length of COLLECTION_ENTRY and no name
+    collections Every collection path once, in the order first listed, each
+                front-coded against the previous one: <HH (shared prefix
+                length, suffix length), then the suffix
+
+Paths are UTF-8. The header is only filled in once the listing completes, so
+an interrupted snapshot is never mistaken for a complete one."""
+
+import mmap
+import os
+import struct
+import threading
+
+MAGIC = b'ASCSNAP1'
+_HEADER = struct.Struct('<QQQQ')
+_ENTRY = struct.Struct('<IHH')
+_FRONT = struct.Struct('<HH')
+_ROOT = struct.Struct('<H')
+COLLECTION_ENTRY = 0xFFFF
+
+
+class SnapshotError(Exception):
+    """The file isn't a complete catalogue snapshot."""
+
+
+def _shared_prefix(a, b):
+    limit = min(len(a), len(b), COLLECTION_ENTRY - 1)
+    index = 0
+    while index < limit and a[index] == b[index]:
+        index += 1
+    return index
+
+
+class _SnapshotWriter:
+    """Encodes entries into a snapshot file as they're added, and fills in
+    the collection table and header once they all have been. 'paths' and
+    'end' (the offset after the last entry added) may be read by another
+    thread while it holds 'condition'."""
+
+    def __init__(self, partial, root):
+        self.file = open(partial, 'wb')
+        root = root.encode('UTF-8')
+        self.file.write(MAGIC + _HEADER.pack(0, 0, 0, 0))
+        self.file.write(_ROOT.pack(len(root)) + root)
+        self.entries_offset = self.end = self.file.tell()
+        self.count = 0
+        self.collections = {} # collection path -> index
+        self.paths = [] # collection paths, by index
+        self.last_names = {} # collection index -> last data object name
+        self.condition = threading.Condition()
+        self.waiting = False
+
+    def add(self, entry):
+        entry_path, is_collection = entry
+        if is_collection:
+            collection, name = entry_path.rstrip('/') or '/', b''
+        else:
+            collection, name = entry_path.rsplit('/', 1)
+            collection = collection or '/'
+            name = name.encode('UTF-8')
+
+        index = self.collections.get(collection)
+        if index is None:
+            index = self.collections[collection] = len(self.paths)
+            self.paths.append(collection)
+
+        if is_collection:
+            record = _ENTRY.pack(index, COLLECTION_ENTRY, 0)
+        else:
+            shared = _shared_prefix(self.last_names.get(index, b''), name)
+            record = _ENTRY.pack(index, shared, len(name) - shared) + \
+                name[shared:]
+            self.last_names[index] = name
+        self.file.write(record)
+        with self.condition:
+            self.count += 1
+            self.end += len(record)
+            if self.waiting:
+                self.condition.notify_all()
+
+    def finish(self):
+        collections_offset = self.end
+        previous = b''
+        for collection in self.paths:
+            encoded = collection.encode('UTF-8')
+            shared = _shared_prefix(previous, encoded)
+            self.file.write(_FRONT.pack(shared, len(encoded) - shared))
+            self.file.write(encoded[shared:])
+            previous = encoded
+
+        self.file.seek(len(MAGIC))
+        self.file.write(_HEADER.pack(len(self.paths), self.count,
+            collections_offset, self.entries_offset))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+
+def _decode(data, paths, last_names):
+    """Decode a run of whole entries, given the collection paths so far and
+    the last data object name of each collection, which is updated."""
+    offset = 0
+    unpack = _ENTRY.unpack_from
+    while offset < len(data):
+        index, shared, length = unpack(data, offset)
+        offset += _ENTRY.size
+        if shared == COLLECTION_ENTRY:
+            yield (paths[index], True)
+            continue
+        name = last_names.get(index, b'')[:shared] + \
+            data[offset:offset + length]
+        offset += length
+        last_names[index] = name
+        yield (paths[index].rstrip('/') + '/' + name.decode('UTF-8'), False)
+
+
+def write_snapshot(entries, path, root=''):
+    """Pass catalogue entries through unchanged while writing them to a
+    snapshot. The snapshot is only moved into place once every entry has
+    been consumed.
+
+    @param entries: Iterable of (iRODS path, is collection) tuples, such as
+        'irods_wrapper.iter_irods_catalogue'
+    @param path: Path to write the snapshot to
+    @param root: The root collection being listed
+    @return: The same entries, as a generator"""
+
+    partial = path + '.partial'
+    writer = _SnapshotWriter(partial, root)
+    complete = False
+    try:
+        for entry in entries:
+            writer.add(entry)
+            yield entry
+        writer.finish()
+        complete = True
+    finally:
+        _close(writer, partial, path, complete)
+
+
+def spool_snapshot(entries, path, root=''):
+    """Drain catalogue entries into a snapshot on a thread of its own, and
+    read them back from the file as they're consumed. The listing runs at
+    its own pace however slowly the entries are consumed, without holding
+    them in memory, and the snapshot is moved into place as soon as it
+    ends. A run which fails after that can be resumed from the snapshot.
+
+    If the entries are no longer consumed before the listing ends, the
+    listing is stopped and no snapshot is left.
+
+    @param entries: Iterable of (iRODS path, is collection) tuples, such as
+        'irods_wrapper.iter_irods_catalogue'
+    @param path: Path to write the snapshot to
+    @param root: The root collection being listed
+    @return: The same entries, in order, as a generator"""
+
+    partial = path + '.partial'
+    writer = _SnapshotWriter(partial, root)
+    state = {'finished': False, 'error': None, 'stop': False}
+
+    def drain():
+        complete = False
+        try:
+            for entry in entries:
+                if state['stop']:
+                    return
+                writer.add(entry)
+            writer.finish()
+            complete = True
+        except BaseException as e:
+            state['error'] = e
+        finally:
+            if hasattr(entries, 'close'):
+                entries.close()
+            # The reader flushes the file while holding the condition, so
+            # it's only closed while holding it too
+            with writer.condition:
+                writer.file.close()
+                state['finished'] = True
+                writer.condition.notify_all()
+            _close(writer, partial, path, complete)
+
+    reader = open(partial, 'rb')
+    reader.seek(writer.entries_offset)
+    thread = threading.Thread(target=drain, daemon=True)
+    thread.start()
+    try:
+        offset = writer.entries_offset
+        last_names = {}
+        while True:
+            with writer.condition:
+                while writer.end == offset and not state['finished']:
+                    writer.waiting = True
+                    writer.condition.wait()
+                writer.waiting = False
+                end = writer.end
+                paths = writer.paths
+                if not state['finished']:
+                    # Entries added since the writer last flushed
+                    writer.file.flush()
+            if end == offset:
+                break
+            yield from _decode(reader.read(end - offset), paths, last_names)
+            offset = end
+        if state['error'] is not None:
+            raise state['error']
+    finally:
+        state['stop'] = True
+        thread.join()
+        reader.close()
+
+
+def _close(writer, partial, path, complete):
+    writer.file.close()
+    if complete:
+        os.replace(partial, path)
+    elif os.path.exists(partial):
+        os.remove(partial)
+
+
+class CatalogueSnapshot:
+    """A catalogue snapshot opened with mmap. Iterating over it gives the
+    same (iRODS path, is collection) tuples, in the same order, as the
+    listing it was written from. Only the collection table is decoded up
+    front; entries are decoded as they are iterated over. 'root' is the
+    collection that was listed.
+
+    @param path: Path to the snapshot
+    @raise SnapshotError: If the file is missing, incomplete or not a
+        snapshot"""
+
+    def __init__(self, path):
+        try:
+            with open(path, 'rb') as file:
+                self._map = mmap.mmap(file.fileno(), 0,
+                    access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise SnapshotError("Can't open catalogue snapshot {}: {}"
+                .format(path, e))
+
+        if self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise SnapshotError("{} isn't a catalogue snapshot".format(path))
+        self.collection_count, self.entry_count, self._collections_offset, \
+            self._entries_offset = _HEADER.unpack_from(self._map, len(MAGIC))
+        if self._entries_offset == 0:
+            self.close()
+            raise SnapshotError("Catalogue snapshot {} is incomplete"
+                .format(path))
+
+        offset = len(MAGIC) + _HEADER.size
+        length = _ROOT.unpack_from(self._map, offset)[0]
+        offset += _ROOT.size
+        self.root = self._map[offset:offset + length].decode('UTF-8')
+        self.collections = self._read_collections()
+
+    def _read_collections(self):
+        collections = []
+        offset = self._collections_offset
+        previous = b''
+        for _ in range(self.collection_count):
+            shared, length = _FRONT.unpack_from(self._map, offset)
+            offset += _FRONT.size
+            previous = previous[:shared] + self._map[offset:offset + length]
+            offset += length
+            collections.append(previous.decode('UTF-8'))
+        return collections
+
+    def __len__(self):
+        return self.entry_count
+
+    def __iter__(self):
+        data = self._map
+        collections = self.collections
+        last_names = {}
+        offset = self._entries_offset
+        unpack = _ENTRY.unpack_from
+        for _ in range(self.entry_count):
+            index, shared, length = unpack(data, offset)
+            offset += _ENTRY.size
+            if shared == COLLECTION_ENTRY:
+                yield (collections[index], True)
+                continue
+            name = last_names.get(index, b'')[:shared] + \
+                data[offset:offset + length]
+            offset += length
+            last_names[index] = name
+            yield (collections[index].rstrip('/') + '/' +
+                name.decode('UTF-8'), False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._map.close()
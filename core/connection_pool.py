@@ -0,0 +1,152 @@
+"""A managed pool of iRODS connections, so every stage of a run in one
+process (listing the catalogue, reading headers and applying metadata) can
+share a single iRODSSession and reuse its connections, instead of each
+opening its own and paying for another SSL handshake.
+
+python-irodsclient already keeps a session's idle connections for reuse.
+ConnectionPool replaces a session's pool with one which also:
+* caps the connections open at once at 'size'. Beyond that, an operation
+  waits up to 'wait' seconds for a free connection, then opens one anyway,
+  since a thread already holding a connection (such as an open file) could
+  otherwise wait on itself;
+* turns on TCP keepalive, so idle connections aren't silently dropped by
+  firewalls between runs of activity;
+* checks an idle connection is still healthy before reusing it, and opens a
+  new one in its place if the server has closed it. Connections which fail
+  during an operation are already closed by python-irodsclient, so the next
+  operation reconnects;
+* reports its use in core.metrics."""
+
+import select
+import socket
+import threading
+import time
+import weakref
+
+from irods.pool import Pool
+
+import core.metrics as metrics
+
+DEFAULT_SIZE = 16
+DEFAULT_KEEPALIVE = 60
+DEFAULT_WAIT = 5
+
+
+def _set_keepalive(sock, idle):
+    """Start TCP keepalive probes after 'idle' seconds without traffic."""
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE,
+                max(1, int(idle)))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL,
+                max(1, int(idle) // 4))
+    except OSError:
+        # Not every socket or platform supports the TCP options
+        pass
+
+
+def _healthy(conn):
+    """An idle connection has nothing to read, so if its socket is readable
+    the server has closed it, or sent something no request is waiting for.
+    This costs a system call rather than a round-trip."""
+    try:
+        readable, _, _ = select.select([conn.socket], [], [], 0)
+    except (OSError, ValueError, AttributeError):
+        return False
+    return not readable
+
+
+def _count(pool, with_idle):
+    if pool is None:
+        return 0
+    return len(pool.active) + (len(pool.idle) if with_idle else 0)
+
+
+class ConnectionPool(Pool):
+    """python-irodsclient connection pool with a size limit, keepalive and
+    health checks. Use 'install' to give a session one.
+
+    @param size: Maximum connections open at once, short of overflowing
+    @param keepalive: Seconds a connection is idle before keepalive probes
+        are sent. 0 leaves the system default
+    @param wait: Seconds to wait for a free connection before opening one
+        beyond 'size'"""
+
+    def __init__(self, account, application_name='',
+            connection_refresh_time=-1, session=None, size=DEFAULT_SIZE,
+            keepalive=DEFAULT_KEEPALIVE, wait=DEFAULT_WAIT):
+        super().__init__(account, application_name, connection_refresh_time,
+            session)
+        self.size = size
+        self.keepalive = keepalive
+        self.wait = wait
+        self._slots = threading.BoundedSemaphore(size)
+        self._known = weakref.WeakSet()
+        self._overflow = weakref.WeakSet()
+
+        # The gauges mustn't keep a discarded pool alive
+        pool = weakref.ref(self)
+        metrics.POOL_CONNECTIONS.set_function(lambda: _count(pool(), True))
+        metrics.POOL_CONNECTIONS_IN_USE.set_function(lambda: _count(pool(),
+            False))
+
+    @classmethod
+    def install(cls, session, **options):
+        """Replace a session's connection pool with a ConnectionPool. This
+        must be done before the session opens any connection.
+
+        @param session: iRODSSession object
+        @param options: 'size', 'keepalive' and 'wait'
+        @return: The session"""
+
+        old = session.pool
+        pool = cls(old.account, old.application_name,
+            old.connection_refresh_time or -1, session, **options)
+        pool.connection_timeout = old.connection_timeout
+        session.pool = pool
+        return session
+
+    def get_connection(self):
+        start = time.monotonic()
+        slot = self._slots.acquire(timeout=self.wait)
+        metrics.POOL_WAIT_SECONDS.observe(time.monotonic() - start)
+        if not slot:
+            metrics.POOL_OVERFLOWS.inc()
+
+        try:
+            while True:
+                conn = super().get_connection()
+                if conn not in self._known:
+                    self._known.add(conn)
+                    metrics.POOL_CONNECTIONS_OPENED.inc()
+                    if self.keepalive:
+                        _set_keepalive(conn.socket, self.keepalive)
+                    break
+                if _healthy(conn):
+                    break
+                # Bypasses this pool's release, which would give up the slot
+                metrics.POOL_CONNECTIONS_DROPPED.inc()
+                super().release_connection(conn, destroy=True)
+                conn.disconnect()
+        except BaseException:
+            if slot:
+                self._slots.release()
+            raise
+
+        if not slot:
+            self._overflow.add(conn)
+        return conn
+
+    def release_connection(self, conn, destroy=False):
+        with self._lock:
+            was_active = conn in self.active
+        super().release_connection(conn, destroy)
+        if not was_active:
+            return
+        if destroy:
+            metrics.POOL_CONNECTIONS_DROPPED.inc()
+        if conn in self._overflow:
+            self._overflow.discard(conn)
+        else:
+            self._slots.release()
@@ -1,71 +1,397 @@
 import ssl
 
 import irods.exception
+from irods.column import In, Like
+from irods.meta import AVUOperation, iRODSMeta
+from irods.models import Collection, CollectionMeta, DataObject, \
+    DataObjectMeta
 from irods.session import iRODSSession
 
 from config import ENV_FILE
+import core.logger as logger
+import core.metrics as metrics
+from core.connection_pool import ConnectionPool
+from core.throttle import Throttle
+
+# The iCAT caps a GenQuery page at MAX_SQL_ROWS (256) rows, so asking for
+# more only helps against servers configured with a larger limit.
+CATALOGUE_PAGE_SIZE = 256
+
+# Errors which suggest the server is overloaded, rather than a problem with
+# the request itself. Adaptive throttling backs off when it sees these.
+OVERLOAD_ERRORS = (irods.exception.NetworkException, OSError)
+
+_throttle = Throttle(error_types=OVERLOAD_ERRORS)
+
+log = logger.get_logger('iRODS')
+
+# Options of the ConnectionPool each new session is given
+_pool_options = {}
+
+
+def set_throttle(throttle):
+    """Sets the Throttle every iRODS call made through this module (and
+    'throttled()' blocks elsewhere) goes through. The default doesn't limit
+    anything."""
+    global _throttle
+    _throttle = throttle
+
+
+def get_throttle():
+    return _throttle
+
+
+def set_pool_options(**options):
+    """Sets the 'size', 'keepalive' and 'wait' of the connection pool of
+    every session 'create_session' creates from now on. See
+    core.connection_pool for what they mean."""
+    global _pool_options
+    _pool_options = options
+
+
+def get_pool_options():
+    return dict(_pool_options)
+
+
+def throttled():
+    """Context manager to wrap around an iRODS call made outside of this
+    module, such as a samtools subprocess reading from iRODS."""
+    return _throttle.request()
+
+
+def _results(query, histogram=None):
+    """Iterate over the rows of a GenQuery, throttling each page fetch, and
+    timing each one with 'histogram' if given."""
+    pages = query.get_batches()
+    while True:
+        with _throttle.request():
+            if histogram is None:
+                page = next(pages, None)
+            else:
+                with histogram.time():
+                    page = next(pages, None)
+        if page is None:
+            return
+        yield from page
+
 
 def create_session():
-    """Returns an iRODSSession object."""
+    """Returns an iRODSSession object, whose connections are managed by a
+    ConnectionPool. A session is safe to share between threads, so one
+    session can serve every stage of a run."""
 
     ssl_settings = {'ssl_context':
         ssl.create_default_context(purpose=ssl.Purpose.SERVER_AUTH)}
 
-    return iRODSSession(irods_env_file=ENV_FILE, **ssl_settings)
+    return ConnectionPool.install(iRODSSession(irods_env_file=ENV_FILE,
+        **ssl_settings), **_pool_options)
 
 def get_metadata(session, filepath, is_collection = False):
 
+    with _throttle.request():
+        if is_collection:
+            obj = session.collections.get(filepath)
+        else:
+            obj = session.data_objects.get(filepath)
+    return obj.metadata
+
+
+def _model(is_collection):
+    return Collection if is_collection else DataObject
+
+
+def add_metadata(session, path, avus, is_collection=False):
+    """Adds (attribute, value, units) AVUs to an object by path, without
+    fetching the object first."""
+
+    for attribute, value, units in avus:
+        with _throttle.request():
+            session.metadata.add(_model(is_collection), path,
+                iRODSMeta(attribute, value, units))
+
+
+def remove_metadata(session, path, avus, is_collection=False):
+    """Removes (attribute, value, units) AVUs from an object by path, without
+    fetching the object first."""
+
+    for attribute, value, units in avus:
+        with _throttle.request():
+            session.metadata.remove(_model(is_collection), path,
+                iRODSMeta(attribute, value, units))
+
+
+def apply_metadata(session, path, to_add, to_remove, is_collection=False):
+    """Applies a whole AVU diff to one object in a single atomic metadata
+    operation, so either every change lands or none do. Removals are applied
+    before additions. Servers older than iRODS 4.2.8 have no atomic metadata
+    API, in which case the changes are made one call at a time instead.
+
+    @param session: iRODSSession object
+    @param path: iRODS path of the object
+    @param to_add: List of (attribute, value, units) tuples to add
+    @param to_remove: List of (attribute, value, units) tuples to remove
+    @param is_collection: True if the path is a collection"""
+
+    if not to_add and not to_remove:
+        return
+
+    operations = [AVUOperation(operation='remove', avu=iRODSMeta(*avu))
+        for avu in to_remove]
+    operations.extend(AVUOperation(operation='add', avu=iRODSMeta(*avu))
+        for avu in to_add)
+
+    with metrics.METADATA_WRITE_SECONDS.time():
+        try:
+            with _throttle.request():
+                session.metadata.apply_atomic_operations(
+                    _model(is_collection), path, *operations)
+        except irods.exception.SYS_UNMATCHED_API_NUM:
+            remove_metadata(session, path, to_remove, is_collection)
+            add_metadata(session, path, to_add, is_collection)
+
+
+def query_metadata(session, collection, names=None, is_collection=False,
+        page_size=CATALOGUE_PAGE_SIZE):
+    """Fetches the AVUs of every data object directly in a collection, or of
+    every subcollection directly under it, with a single paged GenQuery on
+    META_DATA_ATTR_NAME/VALUE/UNITS.
+
+    @param session: iRODSSession object
+    @param collection: iRODS path of the parent collection
+    @param names: Optional list of data object or subcollection names to
+        restrict the query to
+    @param is_collection: If True, fetch subcollection AVUs instead of data
+        object AVUs
+    @param page_size: Number of rows requested per GenQuery page
+    @return: Dictionary of {iRODS path: [(attribute, value, units), ...]}.
+        Objects without AVUs are absent."""
+
     if is_collection:
-        obj = session.collections.get(filepath)
+        query = session.query(Collection.name, CollectionMeta.name,
+            CollectionMeta.value, CollectionMeta.units).filter(
+            Collection.parent_name == collection)
+        if names is not None:
+            query = query.filter(In(Collection.name,
+                [collection.rstrip('/') + '/' + name for name in names]))
+        model = CollectionMeta
     else:
-        obj = session.data_objects.get(filepath)
-    return obj.metadata
+        query = session.query(DataObject.name, DataObjectMeta.name,
+            DataObjectMeta.value, DataObjectMeta.units).filter(
+            Collection.name == collection)
+        if names is not None:
+            query = query.filter(In(DataObject.name, list(names)))
+        model = DataObjectMeta
 
+    metadata = {}
+    for row in _results(query.limit(page_size),
+            metrics.METADATA_READ_SECONDS):
+        if is_collection:
+            path = row[Collection.name]
+        else:
+            path = collection.rstrip('/') + '/' + row[DataObject.name]
+        metadata.setdefault(path, []).append((row[model.name],
+            row[model.value], row[model.units] or None))
 
-def get_irods_catalogue(path):
-    """Returns a dictionary of lists, {'objects': [], 'collections': []},
-    which contains the iRODS path of every object and subcollection in
-    the given path.
+    return metadata
+
+
+def query_fingerprints(session, collection, names=None,
+        page_size=CATALOGUE_PAGE_SIZE):
+    """Fetches the checksum, size and modify time of every data object
+    directly in a collection with a single paged GenQuery. Together these
+    identify a version of a file's content without reading it.
+
+    @param session: iRODSSession object
+    @param collection: iRODS path of the parent collection
+    @param names: Optional list of data object names to restrict the query to
+    @param page_size: Number of rows requested per GenQuery page
+    @return: Dictionary of {iRODS path: (checksum, size, modify time)}. The
+        checksum is '' if none has been computed, and the modify time is an
+        ISO 8601 string. If replicas differ, the newest one is used."""
+
+    query = session.query(DataObject.name, DataObject.checksum,
+        DataObject.size, DataObject.modify_time).filter(
+        Collection.name == collection)
+    if names is not None:
+        query = query.filter(In(DataObject.name, list(names)))
+
+    fingerprints = {}
+    for row in _results(query.limit(page_size)):
+        path = collection.rstrip('/') + '/' + row[DataObject.name]
+        fingerprint = (row[DataObject.checksum] or '',
+            int(row[DataObject.size]), row[DataObject.modify_time].isoformat())
+        if path not in fingerprints or fingerprint[2] > fingerprints[path][2]:
+            fingerprints[path] = fingerprint
+
+    return fingerprints
+
+
+def _walk_catalogue(coll, include_collections=False, since=None):
+    """Lists a collection tree by recursively calling 'subcollections' and
+    'data_objects' on every collection. This costs several round-trips per
+    collection, but works against any server.
+
+    @param coll: Root iRODSCollection object
+    @param include_collections: If True, collection paths are yielded after
+        every data object path
+    @param since: If given, only list objects modified at or after this
+        datetime. The whole tree is still walked
+    @return: (iRODS path, is collection) tuples, as a generator"""
+
+    coll_buffer = [coll]
+    collection_paths = []
+
+    while len(coll_buffer) != 0:
+        coll = coll_buffer.pop()
+        if include_collections and (since is None or
+                coll.modify_time >= since):
+            collection_paths.append(coll.path)
+        with _throttle.request(), metrics.CATALOGUE_PAGE_SECONDS.time():
+            data_objects = coll.data_objects
+        for obj in data_objects:
+            if since is None or obj.modify_time >= since:
+                yield (obj.path, False)
+        with _throttle.request(), metrics.CATALOGUE_PAGE_SECONDS.time():
+            coll_buffer.extend(coll.subcollections)
+
+    for collection_path in collection_paths:
+        yield (collection_path, True)
+
+
+def _tree_criteria(path):
+    """Returns GenQuery criteria matching the collection 'path' and every
+    collection beneath it. GenQuery can't OR two conditions together, so
+    each one has to be issued as a separate query."""
+
+    # '_' and '%' in the path are LIKE wildcards, so the LIKE query can
+    # return collections which aren't under 'path'. Callers filter those out.
+    return [Collection.name == path, Like(Collection.name, path + '/%')]
+
+
+def _in_tree(collection, path):
+    return collection == path or collection.startswith(path + '/')
 
-    @param path: Root iRODS path string
-    @return: Dictionary with two lists, 'objects' and 'collections'"""
 
-    coll_buffer = []
-    objects = []
-    collections = []
+def _query_catalogue(session, path, include_collections=False,
+        page_size=CATALOGUE_PAGE_SIZE, since=None):
+    """Lists a collection tree with paged GenQueries joining COLL_NAME and
+    DATA_NAME. Only path strings are built, and the whole listing costs one
+    round-trip per page instead of several per collection. Paths are yielded
+    as each page arrives, so memory use is bounded by the page size.
+
+    @param session: iRODSSession object
+    @param path: Root iRODS path string, without a trailing slash
+    @param include_collections: If True, collection paths are yielded after
+        every data object path
+    @param page_size: Number of rows requested per GenQuery page
+    @param since: If given, only list objects modified at or after this
+        datetime, with a condition on DATA_MODIFY_TIME (or COLL_MODIFY_TIME)
+    @return: (iRODS path, is collection) tuples, as a generator"""
+
+    for criterion in _tree_criteria(path):
+        query = session.query(Collection.name, DataObject.name) \
+            .filter(criterion).limit(page_size)
+        if since is not None:
+            # A data object's modify time is set when it is created, so this
+            # also finds new objects
+            query = query.filter(DataObject.modify_time >= since)
+        for row in _results(query, metrics.CATALOGUE_PAGE_SECONDS):
+            if _in_tree(row[Collection.name], path):
+                yield (row[Collection.name] + '/' + row[DataObject.name],
+                    False)
+
+    if not include_collections:
+        return
+
+    for criterion in _tree_criteria(path):
+        query = session.query(Collection.name).filter(criterion) \
+            .limit(page_size)
+        if since is not None:
+            query = query.filter(Collection.modify_time >= since)
+        for row in _results(query, metrics.CATALOGUE_PAGE_SECONDS):
+            if _in_tree(row[Collection.name], path):
+                yield (row[Collection.name], True)
+
+
+def iter_irods_catalogue(path, session=None, include_collections=False,
+        walk=False, since=None):
+    """Yields the iRODS path of every data object (and, optionally, every
+    collection) under the given path as soon as it is listed, so callers can
+    start work before the listing finishes.
+
+    The listing is done with paged GenQueries. If the server rejects the
+    first query, or 'walk' is True, the tree is walked collection by
+    collection instead.
+
+    @param path: Root iRODS path string
+    @param session: iRODSSession object. A new session is created and
+        cleaned up if one isn't provided
+    @param include_collections: If True, collection paths are yielded after
+        every data object path
+    @param walk: If True, always use the collection walker
+    @param since: If given, only list objects created or modified at or
+        after this timezone-aware datetime
+    @return: (iRODS path, is collection) tuples, as a generator
+    @raise irods.exception.CollectionDoesNotExist: If the root is missing"""
 
     # session.collections.get fails if there's a trailing slash in the path
     path = path.rstrip("/")
 
-    with create_session() as session:
-        try:
+    owns_session = session is None
+    if owns_session:
+        session = create_session()
+
+    try:
+        with _throttle.request():
             coll = session.collections.get(path)
-        except irods.exception.CollectionDoesNotExist:
-            print("Error! Collection {} not found!".format(path),
-                file=sys.stderr)
-            return False
-
-        collections.append(coll)
-        collections.extend(coll.subcollections)
-        objects.extend(coll.data_objects)
-        coll_buffer.extend(coll.subcollections)
-
-        while len(coll_buffer) != 0:
-            coll = coll_buffer.pop()
-            collections.extend(coll.subcollections)
-            objects.extend(coll.data_objects)
-            coll_buffer.extend(coll.subcollections)
 
-    # uncomment to return full iRODS objects instead of just paths
-    #return {'objects': objects, 'collections': collections}
+        if not walk:
+            listed = False
+            try:
+                for entry in _query_catalogue(session, path,
+                        include_collections, since=since):
+                    listed = True
+                    metrics.CATALOGUE_PATHS.inc()
+                    yield entry
+                return
+            except irods.exception.iRODSException as e:
+                # Once paths have been handed out, falling back would list
+                # them a second time.
+                if listed:
+                    raise
+                log.warning("Catalogue query failed (%r), falling back to "
+                    "walking the collection tree.", e)
 
-    object_paths = []
-    collection_paths = []
+        for entry in _walk_catalogue(coll, include_collections, since):
+            metrics.CATALOGUE_PATHS.inc()
+            yield entry
+    finally:
+        if owns_session:
+            session.cleanup()
+
+
+def get_irods_catalogue(path, session=None, walk=False):
+    """Returns a dictionary of lists, {'objects': [], 'collections': []},
+    which contains the iRODS path of every object and subcollection in
+    the given path. Prefer 'iter_irods_catalogue' for large trees.
+
+    @param path: Root iRODS path string
+    @param session: iRODSSession object. A new session is created and
+        cleaned up if one isn't provided
+    @param walk: If True, always use the collection walker
+    @return: Dictionary with two lists, 'objects' and 'collections'"""
 
-    for object in objects:
-        object_paths.append(object.path)
+    catalogue = {'objects': [], 'collections': []}
 
-    for collection in collections:
-        collection_paths.append(collection.path)
+    try:
+        for entry_path, is_collection in iter_irods_catalogue(path, session,
+                include_collections=True, walk=walk):
+            if is_collection:
+                catalogue['collections'].append(entry_path)
+            else:
+                catalogue['objects'].append(entry_path)
+    except irods.exception.CollectionDoesNotExist:
+        log.error("Error! Collection %s not found!", path)
+        return False
 
-    return {'objects': object_paths, 'collections': collection_paths}
+    return catalogue
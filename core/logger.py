@@ -1,22 +1,208 @@
+"""Logging for Asclepius, configured once per process with 'configure'.
+
+Every component logs through a child of the DEFAULT_LOGGER logger, which
+has a single QueueHandler: records are put on a queue by the thread which
+logs them, and formatted and written by a QueueListener on a thread of its
+own, so a slow terminal or file doesn't hold up planning or execution.
+
+Messages about one object carry its path, given as extra={'path': path}.
+At millions of objects these would swamp the log, so each level's
+per-object messages (short of errors) are limited to 'rate' a second, and
+the next one let through says how many were suppressed. Run-wide messages
+are never limited."""
+
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
 
 DEFAULT_LOGGER = 'asclepius_main'
 
+# Per-object messages of each level let through a second
+DEFAULT_RATE = 10
+
+# Fields of a record given in 'extra' which JSON lines include
+_EXTRA_FIELDS = ('path', 'error', 'suppressed')
+
+_lock = threading.Lock()
+_settings = None
+_handler = None
+_listener = None
+
+
+class TextFormatter(logging.Formatter):
+    """Formats a record as '[time] Component: message'."""
+
+    def format(self, record):
+        message = "[{}] {}: {}".format(self.formatTime(record),
+            _component(record), record.getMessage())
+        if getattr(record, 'suppressed', 0):
+            message += " ({} similar messages suppressed)".format(
+                record.suppressed)
+        return message
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one line of JSON, with its UTC time, level,
+    component and message, and the object's path if it's about one."""
+
+    def format(self, record):
+        entry = {'time': datetime.fromtimestamp(record.created,
+            timezone.utc).isoformat(), 'level': record.levelname,
+            'component': _component(record), 'message': record.getMessage()}
+        for field in _EXTRA_FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        return json.dumps(entry)
+
+
+def _component(record):
+    if record.name.startswith(DEFAULT_LOGGER + '.'):
+        return record.name[len(DEFAULT_LOGGER) + 1:]
+    return record.name
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets through at most 'rate' per-object records of each level below
+    ERROR a second. The next record let through after some were dropped
+    carries their number as 'suppressed'.
+
+    @param rate: Records a second, or 0 for no limit"""
+
+    def __init__(self, rate=DEFAULT_RATE):
+        super().__init__()
+        self.rate = rate
+        self._windows = {} # level -> [window start, let through, dropped]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not self.rate or record.levelno >= logging.ERROR or \
+                not hasattr(record, 'path'):
+            return True
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.setdefault(record.levelno, [now, 0, 0])
+            if now - window[0] >= 1:
+                window[0], window[1] = now, 0
+            if window[1] >= self.rate:
+                window[2] += 1
+                return False
+            window[1] += 1
+            if window[2]:
+                record.suppressed, window[2] = window[2], 0
+        return True
+
+    def suppressed(self):
+        """Return and forget the number of records dropped at each level
+        since the last one let through.
+
+        @return: Dictionary of {level: count}"""
+        with self._lock:
+            counts = {level: window[2] for level, window in
+                self._windows.items() if window[2]}
+            for window in self._windows.values():
+                window[2] = 0
+        return counts
+
+
+def configure(level=logging.INFO, json_lines=False, stream=None,
+        path=None, rate=DEFAULT_RATE):
+    """Configure logging for the process, replacing any earlier
+    configuration.
+
+    @param level: Lowest level written. WARNING gives a quiet run, DEBUG
+        adds a message for every object planned and applied
+    @param json_lines: If True, write JSON lines rather than text
+    @param stream: Stream to write to, stderr by default
+    @param path: File to append to instead of a stream
+    @param rate: Per-object messages of each level written a second, or 0
+        for every one"""
+
+    global _settings
+    with _lock:
+        _stop()
+        _settings = {'level': level, 'json_lines': json_lines,
+            'stream': stream, 'path': path, 'rate': rate}
+        _start()
+
+
+def _start():
+    global _handler, _listener
+    settings = _settings
+    if settings['path'] is not None:
+        output = logging.FileHandler(settings['path'])
+    else:
+        output = logging.StreamHandler(settings['stream'] or sys.stderr)
+    output.setFormatter(JsonFormatter() if settings['json_lines'] else
+        TextFormatter())
+
+    records = queue.SimpleQueue()
+    _handler = logging.handlers.QueueHandler(records)
+    _handler.addFilter(RateLimitFilter(settings['rate']))
+    _listener = logging.handlers.QueueListener(records, output)
+
+    log = logging.getLogger(DEFAULT_LOGGER)
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+    log.addHandler(_handler)
+    log.setLevel(settings['level'])
+    log.propagate = False
+    _listener.start()
+
+
+def _stop():
+    global _handler, _listener
+    if _listener is None:
+        return
+    for level, count in _handler.filters[0].suppressed().items():
+        logging.getLogger(DEFAULT_LOGGER).log(level, "%d similar %s "
+            "messages suppressed", count, logging.getLevelName(level))
+    # Writes everything still queued
+    _listener.stop()
+    _listener.handlers[0].close()
+    logging.getLogger(DEFAULT_LOGGER).removeHandler(_handler)
+    _handler = _listener = None
+
+
+def shutdown():
+    """Write every message still queued and stop the writer thread."""
+    with _lock:
+        _stop()
+
+
+def get_logger(label):
+    """Returns the logger of a component, such as 'Planner'. Until logging
+    is configured, only its warnings and errors are written, to stderr.
+
+    @param label: Name of the component, which prefixes its messages"""
+    return logging.getLogger(DEFAULT_LOGGER).getChild(label)
+
+
 def init_logger(logger_name, label):
-    """Initialises a logger object.
-
-    @param logger_name String passed to the 'logging.getLogger()' function
-    @param label String used to prefix every log entry, ie if 'label' == 'CLI'
-        every log entry will be formatted 'CLI: (message)'
-    """
-    #_log_handler = logging.FileHandler(filename='asclepius.log')
-    _log_handler = logging.StreamHandler()
-    _log_formatter = logging.Formatter(fmt="[%(asctime)s] {}: %(message)s"
-        .format(label))
-
-    _log_handler.setFormatter(_log_formatter)
-    LOGGER = logging.getLogger(logger_name)
-    LOGGER.addHandler(_log_handler)
-    LOGGER.setLevel(logging.DEBUG)
-
-    return LOGGER
+    """Returns a component's logger. Kept for existing callers: it no
+    longer adds a handler, so however often it's called, each message is
+    written once.
+
+    @param logger_name: Unused, every component logs under DEFAULT_LOGGER
+    @param label: Name of the component, which prefixes its messages"""
+    return get_logger(label)
+
+
+def _after_fork():
+    # A forked child has a copy of the queue but not the thread writing it,
+    # so it starts its own. The lock may have been held by another thread.
+    global _lock, _handler, _listener
+    _lock = threading.Lock()
+    if _listener is not None:
+        _handler = _listener = None
+        _start()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+atexit.register(shutdown)
@@ -0,0 +1,354 @@
+"""Counters, gauges and latency histograms for each phase of a run, so a slow
+run shows where its time goes: listing the catalogue, reading headers,
+reading and writing metadata, or waiting in a queue.
+
+Every metric lives in one process-wide registry, REGISTRY, and the metrics
+the rest of Asclepius records are defined at the bottom of this module. The
+registry can be written out in the Prometheus text format, periodically by a
+TextfileExporter for node_exporter's textfile collector, and summarised as
+JSON at the end of a run. Execution worker processes send their metrics to
+the main process with 'drain' and 'merge'."""
+
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds, in seconds, of the buckets latencies are counted in
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1, 2.5, 5, 10, 30, 60)
+
+
+class Counter:
+    """A count that only goes up, such as the number of AVUs added."""
+
+    kind = 'counter'
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def _samples(self):
+        return [(self.name, '', self.value)]
+
+    def _drain(self):
+        with self._lock:
+            value, self.value = self.value, 0
+        return value
+
+    def _merge(self, value):
+        self.inc(value)
+
+    def _summary(self):
+        return self.value
+
+
+class Gauge:
+    """A value which goes up and down, such as a queue's depth. It is either
+    set directly, or read from a function whenever it is exported."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._value = 0
+        self._function = None
+
+    def set(self, value):
+        self._value = value
+
+    def set_function(self, function):
+        """Read the gauge from 'function' from now on. None goes back to the
+        last value set."""
+        self._function = function
+
+    @property
+    def value(self):
+        if self._function is not None:
+            try:
+                return self._function()
+            except (NotImplementedError, OSError, ValueError):
+                # multiprocessing queues can't report their size everywhere
+                pass
+        return self._value
+
+    def _samples(self):
+        return [(self.name, '', self.value)]
+
+    def _drain(self):
+        return None
+
+    def _merge(self, value):
+        pass
+
+    def _summary(self):
+        return self.value
+
+
+class Histogram:
+    """Counts of observations, usually latencies in seconds, in cumulative
+    buckets, with their count and sum.
+
+    @param buckets: Increasing upper bounds of the buckets"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        """Context manager observing how long its body takes."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start)
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating within its bucket, as
+        Prometheus' histogram_quantile does. Observations above the last
+        bucket are reported as its bound."""
+
+        with self._lock:
+            counts = list(self._counts)
+            count = self.count
+        if count == 0:
+            return None
+        rank = q * count
+        seen = 0
+        lower = 0.0
+        for bound, bucket in zip(self.buckets, counts):
+            if bucket and seen + bucket >= rank:
+                return lower + (bound - lower) * (rank - seen) / bucket
+            seen += bucket
+            lower = bound
+        return self.buckets[-1]
+
+    def _samples(self):
+        with self._lock:
+            counts = list(self._counts)
+            count, total = self.count, self.sum
+        samples = []
+        cumulative = 0
+        for bound, bucket in zip(self.buckets, counts):
+            cumulative += bucket
+            samples.append((self.name + '_bucket',
+                '{{le="{}"}}'.format(bound), cumulative))
+        samples.append((self.name + '_bucket', '{le="+Inf"}', count))
+        samples.append((self.name + '_sum', '', total))
+        samples.append((self.name + '_count', '', count))
+        return samples
+
+    def _drain(self):
+        with self._lock:
+            drained = (list(self._counts), self.count, self.sum)
+            self._counts = [0] * len(self._counts)
+            self.count = 0
+            self.sum = 0.0
+        return drained
+
+    def _merge(self, drained):
+        counts, count, total = drained
+        with self._lock:
+            self._counts = [a + b for a, b in zip(self._counts, counts)]
+            self.count += count
+            self.sum += total
+
+    def _summary(self):
+        if self.count == 0:
+            return {'count': 0}
+        return {'count': self.count, 'sum': self.sum,
+            'mean': self.sum / self.count, 'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9), 'p99': self.quantile(0.99)}
+
+
+class Registry:
+    """A set of metrics, by name."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, description):
+        return self._add(Counter(name, description))
+
+    def gauge(self, name, description):
+        return self._add(Gauge(name, description))
+
+    def histogram(self, name, description, buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, description, buckets))
+
+    def drain(self):
+        """Return everything counted since the last drain and start counting
+        from zero, so another process can 'merge' it without counting
+        anything twice."""
+        return {name: metric._drain() for name, metric in
+            self.metrics.items() if metric.kind != 'gauge'}
+
+    def merge(self, drained):
+        """Add the counts from another process's 'drain' to this registry."""
+        for name, value in drained.items():
+            if name in self.metrics:
+                self.metrics[name]._merge(value)
+
+    def prometheus(self):
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append('# HELP {} {}'.format(metric.name,
+                metric.description))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            for name, labels, value in metric._samples():
+                lines.append('{}{} {}'.format(name, labels, value))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Return a dictionary summarising the run so far: the elapsed time,
+        every metric's value, and the mean and estimated quantiles of every
+        histogram."""
+        elapsed = time.time() - self.started
+        summary = {'elapsed_seconds': elapsed}
+        for kind in ('counter', 'gauge', 'histogram'):
+            summary[kind + 's'] = {metric.name: metric._summary() for metric
+                in self.metrics.values() if metric.kind == kind}
+        applied = summary['counters'].get(OBJECTS_APPLIED.name, 0)
+        summary['objects_per_second'] = applied / elapsed if elapsed else 0
+        return summary
+
+
+def _write_atomically(path, text):
+    # node_exporter mustn't read a half written file
+    partial = path + '.partial'
+    with open(partial, 'w') as file:
+        file.write(text)
+    os.replace(partial, path)
+
+
+def write_summary(path, registry=None):
+    """Write a registry's 'summary' to a JSON file."""
+    registry = registry or REGISTRY
+    _write_atomically(path, json.dumps(registry.summary(), indent=2) + '\n')
+
+
+class TextfileExporter:
+    """Writes a registry to a Prometheus textfile every 'interval' seconds on
+    a background thread, and once more when stopped.
+
+    @param path: File to write, which node_exporter's textfile collector
+        expects to end in '.prom'
+    @param interval: Seconds between writes
+    @param registry: Registry to export, REGISTRY by default"""
+
+    def __init__(self, path, interval=15, registry=None):
+        self.path = path
+        self.interval = interval
+        self.registry = registry or REGISTRY
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._export, daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.write()
+
+    def write(self):
+        _write_atomically(self.path, self.registry.prometheus())
+
+    def _export(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError:
+                # A full or missing metrics directory shouldn't stop a run;
+                # the next write tries again
+                pass
+
+
+REGISTRY = Registry()
+
+CATALOGUE_PAGE_SECONDS = REGISTRY.histogram(
+    'asclepius_catalogue_page_seconds',
+    "Time to fetch a page of the catalogue listing.")
+CATALOGUE_PATHS = REGISTRY.counter('asclepius_catalogue_paths_total',
+    "Paths listed from the catalogue.")
+PATTERN_MATCHES = REGISTRY.counter('asclepius_pattern_matches_total',
+    "Configuration patterns matched by listed paths.")
+PLANS = REGISTRY.counter('asclepius_plans_total', "Plans generated.")
+HEADER_FETCH_SECONDS = REGISTRY.histogram(
+    'asclepius_header_fetch_seconds',
+    "Time to read and parse a file header from iRODS.")
+HEADER_CACHE_HITS = REGISTRY.counter('asclepius_header_cache_hits_total',
+    "Headers read from the header cache.")
+HEADER_CACHE_MISSES = REGISTRY.counter('asclepius_header_cache_misses_total',
+    "Headers not in the header cache, or out of date.")
+METADATA_READ_SECONDS = REGISTRY.histogram(
+    'asclepius_metadata_read_seconds',
+    "Time to fetch a page of existing AVUs.")
+METADATA_WRITE_SECONDS = REGISTRY.histogram(
+    'asclepius_metadata_write_seconds',
+    "Time to apply one object's AVU changes.")
+AVUS_ADDED = REGISTRY.counter('asclepius_avus_added_total',
+    "Attributes added to objects.")
+AVUS_MODIFIED = REGISTRY.counter('asclepius_avus_modified_total',
+    "Attributes whose values were replaced.")
+AVUS_REMOVED = REGISTRY.counter('asclepius_avus_removed_total',
+    "Attributes removed from objects.")
+OBJECTS_APPLIED = REGISTRY.counter('asclepius_objects_applied_total',
+    "Objects whose plans were applied.")
+OBJECTS_FAILED = REGISTRY.counter('asclepius_objects_failed_total',
+    "Objects whose plans failed.")
+PLAN_QUEUE_DEPTH = REGISTRY.gauge('asclepius_plan_queue_depth',
+    "Plans waiting to be executed.")
+WORKER_QUEUE_DEPTH = REGISTRY.gauge('asclepius_worker_queue_depth',
+    "Plans waiting in the execution worker processes' queues.")
+POOL_CONNECTIONS = REGISTRY.gauge('asclepius_pool_connections',
+    "iRODS connections open in this process's pool.")
+POOL_CONNECTIONS_IN_USE = REGISTRY.gauge('asclepius_pool_connections_in_use',
+    "iRODS connections in use by an operation.")
+POOL_WAIT_SECONDS = REGISTRY.histogram('asclepius_pool_wait_seconds',
+    "Time waiting for a free iRODS connection.")
+POOL_CONNECTIONS_OPENED = REGISTRY.counter(
+    'asclepius_pool_connections_opened_total',
+    "iRODS connections opened, each with its own handshake.")
+POOL_CONNECTIONS_DROPPED = REGISTRY.counter(
+    'asclepius_pool_connections_dropped_total',
+    "iRODS connections closed after failing or failing a health check.")
+POOL_OVERFLOWS = REGISTRY.counter('asclepius_pool_overflows_total',
+    "Connections opened beyond the pool's size after waiting too long.")
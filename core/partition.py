@@ -0,0 +1,63 @@
+import hashlib
+import os
+import zlib
+
+
+def path_hash(path):
+    """Returns a hash of an iRODS path which, unlike hash(), is the same in
+    every process and on every run."""
+    return zlib.crc32(path.encode('utf-8'))
+
+
+def partition(path, num_partitions):
+    """Returns which of 'num_partitions' partitions an iRODS path belongs to.
+    A path always lands in the same partition, so work split this way never
+    has two partitions touching the same object."""
+    return path_hash(path) % num_partitions
+
+
+def parse_shard(text):
+    """Parse a shard given as 'i/N', the i-th of N shards counting from 1 as
+    LSF job array indices do.
+
+    @return: (i, N) tuple
+    @raise ValueError: If the text isn't a valid shard"""
+
+    try:
+        index, count = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise ValueError("Shard must be given as i/N, not {!r}".format(text))
+    if not 1 <= index <= count:
+        raise ValueError("Shard {} isn't between 1 and {}".format(index,
+            count))
+    return (index, count)
+
+
+def shard_of(path, num_shards):
+    """Returns which of 'num_shards' shards, counting from 1, an iRODS path
+    belongs to. This uses a different hash from 'partition', so each shard
+    still spreads its paths evenly over the executor's workers."""
+    digest = hashlib.blake2b(path.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % num_shards + 1
+
+
+def in_shard(entries, shard, key=None):
+    """Filter a stream down to the entries in one shard, keeping their order.
+
+    @param entries: Iterable of paths, or of anything 'key' maps to a path
+    @param shard: (i, N) tuple, as returned by 'parse_shard'
+    @param key: Function returning an entry's path
+    @return: Entries in the shard, as a generator"""
+
+    index, count = shard
+    for entry in entries:
+        if shard_of(key(entry) if key else entry, count) == index:
+            yield entry
+
+
+def shard_file(path, shard):
+    """Returns the name of a shard's own copy of a file, such as
+    'progress.shard-2-of-8.db' for 'progress.db', so tasks never share
+    one."""
+    base, extension = os.path.splitext(path)
+    return "{}.shard-{}-of-{}{}".format(base, shard[0], shard[1], extension)
@@ -0,0 +1,112 @@
+import queue
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def buffered(iterable, depth, gauge=None):
+    """Consume 'iterable' in a background thread, keeping at most 'depth'
+    items waiting in a bounded queue. The producer blocks when the queue is
+    full, so a slow consumer applies backpressure instead of plans piling up
+    in memory. Exceptions raised by the producer are re-raised in the
+    consumer.
+
+    @param iterable: Any iterable, such as the plan generator
+    @param depth: Maximum number of buffered items. If less than 1, the
+        iterable is consumed directly in the calling thread
+    @param gauge: Optional metrics Gauge to report the number of buffered
+        items through
+    @return: The items of 'iterable', in order, as a generator"""
+
+    if depth < 1:
+        yield from iterable
+        return
+
+    items = queue.Queue(depth)
+    stop = threading.Event()
+    if gauge is not None:
+        gauge.set_function(items.qsize)
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(_Failure(e))
+            return
+        put(_DONE)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _Failure):
+                raise item.exception
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+        if gauge is not None:
+            gauge.set_function(None)
+            gauge.set(0)
+
+
+def bounded_map(function, iterable, in_flight, ordered=False):
+    """Apply 'function' to each item of 'iterable' on a pool of threads,
+    with at most 'in_flight' calls outstanding at once. Items are only taken
+    from 'iterable' as slots free up, so it is consumed lazily.
+
+    @param function: Callable taking one item
+    @param iterable: Items to apply the function to
+    @param in_flight: Maximum number of concurrent calls. If less than 2,
+        calls are made one at a time in the calling thread
+    @param ordered: If True, results are yielded in input order; otherwise
+        in completion order
+    @return: Results of 'function', as a generator"""
+
+    if in_flight < 2:
+        for item in iterable:
+            yield function(item)
+        return
+
+    with ThreadPoolExecutor(in_flight) as pool:
+        if ordered:
+            pending = deque()
+            for item in iterable:
+                if len(pending) >= in_flight:
+                    yield pending.popleft().result()
+                pending.append(pool.submit(function, item))
+            while pending:
+                yield pending.popleft().result()
+        else:
+            pending = set()
+            for item in iterable:
+                if len(pending) >= in_flight:
+                    done, pending = wait(pending,
+                        return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                pending.add(pool.submit(function, item))
+            for future in wait(pending).done:
+                yield future.result()
@@ -0,0 +1,277 @@
+import codecs
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from itertools import islice
+
+import core.logger as logger
+
+log = logger.get_logger('Progress')
+
+# Completed paths are committed in batches, so a crash loses at most one
+# batch (which is simply applied again on resume) and the journal doesn't
+# cost a disk sync per object.
+COMMIT_INTERVAL = 1000
+COMMIT_SECONDS = 1.0
+
+# Paths are looked up in the journal this many at a time when resuming
+LOOKUP_CHUNK = 500
+
+# The first bytes of every SQLite database
+_SQLITE_MAGIC = b'SQLite format 3\x00'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS done (
+    path TEXT PRIMARY KEY
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS watermarks (
+    root TEXT PRIMARY KEY,
+    time REAL,
+    listed REAL
+);
+'''
+
+
+class ProgressJournal:
+    '''
+    Records which paths have had their metadata applied, in an SQLite
+    database in WAL mode, so an interrupted run can be resumed.
+    * Completions are committed every COMMIT_INTERVAL paths or
+      COMMIT_SECONDS seconds, whichever comes first, even if nothing has
+      completed since.
+    * Resuming filters the catalogue stream against the journal's index a
+      chunk at a time, so memory use doesn't grow with the number of paths
+      already done, and the catalogue's order is kept.
+    * It also keeps a high-water mark per root collection: the time the
+      listing used by the last run over that root to finish without errors
+      started. Starting a fresh run doesn't forget these.
+    * A progress file of older versions, a text file of one path per line,
+      is moved aside to '<path>.old' and its paths imported.
+    It is safe to share between threads.
+
+    @param path: Path to the journal database
+    @param resume: If False, any paths recorded by a previous run are
+        forgotten
+    @raise ValueError: If the file is neither a journal nor a text progress
+        file
+    '''
+    def __init__(self, path, resume=True):
+        self.path = path
+        self._pending = 0
+        self._last_commit = time.monotonic()
+        self._lock = threading.Lock()
+
+        old = _move_text_progress(path)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        # In WAL mode, NORMAL only syncs at checkpoints. A committed batch
+        # survives the process crashing, just not the machine losing power.
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(_SCHEMA)
+        if not resume:
+            self._db.execute('DELETE FROM done')
+            self._db.commit()
+        elif old is not None:
+            self._import(old)
+
+        # Commits whatever has completed every COMMIT_SECONDS, so the last
+        # completions before a run stalls aren't left uncommitted
+        self._closed = threading.Event()
+        self._committer = threading.Thread(target=self._commit_periodically,
+            daemon=True)
+        self._committer.start()
+
+    def _import(self, old):
+        with open(old, encoding='UTF-8') as file:
+            paths = (line.strip() for line in file)
+            while True:
+                chunk = [(path,) for path in islice(paths, LOOKUP_CHUNK)
+                    if path]
+                if not chunk:
+                    break
+                self._db.executemany('INSERT OR IGNORE INTO done VALUES (?)',
+                    chunk)
+        self._db.commit()
+        log.info("Imported %d paths from the progress file %s.",
+            len(self), old)
+
+    def _commit_periodically(self):
+        while not self._closed.wait(COMMIT_SECONDS):
+            with self._lock:
+                if self._pending and not self._closed.is_set():
+                    self._commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record(self, path):
+        """Record that a path is done. It is committed with the next
+        batch."""
+
+        with self._lock:
+            self._db.execute('INSERT OR IGNORE INTO done VALUES (?)', (path,))
+            self._pending += 1
+            if self._pending >= COMMIT_INTERVAL or \
+                    time.monotonic() - self._last_commit >= COMMIT_SECONDS:
+                self._commit()
+
+    def _commit(self):
+        self._db.commit()
+        self._pending = 0
+        self._last_commit = time.monotonic()
+
+    def commit(self):
+        with self._lock:
+            self._commit()
+
+    def close(self):
+        self._closed.set()
+        self._committer.join()
+        with self._lock:
+            self._commit()
+            self._db.close()
+
+    def watermark(self, root):
+        """Return the high-water mark of a root collection as a UTC datetime,
+        or None if no run over it has succeeded."""
+
+        with self._lock:
+            row = self._db.execute('SELECT time FROM watermarks WHERE '
+                'root = ?', (root,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return datetime.fromtimestamp(row[0], timezone.utc)
+
+    def watermarks(self):
+        """Return every root collection's high-water mark.
+
+        @return: Dictionary of {root: UTC datetime}"""
+
+        with self._lock:
+            rows = self._db.execute('SELECT root, time FROM watermarks WHERE '
+                'time IS NOT NULL').fetchall()
+        return {root: datetime.fromtimestamp(time, timezone.utc)
+            for root, time in rows}
+
+    def start_listing(self, root, time):
+        """Record when the catalogue listing the current run works through
+        started. A resumed run reuses the listing, and with it this time.
+
+        @param root: iRODS path of the root collection
+        @param time: Timezone-aware datetime"""
+
+        with self._lock:
+            self._db.execute('INSERT INTO watermarks (root, listed) VALUES '
+                '(?, ?) ON CONFLICT (root) DO UPDATE SET listed = '
+                'excluded.listed', (root, time.timestamp()))
+            self._commit()
+
+    def advance_watermark(self, root):
+        """Move a root collection's high-water mark up to the start of the
+        last listing, once everything in it has been applied."""
+
+        with self._lock:
+            self._db.execute('UPDATE watermarks SET time = listed WHERE '
+                'root = ? AND listed IS NOT NULL', (root,))
+            self._commit()
+
+    def merge(self, paths, with_watermarks=True):
+        """Merge other journals, such as those of the shards of a sharded
+        run, into this one. Every path done in any of them is done here. A
+        root collection's watermark is only carried over if every journal
+        has one, in which case the earliest is taken.
+
+        @param paths: Paths to the other journals' databases
+        @param with_watermarks: If False, only completed paths are merged"""
+
+        merged = None
+        with self._lock:
+            self._commit()
+            for path in paths:
+                self._db.execute('ATTACH DATABASE ? AS other', (path,))
+                try:
+                    self._db.execute('INSERT OR IGNORE INTO done SELECT path '
+                        'FROM other.done')
+                    watermarks = dict(self._db.execute('SELECT root, time '
+                        'FROM other.watermarks WHERE time IS NOT NULL'))
+                    self._commit()
+                finally:
+                    self._db.execute('DETACH DATABASE other')
+                if merged is None:
+                    merged = watermarks
+                else:
+                    merged = {root: min(time, watermarks[root]) for
+                        root, time in merged.items() if root in watermarks}
+
+            if not with_watermarks:
+                merged = None
+            for root, time in (merged or {}).items():
+                self._db.execute('INSERT INTO watermarks (root, time) VALUES '
+                    '(?, ?) ON CONFLICT (root) DO UPDATE SET time = '
+                    'excluded.time', (root, time))
+            self._commit()
+
+    def __contains__(self, path):
+        with self._lock:
+            return self._db.execute('SELECT 1 FROM done WHERE path = ?',
+                (path,)).fetchone() is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM done').fetchone()[0]
+
+    def pending(self, entries, key=None):
+        """Filter out entries whose paths are already done, keeping their
+        order. Entries are looked up LOOKUP_CHUNK at a time.
+
+        @param entries: Iterable of paths, or of anything 'key' maps to a
+            path
+        @param key: Function returning an entry's path
+        @return: Entries not yet done, as a generator"""
+
+        entries = iter(entries)
+        while True:
+            chunk = list(islice(entries, LOOKUP_CHUNK))
+            if not chunk:
+                return
+            paths = [key(entry) for entry in chunk] if key else chunk
+            with self._lock:
+                done = set(row[0] for row in self._db.execute(
+                    'SELECT path FROM done WHERE path IN ({})'.format(
+                    ','.join('?' * len(paths))), paths))
+            for entry, path in zip(chunk, paths):
+                if path not in done:
+                    yield entry
+
+
+def _move_text_progress(path):
+    """Move a text progress file, as older versions wrote, out of the way of
+    the journal.
+
+    @return: Where it was moved to, or None if there was none
+    @raise ValueError: If the file is neither that nor a journal"""
+
+    try:
+        with open(path, 'rb') as file:
+            start = file.read(len(_SQLITE_MAGIC))
+            rest = file.read(4096)
+    except FileNotFoundError:
+        return None
+    if not start or start == _SQLITE_MAGIC:
+        return None
+    try:
+        # The read may end part way through a character
+        codecs.getincrementaldecoder('UTF-8')().decode(start + rest)
+    except UnicodeDecodeError:
+        raise ValueError("{} is neither a progress journal nor a text "
+            "progress file".format(path))
+    old = path + '.old'
+    os.replace(path, old)
+    log.info("%s is a text progress file from an older version. Moved it to "
+        "%s to replace it with a journal.", path, old)
+    return old
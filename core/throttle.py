@@ -0,0 +1,155 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class TokenBucket:
+    """Hard cap on the rate of requests. Each request takes a token; tokens
+    refill at 'rate' per second, up to 'burst' saved for later.
+
+    @param rate: Requests per second
+    @param burst: Maximum number of tokens, defaults to one second's worth"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst,
+                    self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class ConcurrencyLimiter:
+    """Limits the number of requests in flight at once. If 'adaptive' is
+    True, the limit follows AIMD (additive increase, multiplicative
+    decrease): it grows by about one per round of healthy requests and is
+    halved when a request fails or takes longer than 'target_latency'.
+
+    @param limit: Initial (or, if not adaptive, fixed) number of requests
+    @param adaptive: If True, adjust the limit as described above
+    @param minimum: Lowest limit AIMD can shrink to
+    @param maximum: Highest limit AIMD can grow to
+    @param target_latency: Seconds above which a request counts as slow"""
+
+    def __init__(self, limit, adaptive=False, minimum=1, maximum=64,
+            target_latency=0.5):
+        self.limit = float(limit)
+        self.adaptive = adaptive
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.in_flight = 0
+        self._last_decrease = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= max(int(self.limit), 1):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency, failed=False):
+        with self._condition:
+            self.in_flight -= 1
+            if self.adaptive:
+                now = time.monotonic()
+                if failed or latency > self.target_latency:
+                    # Requests already in flight when the server slowed
+                    # down will report late too, so only back off once per
+                    # target latency period.
+                    if now - self._last_decrease > self.target_latency:
+                        self.limit = max(self.minimum, self.limit / 2)
+                        self._last_decrease = now
+                else:
+                    self.limit = min(self.maximum,
+                        self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class Throttle:
+    """Rate and concurrency controller placed in front of every iRODS call.
+    Use 'request()' as a context manager around each call. Nested requests
+    from the same thread are only counted once.
+
+    @param rate: Maximum requests per second, or None for no cap
+    @param concurrency: Maximum (or, if adaptive, initial) requests in
+        flight, or None for no cap
+    @param adaptive: If True, adjust the concurrency limit with AIMD
+    @param max_concurrency: Upper bound for the adaptive limit
+    @param target_latency: Seconds above which AIMD treats a request as a
+        sign of server load
+    @param error_types: Exceptions which AIMD treats as a sign of server
+        load. Other exceptions pass through without affecting the limit"""
+
+    def __init__(self, rate=None, concurrency=None, adaptive=False,
+            max_concurrency=64, target_latency=0.5, error_types=()):
+        self._config = dict(rate=rate, concurrency=concurrency,
+            adaptive=adaptive, max_concurrency=max_concurrency,
+            target_latency=target_latency, error_types=error_types)
+        self.error_types = tuple(error_types)
+        self.bucket = TokenBucket(rate) if rate else None
+        self.limiter = None
+        if concurrency or adaptive:
+            self.limiter = ConcurrencyLimiter(concurrency or 1, adaptive,
+                maximum=max_concurrency, target_latency=target_latency)
+        self._local = threading.local()
+
+    def __getstate__(self):
+        # Locks can't be pickled, so worker processes rebuild the throttle
+        return self._config
+
+    def __setstate__(self, config):
+        self.__init__(**config)
+
+    def share(self, parts):
+        """Return a throttle with 1/parts of this one's rate and concurrency,
+        for each of 'parts' processes that together must respect it."""
+
+        config = dict(self._config)
+        if config['rate']:
+            config['rate'] = config['rate'] / parts
+        if config['concurrency']:
+            config['concurrency'] = max(1, config['concurrency'] // parts)
+        config['max_concurrency'] = max(1, config['max_concurrency'] // parts)
+        return Throttle(**config)
+
+    @contextmanager
+    def request(self):
+        depth = getattr(self._local, 'depth', 0)
+        if depth:
+            self._local.depth = depth + 1
+            try:
+                yield
+            finally:
+                self._local.depth = depth
+            return
+
+        if self.bucket is not None:
+            self.bucket.acquire()
+        if self.limiter is not None:
+            self.limiter.acquire()
+
+        self._local.depth = 1
+        start = time.monotonic()
+        failed = False
+        try:
+            yield
+        except self.error_types:
+            failed = True
+            raise
+        finally:
+            self._local.depth = 0
+            if self.limiter is not None:
+                self.limiter.release(time.monotonic() - start, failed)
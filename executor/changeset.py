@@ -0,0 +1,153 @@
+"""Change-sets: the exact AVU changes a run would make, computed ahead of time
+against the metadata already on each object and written to a file, so they
+can be reviewed before anything is touched and applied later in one go.
+
+The file is JSON lines, gzip compressed if its name ends in '.gz'. The first
+line describes how it was planned:
+
+    {"changeset": FORMAT_VERSION, "root": ..., "overwrite": ..., "refresh": ...}
+
+and every other line is one object with something to change, in catalogue
+order:
+
+    {"path": ..., "collection": ..., "add": [[attribute, value, unit], ...],
+        "remove": [...]}
+
+Objects whose metadata is already as planned aren't written at all."""
+
+import gzip
+import json
+import os
+
+from executor.executor import count_changes, diff_avus
+from planner.object_class import AVU, Change
+
+FORMAT_VERSION = 1
+
+
+class ChangeSetError(Exception):
+    """The file isn't a change-set this module can read."""
+
+
+def _open(path, mode, name=None):
+    """Open a change-set, compressed if 'name' (by default its path) ends in
+    '.gz'."""
+    if (name or path).endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='UTF-8')
+    return open(path, mode, encoding='UTF-8')
+
+
+def _encode(avus):
+    return [[avu.attribute, avu.value, avu.unit] for avu in avus]
+
+
+def diff_plans(plans, prefetcher, overwrite=False, refresh=False,
+        summary=None):
+    """Diff each plan against the object's existing AVUs.
+
+    @param plans: Iterable of Plan objects
+    @param prefetcher: MetadataPrefetcher to read existing AVUs from
+    @param summary: Optional dictionary of counts, updated as plans are
+        diffed: 'objects', 'changed', 'added', 'modified' and 'removed'. An
+        attribute whose values are replaced counts as modified, not as
+        added and removed
+    @return: Change objects for the plans which change something, as a
+        generator"""
+
+    for plan in plans:
+        existing = prefetcher.get(plan.path, plan.is_collection)
+        to_add, to_remove = diff_avus(existing, plan.metadata, overwrite,
+            refresh)
+
+        if summary is not None:
+            summary['objects'] = summary.get('objects', 0) + 1
+        if not to_add and not to_remove:
+            continue
+
+        if summary is not None:
+            added, modified, removed = count_changes(to_add, to_remove)
+            for key, count in (('changed', 1), ('added', added),
+                    ('modified', modified), ('removed', removed)):
+                summary[key] = summary.get(key, 0) + count
+
+        yield Change(plan.path, plan.is_collection, tuple(to_add),
+            tuple(to_remove))
+
+
+def write_changeset(changes, path, root='', overwrite=False, refresh=False):
+    """Write changes to a change-set file. It is written alongside and only
+    moved into place once every change has been written.
+
+    @param changes: Iterable of Change objects, such as 'diff_plans' gives
+    @param path: Path to write the change-set to
+    @param root: The root collection the changes were planned from
+    @param overwrite: Whether the changes were planned with overwrite
+    @param refresh: Whether the changes were planned with refresh
+    @return: Number of changes written"""
+
+    partial = path + '.partial'
+    count = 0
+    try:
+        with _open(partial, 'w', path) as file:
+            file.write(json.dumps({'changeset': FORMAT_VERSION, 'root': root,
+                'overwrite': overwrite, 'refresh': refresh}) + '\n')
+            for change in changes:
+                file.write(json.dumps({'path': change.path,
+                    'collection': change.is_collection,
+                    'add': _encode(change.to_add),
+                    'remove': _encode(change.to_remove)},
+                    separators=(',', ':')) + '\n')
+                count += 1
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    os.replace(partial, path)
+    return count
+
+
+class ChangeSetReader:
+    """A change-set file opened for replay. 'header' is its first line, and
+    iterating over it gives Change objects, decoded one line at a time.
+
+    @param path: Path to the change-set
+    @raise ChangeSetError: If the file is missing or isn't a change-set"""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            self._file = _open(path, 'r')
+        except OSError as e:
+            raise ChangeSetError("Can't open change-set {}: {}".format(path,
+                e))
+        try:
+            self.header = json.loads(self._file.readline())
+        except (OSError, ValueError) as e:
+            self.close()
+            raise ChangeSetError("Can't read change-set {}: {}".format(path,
+                e))
+        if not isinstance(self.header, dict) or \
+                self.header.get('changeset') != FORMAT_VERSION:
+            self.close()
+            raise ChangeSetError("{} isn't a version {} change-set".format(
+                path, FORMAT_VERSION))
+
+    def __iter__(self):
+        for number, line in enumerate(self._file, 2):
+            try:
+                entry = json.loads(line)
+                yield Change(entry['path'], entry['collection'],
+                    tuple(AVU(*avu) for avu in entry['add']),
+                    tuple(AVU(*avu) for avu in entry['remove']))
+            except (ValueError, KeyError, TypeError) as e:
+                raise ChangeSetError("Invalid change on line {} of {}: {}"
+                    .format(number, self.path, e))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._file.close()
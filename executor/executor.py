@@ -1,9 +1,133 @@
+import multiprocessing
+import queue
+import time
+import core.irods_wrapper as irods_wrapper
+import core.logger as logger
+import core.metrics as metrics
+from core.backend import as_backend
+from core.partition import partition
+from core.pipeline import bounded_map
+from executor.prefetch import MetadataPrefetcher
+from planner.object_class import Change
 
+log = logger.get_logger('Executor')
 
+# Maximum number of plans waiting for each worker process
+WORKER_QUEUE_SIZE = 1000
+
+# Seconds between each worker process sending its metrics to the main one
+WORKER_METRICS_INTERVAL = 1.0
+
+# Kinds of message a worker process sends the main one, each the first item
+# of a tuple
+_RESULT = 'result' # (_RESULT, iRODS path, error string or None)
+_METRICS = 'metrics' # (_METRICS, drained metrics)
+_DONE = 'done' # (_DONE,), once the worker has sent everything
+
+
+def _same_avu(a, b):
+    # iRODS reports a missing unit as either None or ''
+    return (a.attribute, a.value, a.unit or None) == \
+        (b.attribute, b.value, b.unit or None)
+
+
+def diff_avus(existing_AVUs, planned_AVUs, overwrite = False, refresh = False):
+    """Compute the AVUs to add to and remove from an object so that it ends up
+    holding its planned metadata.
+
+    * refresh: every existing AVU not in the plan is removed, and each
+      planned attribute is set to its last planned value.
+    * overwrite: each planned attribute is set to its last planned value,
+      replacing any existing values for that attribute.
+    * default: a planned attribute is only added if the object doesn't
+      already have it, using its first planned value.
+
+    @param existing_AVUs: List of AVUs currently on the object
+    @param planned_AVUs: List of AVUs from the plan
+    @return: (AVUs to add, AVUs to remove) tuple of lists"""
+
+    planned = {}
+    for avu in planned_AVUs:
+        if not avu.attribute:
+            continue
+        if refresh or overwrite or avu.attribute not in planned:
+            planned[avu.attribute] = avu
+
+    to_add = []
+    to_remove = []
+
+    if refresh:
+        for avu in existing_AVUs:
+            if avu.attribute not in planned or \
+                    not _same_avu(avu, planned[avu.attribute]):
+                to_remove.append(avu)
+        for avu in planned.values():
+            if not any(_same_avu(avu, old) for old in existing_AVUs):
+                to_add.append(avu)
+
+    elif overwrite:
+        for attribute, avu in planned.items():
+            current = [old for old in existing_AVUs
+                if old.attribute == attribute]
+            to_remove.extend(old for old in current if not _same_avu(old, avu))
+            if not any(_same_avu(old, avu) for old in current):
+                to_add.append(avu)
+
+    else:
+        existing_attributes = set(avu.attribute for avu in existing_AVUs)
+        to_add.extend(avu for attribute, avu in planned.items()
+            if attribute not in existing_attributes)
+
+    return to_add, to_remove
+
+
+def count_changes(to_add, to_remove):
+    """Count the attributes an AVU diff adds, modifies and removes. An
+    attribute with values both added and removed counts as modified.
+
+    @return: (added, modified, removed) tuple"""
+
+    added = set(avu.attribute for avu in to_add)
+    removed = set(avu.attribute for avu in to_remove)
+    return (len(added - removed), len(added & removed), len(removed - added))
+
+
+def _record_changes(to_add, to_remove):
+    added, modified, removed = count_changes(to_add, to_remove)
+    metrics.AVUS_ADDED.inc(added)
+    metrics.AVUS_MODIFIED.inc(modified)
+    metrics.AVUS_REMOVED.inc(removed)
+
+
+def _worker(session_factory, plans, results, overwrite, refresh, in_flight,
+        throttle):
+    """Entry point of an execution worker process. Each worker owns its own
+    iRODS session or backend and share of the throttle, executes the plans
+    it is sent until it receives None, and sends a _RESULT message for every
+    plan. Every WORKER_METRICS_INTERVAL seconds, and when it finishes, it
+    also sends a _METRICS message, and lastly a _DONE one."""
+
+    # A forked worker starts with a copy of the main process's counts
+    metrics.REGISTRY.drain()
+    if throttle is not None:
+        irods_wrapper.set_throttle(throttle)
+    session = session_factory()
+    try:
+        executor = Executor(session, 1, in_flight=in_flight)
+        sent = time.monotonic()
+        for path, error in executor._execute_local(iter(plans.get, None),
+                overwrite, refresh):
+            results.put((_RESULT, path, error))
+            if time.monotonic() - sent >= WORKER_METRICS_INTERVAL:
+                results.put((_METRICS, metrics.REGISTRY.drain()))
+                sent = time.monotonic()
+    finally:
+        session.cleanup()
+        results.put((_METRICS, metrics.REGISTRY.drain()))
+        results.put((_DONE,))
+        # Worker processes exit without running atexit handlers
+        logger.shutdown()
 
-from multiprocessing import Pool
-from irods.meta import iRODSMeta
-import core.irods_wrapper as irods_wrapper
 
 class Executor:
     '''
@@ -11,12 +135,22 @@ class Executor:
     * It will consume the stream of file-AVU tuples.
     * It will pass this to an execution worker (the pool thereof is either managed by this, or by the overall wrapper...probably the execution manager would be best).
     * Each execution worker will check the current AVUs on said file, then commit the difference (i.e., the new ones) per its input. This will ensure idempotency.
+    Existing AVUs are read from a MetadataPrefetcher snapshot, which fetches a whole collection's metadata per query, rather than from the object itself.
+    The difference for each object is then committed in a single atomic metadata operation.
+    Reads and writes go through a backend from core.backend; an iRODSSession is used through python-irodsclient, and session_factory may return either.
     Remember to use appropriate synchronisation primitives for your multiprocessing so you don't get race conditions on your queue. Ultimately, the end-user interface will be something like:
     metadata-adder --collection ROOT_COLLECTION --config /path/to/config
     '''
-    def __init__(self, irods_session, num_executors):
-        self.process_pool = Pool(num_executors)
+    def __init__(self, irods_session, num_executors = 1, session_factory = None, in_flight = 1, throttle = None):
+        self.num_executors = num_executors
+        self.in_flight = in_flight
+        self.failures = 0 # Plans execute_plans couldn't apply
+        self.throttle = throttle # Passed to each worker process
         self.session = irods_session
+        self.session_factory = session_factory or irods_wrapper.create_session
+        if irods_session is not None:
+            self.backend = as_backend(irods_session)
+            self.prefetcher = MetadataPrefetcher(self.backend)
 
 
     def execute_plan(self, plan, overwrite = False, refresh = False):
@@ -24,38 +158,140 @@ class Executor:
         planned_AVUs = plan.metadata #List of AVUs
         is_collection = plan.is_collection
 
-        existing_metadata = irods_wrapper.get_metadata(self.session, filepath, is_collection)
-        with self.process_pool as p: # On close, context manager returns process to pool
-            print(f"Filepath: {filepath} AVUs: {planned_AVUs}")
+        existing_AVUs = self.prefetcher.get(filepath, is_collection)
+        log.debug("Applying %s: %s", filepath, planned_AVUs,
+            extra={'path': filepath})
 
-            if refresh:
-                for avu in existing_metadata.items():
-                    existing_metadata.remove(avu)
-                for avu in planned_AVUs:
-                    if avu.attribute:
-                        new_AVU = iRODSMeta(avu.attribute,avu.value,avu.unit)
-                        sexisting_metadata[avu.attribute] = new_AVU
-                return 
+        to_add, to_remove = diff_avus(existing_AVUs, planned_AVUs,
+            overwrite, refresh)
 
-            if overwrite:
-                for avu in planned_AVUs:
+        self.backend.apply_metadata(filepath,
+            [(avu.attribute, avu.value, avu.unit) for avu in to_add],
+            [(avu.attribute, avu.value, avu.unit) for avu in to_remove],
+            is_collection)
+        _record_changes(to_add, to_remove)
 
+        if to_add or to_remove:
+            self.prefetcher.update(filepath, is_collection,
+                [avu for avu in existing_AVUs if avu not in to_remove]
+                + to_add)
+
+    def apply_change(self, change):
+        """Apply a Change from a change-set as it stands. It was diffed when
+        it was planned, so the object's metadata isn't read first."""
+
+        self.backend.apply_metadata(change.path,
+            [(avu.attribute, avu.value, avu.unit) for avu in change.to_add],
+            [(avu.attribute, avu.value, avu.unit) for avu in
+                change.to_remove], change.is_collection)
+        _record_changes(change.to_add, change.to_remove)
+
+    def _try_execute(self, plan, overwrite, refresh):
+        try:
+            if isinstance(plan, Change):
+                self.apply_change(plan)
+            else:
+                self.execute_plan(plan, overwrite, refresh)
+        except Exception as e:
+            return (plan.path, repr(e))
+        return (plan.path, None)
+
+    def _execute_local(self, plans, overwrite, refresh):
+        """Execute plans on this process's session, with up to 'in_flight'
+        of them outstanding on separate threads.
+
+        @return: (iRODS path, error string or None) tuples, as a generator"""
+
+        return bounded_map(lambda plan: self._try_execute(plan, overwrite,
+            refresh), plans, self.in_flight)
+
+    def _failed(self, path, error):
+        self.failures += 1
+        metrics.OBJECTS_FAILED.inc()
+        log.error("Failed to apply metadata to %s: %s", path, error,
+            extra={'path': path, 'error': error})
+
+    def execute_plans(self, plans, overwrite = False, refresh = False):
+        """Execute a stream of plans, in this process if there is a single
+        executor, or otherwise across 'num_executors' worker processes which
+        each own an iRODS session. Plans are partitioned by a stable hash of
+        their path, so no two workers ever touch the same object. Each
+        process keeps up to 'in_flight' plans outstanding at once.
+
+        @param plans: Iterable of Plan objects, or of Change objects from a
+            change-set
+        @return: iRODS paths of successfully executed plans, as a generator,
+            in the order they complete"""
+
+        if self.num_executors <= 1:
+            for path, error in self._execute_local(plans, overwrite, refresh):
+                if error is None:
+                    metrics.OBJECTS_APPLIED.inc()
+                    yield path
+                else:
+                    self._failed(path, error)
+            return
+
+        results = multiprocessing.Queue()
+        queues = [multiprocessing.Queue(WORKER_QUEUE_SIZE)
+            for _ in range(self.num_executors)]
+        workers = [multiprocessing.Process(target=_worker,
+            args=(self.session_factory, plan_queue, results, overwrite,
+                refresh, self.in_flight, self.throttle), daemon=True)
+            for plan_queue in queues]
+        for worker in workers:
+            worker.start()
+
+        running = len(workers)
+        metrics.WORKER_QUEUE_DEPTH.set_function(lambda: sum(
+            plan_queue.qsize() for plan_queue in queues))
+
+        def collect(block):
+            nonlocal running
+            while running:
+                try:
+                    message = results.get(block, timeout=1)
+                except queue.Empty:
+                    if not block:
+                        return
+                    if not any(worker.is_alive() for worker in workers):
+                        # Pick up anything a worker sent before it exited
+                        block = False
+                    continue
+                kind = message[0]
+                if kind == _DONE:
+                    running -= 1
+                elif kind == _METRICS:
+                    metrics.REGISTRY.merge(message[1])
+                else:
+                    _, path, error = message
+                    if error is None:
+                        metrics.OBJECTS_APPLIED.inc()
+                        yield path
+                    else:
+                        self._failed(path, error)
+
+        try:
+            for plan in plans:
+                plan_queue = queues[partition(plan.path, self.num_executors)]
+                while True:
                     try:
-                        existing_AVU = existing_metadata.get_one(avu.attribute)
-                        if existing_AVU.value != avu.value or existing_AVU.units != avu.unit:
-                            new_AVU = iRODSMeta(avu.attribute,avu.value,avu.unit)
-                            existing_metadata[avu.attribute] = new_AVU 
-                    except:
-                        if avu.attribute:
-                            new_AVU = iRODSMeta(avu.attribute,avu.value,avu.unit)
-                            existing_metadata[avu.attribute] = new_AVU 
-                return
-
-            if not refresh and not overwrite:
-                for avu in planned_AVUs:
-                    try:
-                        existing_metadata.get_one(avu.attribute)
-                    except:
-                        new_AVU = iRODSMeta(avu.attribute,avu.value,avu.unit)
-                        if avu.attribute:
-                            existing_metadata[avu.attribute] = new_AVU
+                        plan_queue.put(plan, timeout=0.1)
+                        break
+                    except queue.Full:
+                        # Keep draining results so a busy worker can't stall
+                        # the others
+                        yield from collect(False)
+                        if not all(worker.is_alive() for worker in workers):
+                            raise RuntimeError("An execution worker died")
+                yield from collect(False)
+
+            for plan_queue in queues:
+                plan_queue.put(None)
+            yield from collect(True)
+        finally:
+            metrics.WORKER_QUEUE_DEPTH.set_function(None)
+            for worker in workers:
+                if running:
+                    worker.terminate()
+                worker.join()
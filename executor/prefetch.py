@@ -0,0 +1,162 @@
+import threading
+from collections import OrderedDict
+
+from core.backend import as_backend
+from planner.object_class import AVU
+
+# GenQuery conditions have a length limit, so IN (...) lists are kept short.
+IN_QUERY_CHUNK = 50
+
+
+class MetadataPrefetcher:
+    '''
+    Keeps an in-memory snapshot of existing AVUs so the executor doesn't have
+    to fetch an object's metadata before writing to it.
+    * On a miss, the AVUs of every sibling of the requested path are fetched
+      with one GenQuery, so reads cost O(collections) rather than O(objects).
+    * 'prefetch' loads a page of paths up front instead, which bounds memory
+      when a single collection is very large.
+    * Only the most recently used 'max_collections' parents are kept.
+    It is safe to share between the executor's apply threads. The lock is
+    never held while a collection is fetched: threads which need the same
+    collection wait for the one fetching it, and the rest carry on.
+
+    @param irods_session: iRODSSession object, or a backend from core.backend
+    '''
+    def __init__(self, irods_session, max_collections=16):
+        self.session = irods_session
+        self.backend = as_backend(irods_session)
+        self.max_collections = max_collections
+        self._snapshots = OrderedDict() # (parent, is_collection) -> snapshot
+        # (parent, is_collection) -> (Event set once fetched, {path: AVUs
+        # written while fetching})
+        self._fetching = {}
+        self._lock = threading.Lock()
+
+    def _store(self, key, snapshot):
+        self._snapshots[key] = snapshot
+        self._snapshots.move_to_end(key)
+        while len(self._snapshots) > self.max_collections:
+            self._snapshots.popitem(last=False)
+
+    @staticmethod
+    def _to_avus(metadata):
+        return {path: [AVU(*avu) for avu in avus]
+            for path, avus in metadata.items()}
+
+    def _claim(self, key):
+        """Start fetching a collection, unless another thread already is.
+        Must be called holding the lock.
+
+        @return: The Event of the other thread's fetch, or None if this
+            thread should fetch it"""
+        fetching = self._fetching.get(key)
+        if fetching is not None:
+            return fetching[0]
+        self._fetching[key] = (threading.Event(), {})
+        return None
+
+    def _finish(self, key, snapshot):
+        """Store what a fetch found, with any writes made meanwhile, and
+        wake the threads waiting for it. Must be called holding the lock."""
+        done, written = self._fetching.pop(key)
+        if snapshot is not None:
+            snapshot['paths'].update(written)
+            self._store(key, snapshot)
+        done.set()
+
+    def prefetch(self, paths, is_collection=False):
+        """Load the AVUs of a page of paths, grouped by parent collection.
+
+        @param paths: Iterable of iRODS paths
+        @param is_collection: True if the paths are collections"""
+
+        by_parent = OrderedDict()
+        for path in paths:
+            parent, name = path.rsplit('/', 1)
+            by_parent.setdefault(parent or '/', []).append(name)
+
+        for parent, names in by_parent.items():
+            key = (parent, is_collection)
+            while True:
+                with self._lock:
+                    snapshot = self._snapshots.get(key)
+                    if snapshot is not None and snapshot['complete']:
+                        break
+                    waiting = self._claim(key)
+                if waiting is None:
+                    self._prefetch(key, names)
+                    break
+                waiting.wait()
+
+    def _prefetch(self, key, names):
+        parent, is_collection = key
+        paths = {}
+        try:
+            for i in range(0, len(names), IN_QUERY_CHUNK):
+                chunk = names[i:i + IN_QUERY_CHUNK]
+                metadata = self.backend.query_metadata(parent, chunk,
+                    is_collection)
+                for name in chunk:
+                    path = parent.rstrip('/') + '/' + name
+                    paths[path] = [AVU(*avu) for avu in
+                        metadata.get(path, [])]
+        except BaseException:
+            with self._lock:
+                self._finish(key, None)
+            raise
+
+        with self._lock:
+            snapshot = self._snapshots.get(key) or \
+                {'complete': False, 'paths': {}}
+            snapshot['paths'].update(paths)
+            self._finish(key, snapshot)
+
+    def get(self, path, is_collection=False):
+        """Return the existing AVUs of a data object or collection.
+
+        @param path: iRODS path
+        @param is_collection: True if the path is a collection
+        @return: List of AVU objects"""
+
+        parent = path.rsplit('/', 1)[0] or '/'
+        key = (parent, is_collection)
+
+        while True:
+            with self._lock:
+                snapshot = self._snapshots.get(key)
+                if snapshot is not None and (path in snapshot['paths'] or
+                        snapshot['complete']):
+                    self._snapshots.move_to_end(key)
+                    return list(snapshot['paths'].get(path, []))
+                waiting = self._claim(key)
+            if waiting is None:
+                break
+            # Another thread is fetching the collection, which may hold the
+            # path
+            waiting.wait()
+
+        try:
+            metadata = self.backend.query_metadata(parent,
+                is_collection=is_collection)
+        except BaseException:
+            with self._lock:
+                self._finish(key, None)
+            raise
+
+        with self._lock:
+            snapshot = {'complete': True, 'paths': self._to_avus(metadata)}
+            self._finish(key, snapshot)
+            return list(snapshot['paths'].get(path, []))
+
+    def update(self, path, is_collection, avus):
+        """Record the AVUs an object holds after a write, so the snapshot
+        stays consistent for the rest of the run."""
+
+        key = (path.rsplit('/', 1)[0] or '/', is_collection)
+        with self._lock:
+            if key in self._fetching:
+                # The fetch may have read the object before the write
+                self._fetching[key][1][path] = list(avus)
+            if key in self._snapshots:
+                self._snapshots[key]['paths'][path] = list(avus)
@@ -1,38 +1,312 @@
 import argparse
+import functools
+import logging
+import os
+import sys
+from datetime import datetime, timedelta, timezone
 
 import planner.planner as planner
 from executor.executor import Executor
+import core.catalogue_snapshot as catalogue_snapshot
 import core.irods_wrapper as irods_wrapper
-import json
-
-
-def run(root_collection, config, include_collections=False, overwrite=False, num_workers=4, catalogue_file='catalogue.txt', progress_file='progress.txt', resume = False, refresh = False):
-    irods_session = irods_wrapper.create_session()
-    executor = Executor(irods_session, num_workers)
-    catalogue = irods_wrapper.get_irods_catalogue(root_collection)
-    if not resume:
-        
-        # with open(catalogue_file, 'w') as cf:
-        #     json.dump(catalogue, cf)
-        with open(progress_file, 'w') as pf:
-            for plan in planner.generate_plans(catalogue, config, progress_file, resume, include_collections):
-                executor.execute_plan(plan, overwrite, refresh)
-                pf.write(plan.path + "\n")
-    else:
-        # with open(catalogue_file, 'r') as cf:
-        #     catalogue = json.load(cf)
-        with open(progress_file, 'a') as pf:
-            for plan in planner.generate_plans(catalogue, config, progress_file, resume, include_collections):
-                executor.execute_plan(plan, overwrite, refresh)
-                pf.write(plan.path + "\n")
+import core.logger as logger
+import core.metrics as metrics
+import core.pipeline as pipeline
+from core.backend import BACKENDS, create_backend, default_in_flight, \
+    list_catalogue
+from core.connection_pool import DEFAULT_KEEPALIVE, DEFAULT_SIZE
+from core.partition import in_shard, parse_shard, shard_file
+from core.progress import ProgressJournal
+from core.throttle import Throttle
+from executor.changeset import ChangeSetError, ChangeSetReader, diff_plans, \
+    write_changeset
+from executor.prefetch import MetadataPrefetcher
+from planner.header_cache import HeaderCache
 
+# Incremental runs list objects modified a little before the last successful
+# run started, in case the iRODS server's clock is behind this machine's.
+WATERMARK_OVERLAP = timedelta(minutes=10)
 
-    
+log = logger.get_logger('CLI')
 
-if __name__ == "__main__":
 
-    parser = argparse.ArgumentParser(description="Apply metadata AVUs to all " +
-        "data objects in an iRODS collection.")
+def run(root_collection, config, include_collections=False, overwrite=False, num_workers=4, catalogue_file='catalogue.snap', progress_file='progress.db', resume = False, refresh = False, queue_depth=100, in_flight=None, throttle=None, header_cache_file='header_cache.db', header_cache_size=1024, inference_jobs=4, reuse_catalogue=False, incremental=False, shard=None, backend='irodsclient'):
+    if shard is not None:
+        catalogue_file, progress_file, header_cache_file = _shard_files(
+            shard, catalogue_file, progress_file, header_cache_file)
+    # One session, and its pool of connections, serves listing, planning
+    # and (without worker processes) applying metadata
+    session = irods_wrapper.create_session()
+    executor = _executor(num_workers, in_flight, throttle, backend, session)
+    root = root_collection.rstrip('/')
+    # Completed paths are committed to the journal in batches, and a resumed
+    # run skips the paths it already holds
+    journal = ProgressJournal(progress_file, resume)
+    since = None
+    if incremental:
+        since = journal.watermark(root)
+        if since is None:
+            log.info("No previous successful run over %s, listing every "
+                "object.", root)
+        else:
+            since -= WATERMARK_OVERLAP
+            log.info("Listing objects modified since %s.",
+                since.isoformat())
+
+    catalogue = _catalogue(root_collection, catalogue_file,
+        resume or reuse_catalogue, since, journal, shard, backend, session)
+    header_cache = _header_cache(header_cache_file, header_cache_size,
+        session)
+    try:
+        _run(executor, catalogue, config, include_collections, overwrite,
+            journal, resume, refresh, queue_depth, header_cache, session,
+            inference_jobs)
+        # Only a run which applied everything moves the watermark on, to
+        # when its listing started, so objects which failed or changed
+        # during the run are listed again next time
+        if executor.failures:
+            log.warning("%d objects failed, so the next incremental run "
+                "will list objects modified since the last successful run "
+                "again.", executor.failures)
+        else:
+            journal.advance_watermark(root)
+    finally:
+        if header_cache is not None:
+            header_cache.close()
+        if isinstance(catalogue, catalogue_snapshot.CatalogueSnapshot):
+            catalogue.close()
+        # An irodsclient executor shares run()'s session, which is only
+        # cleaned up once, here
+        if executor.session is not None and \
+                getattr(executor.session, 'session', None) is not session:
+            executor.session.cleanup()
+        session.cleanup()
+        journal.close()
+
+
+def plan(root_collection, config, changeset_file, include_collections=False, overwrite=False, refresh=False, catalogue_file='catalogue.snap', reuse_catalogue=False, throttle=None, header_cache_file='header_cache.db', header_cache_size=1024, inference_jobs=4, shard=None, backend='irodsclient'):
+    """Work out the AVU changes a run would make without making any, and
+    write them to a change-set file for 'apply' to replay."""
+    if shard is not None:
+        catalogue_file, header_cache_file = _shard_files(shard,
+            catalogue_file, header_cache_file)
+    if throttle is not None:
+        irods_wrapper.set_throttle(throttle)
+    planning_session = irods_wrapper.create_session()
+    catalogue = _catalogue(root_collection, catalogue_file, reuse_catalogue,
+        shard=shard, backend=backend, session=planning_session)
+    header_cache = _header_cache(header_cache_file, header_cache_size,
+        planning_session)
+    # Headers are always read through python-irodsclient, but existing
+    # metadata is read through the chosen backend
+    metadata_backend = create_backend(backend, planning_session)
+    summary = {}
+    try:
+        plans = pipeline.buffered(planner.generate_plans(catalogue, config,
+            include_collections=include_collections,
+            header_cache=header_cache, session=planning_session,
+            inference_jobs=inference_jobs))
+        changes = diff_plans(plans, MetadataPrefetcher(metadata_backend),
+            overwrite, refresh, summary)
+        write_changeset(changes, changeset_file,
+            root_collection.rstrip('/'), overwrite, refresh)
+    finally:
+        if header_cache is not None:
+            header_cache.close()
+        if isinstance(catalogue, catalogue_snapshot.CatalogueSnapshot):
+            catalogue.close()
+        metadata_backend.cleanup()
+        planning_session.cleanup()
+
+    log.info("Planned %d objects: %d to change, %d attributes to add, %d "
+        "to modify and %d to remove. Written to %s.",
+        summary.get('objects', 0), summary.get('changed', 0),
+        summary.get('added', 0), summary.get('modified', 0),
+        summary.get('removed', 0), changeset_file)
+    return summary
+
+
+def apply(changeset_file, num_workers=4, progress_file='progress.db', resume=False, queue_depth=100, in_flight=None, throttle=None, backend='irodsclient'):
+    """Replay a change-set written by 'plan'. Nothing is read from iRODS
+    first, so the changes are applied at the full rate of the workers. They
+    were diffed against each object's metadata when they were planned, so
+    a change-set should be applied before anything else changes it."""
+    try:
+        changes = ChangeSetReader(changeset_file)
+    except ChangeSetError as e:
+        log.error("%s", e)
+        return False
+    executor = _executor(num_workers, in_flight, throttle, backend)
+    log.info("Applying changes planned from %s.",
+        changes.header.get('root'))
+    applied = 0
+    with changes, ProgressJournal(progress_file, resume) as journal:
+        pending = iter(changes)
+        if resume:
+            pending = journal.pending(pending, key=lambda change: change.path)
+        try:
+            for path in executor.execute_plans(pipeline.buffered(pending,
+                    queue_depth, metrics.PLAN_QUEUE_DEPTH)):
+                journal.record(path)
+                applied += 1
+        finally:
+            if executor.session is not None:
+                executor.session.cleanup()
+    log.info("Applied %d changes, %d failed.", applied, executor.failures)
+    return executor.failures == 0
+
+
+def status(progress_file, shards):
+    """Print how far each shard of a sharded run has got."""
+    total = 0
+    for index in range(1, shards + 1):
+        path = shard_file(progress_file, (index, shards))
+        if not os.path.exists(path):
+            print("Shard {}/{}: not started ({} missing)".format(index,
+                shards, path))
+            continue
+        with ProgressJournal(path) as journal:
+            done = len(journal)
+            watermarks = journal.watermarks()
+        total += done
+        print("Shard {}/{}: {} objects done{}".format(index, shards, done,
+            "".join(", {} complete up to {}".format(root, time.isoformat())
+            for root, time in sorted(watermarks.items()))))
+    print("{} objects done across {} shards.".format(total, shards))
+
+
+def merge(progress_file, shards):
+    """Merge the journals of every shard of a sharded run into one, which an
+    unsharded run can then resume from or run incrementally after."""
+    paths = [shard_file(progress_file, (index, shards))
+        for index in range(1, shards + 1)]
+    missing = [path for path in paths if not os.path.exists(path)]
+    for path in missing:
+        log.warning("%s is missing, so its shard is left out.", path)
+    with ProgressJournal(progress_file) as journal:
+        # Without every shard, the merged journal doesn't cover the whole
+        # root collection, so no watermark can be taken from it
+        journal.merge([path for path in paths if path not in missing],
+            with_watermarks=not missing)
+        print("Merged {} shards into {} ({} objects done).".format(
+            shards - len(missing), progress_file, len(journal)))
+    return not missing
+
+
+def _shard_files(shard, *paths):
+    # Shards of a job array run at once, so each needs its own files
+    log.info("Running shard %d/%d.", *shard)
+    return [shard_file(path, shard) for path in paths]
+
+
+def _executor(num_workers, in_flight, throttle, backend='irodsclient', session=None):
+    # With more than one worker, each worker process opens its own backend.
+    # Otherwise the executor shares this process's session, if given.
+    if in_flight is None:
+        in_flight = default_in_flight(backend)
+    irods_session = None
+    if num_workers <= 1:
+        irods_session = create_backend(backend, session)
+    worker_throttle = None
+    if throttle is not None:
+        # Split the limits between this process, which lists the catalogue
+        # and reads headers, and each worker process
+        if num_workers > 1:
+            worker_throttle = throttle.share(num_workers + 1)
+            throttle = throttle.share(num_workers + 1)
+        irods_wrapper.set_throttle(throttle)
+    return Executor(irods_session, num_workers,
+        session_factory=functools.partial(_worker_backend, backend,
+            irods_wrapper.get_pool_options()),
+        in_flight=in_flight, throttle=worker_throttle)
+
+
+def _worker_backend(backend, pool_options):
+    # Worker processes give their sessions the same connection pool options
+    # as the main process
+    irods_wrapper.set_pool_options(**pool_options)
+    return create_backend(backend)
+
+
+def _catalogue(root_collection, catalogue_file, reuse, since=None, journal=None, shard=None, backend='irodsclient', session=None):
+    """Returns the catalogue snapshot of a previous listing if 'reuse' is
+    set and there is one, or otherwise starts listing the root collection.
+
+    @param since: Only list objects modified since this datetime
+    @param journal: ProgressJournal to record when the listing started in
+    @param shard: (i, N) tuple. Only paths in this shard are listed
+    @param backend: Name of the backend to list the catalogue with
+    @param session: iRODSSession for the irodsclient backend to share"""
+    root = root_collection.rstrip('/')
+    listing = _listing_key(root, since)
+    if reuse:
+        catalogue = _open_snapshot(catalogue_file, listing)
+        if catalogue is not None:
+            return catalogue
+    # Paths are streamed into the planner as each catalogue page arrives, so
+    # the first plan is executed before the listing has finished. The
+    # listing is drained into the snapshot on a thread of its own rather
+    # than at the pace of execution, so a run which fails once the listing
+    # is done can be resumed without listing again. Collections are always
+    # listed, so the snapshot can be reused with or without
+    # --including_collections.
+    if journal is not None:
+        journal.start_listing(root, datetime.now(timezone.utc))
+    entries = list_catalogue(root_collection, backend,
+        include_collections=True, since=since, session=session)
+    if shard is not None:
+        entries = in_shard(entries, shard, key=lambda entry: entry[0])
+    return catalogue_snapshot.spool_snapshot(entries, catalogue_file,
+        listing)
+
+
+def _header_cache(header_cache_file, header_cache_size, planning_session):
+    # Fingerprints are looked up through the planning session. Headers of
+    # files unchanged since a previous run are read from disk instead.
+    if header_cache_size <= 0:
+        return None
+    return HeaderCache(header_cache_file, planning_session,
+        header_cache_size * 1024 ** 2)
+
+
+def _listing_key(root, since):
+    """Returns what a catalogue snapshot records as its root: the root
+    collection, and for incremental listings the time they start from, so
+    an incremental listing is never reused as a full one or vice versa."""
+    if since is None:
+        return root
+    return "{}@{}".format(root, since.isoformat())
+
+
+def _open_snapshot(catalogue_file, listing):
+    """Returns the catalogue snapshot of a previous listing, or None if there
+    isn't a complete one.
+
+    @param listing: The root collection, as given by '_listing_key'"""
+    try:
+        snapshot = catalogue_snapshot.CatalogueSnapshot(catalogue_file)
+    except catalogue_snapshot.SnapshotError as e:
+        log.info("%s, listing the catalogue again.", e)
+        return None
+    if snapshot.root != listing:
+        log.info("Catalogue snapshot %s is of %s, listing the catalogue "
+            "again.", catalogue_file, snapshot.root)
+        snapshot.close()
+        return None
+    log.info("Using catalogue snapshot %s (%d paths).", catalogue_file,
+        len(snapshot))
+    return snapshot
+
+
+def _run(executor, catalogue, config, include_collections, overwrite, journal, resume, refresh, queue_depth, header_cache, planning_session, inference_jobs):
+    # Plans are generated on a separate thread, at most queue_depth ahead of
+    # execution, so header inference overlaps iRODS writes
+    plans = pipeline.buffered(planner.generate_plans(catalogue, config, journal, resume, include_collections, header_cache, planning_session, inference_jobs), queue_depth, metrics.PLAN_QUEUE_DEPTH)
+    for path in executor.execute_plans(plans, overwrite, refresh):
+        journal.record(path)
+
+
+def _add_planning_arguments(parser):
     parser.add_argument('--config', '-c', nargs='?', default='config.yaml',
         help="Configuration file path.")
     parser.add_argument('--including_collections', '-i', action='store_const',
@@ -40,22 +314,232 @@ if __name__ == "__main__":
         "AVUs to collections as well as data objects. ")
     parser.add_argument('--overwrite', '-o', action='store_const', const=True,
         default=False, help="Whether to overwrite existing AVUs in case of" + "conflict")
+    parser.add_argument('--refresh', action='store_const', const=True,
+        default=False, help="Whether to remove old avus")
     parser.add_argument('--catalogue_file', '-f', nargs=1,
-        default=["catalogue.txt"], help="Path to the file which logs the" + "catalogue.")
+        default=["catalogue.snap"], help="Path to the file which logs the" + "catalogue.")
+    parser.add_argument('--reuse_catalogue', action='store_const',
+        const=True, default=False, help="Plan from the catalogue file " +
+        "written by a previous run instead of listing the root collection " +
+        "again. Implied by --resume.")
+    parser.add_argument('--inference_jobs', type=int, default=4,
+        help="Number of files whose headers are read concurrently while " +
+        "planning. Use 1 to read them one at a time.")
+    parser.add_argument('--header_cache', default='header_cache.db',
+        help="Path to the database caching file headers between runs.")
+    parser.add_argument('--header_cache_size', type=int, default=1024,
+        help="Maximum size of the header cache in MiB. Use 0 to read every " +
+        "header from iRODS.")
+    parser.add_argument('--shard', type=_shard_argument, default=None,
+        help="Only process the i-th of N deterministic slices of the " +
+        "catalogue, given as i/N counting from 1 (for example " +
+        "$LSB_JOBINDEX/N in an LSF job array). Each shard keeps its own " +
+        "catalogue, progress and header cache files.")
+
+
+def _add_execution_arguments(parser):
     parser.add_argument('--progress_file', '-p', nargs=1,
-        default = ["progress.txt"], help="Path to the file which logs progress.")
+        default = ["progress.db"], help="Path to the journal which logs " +
+        "progress.")
     parser.add_argument('--resume', '-r', action='store_const', const=True,
         default=False, help="Whether to restart")
-    parser.add_argument('--refresh', action='store_const', const=True,
-        default=False, help="Whether to remove old avus")
-    parser.add_argument('root_collection', nargs=1,
-        help="Path to the root iRODS collection.")
-    args = parser.parse_args()
-    WORKERS = 4
+    parser.add_argument('--workers', '-w', type=int, default=4,
+        help="Number of execution worker processes, each with its own " +
+        "iRODS session. Use 1 to apply metadata in the main process.")
+    parser.add_argument('--queue_depth', type=int, default=100,
+        help="Maximum number of plans generated ahead of execution. Use 0 " +
+        "to plan and apply each object in lockstep.")
+    parser.add_argument('--in_flight', type=int, default=None,
+        help="Maximum number of plans each execution process applies " +
+        "concurrently. Defaults to 1, or 64 with --backend baton.")
+
+
+def _add_throttle_arguments(parser):
+    parser.add_argument('--max_ops', type=float, default=None,
+        help="Hard cap on iRODS operations per second, across all " +
+        "processes.")
+    parser.add_argument('--max_concurrency', type=int, default=None,
+        help="Maximum iRODS operations in flight at once, across all " +
+        "processes.")
+    parser.add_argument('--adaptive', action='store_const', const=True,
+        default=False, help="Shrink the number of iRODS operations in " +
+        "flight when latency or errors rise, and grow it while the server " +
+        "is healthy.")
+    parser.add_argument('--target_latency', type=float, default=0.5,
+        help="Seconds above which --adaptive treats an operation as slow.")
+
+
+def _add_backend_arguments(parser):
+    parser.add_argument('--backend', choices=BACKENDS, default='irodsclient',
+        help="How to list the catalogue and read and write metadata: " +
+        "through python-irodsclient, or by streaming operations to a " +
+        "long-lived baton-do process, which must be on the PATH. File " +
+        "headers are always read through python-irodsclient.")
+    parser.add_argument('--connections', type=int, default=DEFAULT_SIZE,
+        help="Maximum iRODS connections each process keeps open, shared " +
+        "by listing the catalogue, reading headers and applying metadata.")
+    parser.add_argument('--keepalive', type=int, default=DEFAULT_KEEPALIVE,
+        help="Seconds an iRODS connection can be idle before TCP " +
+        "keepalive probes are sent. Use 0 for the system default.")
+
+
+def _add_metrics_arguments(parser):
+    parser.add_argument('--metrics_file', default=None,
+        help="Prometheus textfile to write metrics to as the run goes, " +
+        "such as a .prom file in node_exporter's textfile directory.")
+    parser.add_argument('--metrics_interval', type=float, default=15,
+        help="Seconds between writes of --metrics_file.")
+    parser.add_argument('--metrics_summary', default=None,
+        help="JSON file to write a summary of the run's metrics to when " +
+        "it finishes.")
+
+
+def _add_logging_arguments(parser):
+    parser.add_argument('--quiet', '-q', action='store_const', const=True,
+        default=False, help="Only log warnings and errors.")
+    parser.add_argument('--verbose', '-v', action='store_const', const=True,
+        default=False, help="Also log every object as it is planned and " +
+        "applied.")
+    parser.add_argument('--log_format', choices=('text', 'json'),
+        default='text', help="Log as text, or as JSON lines with each " +
+        "object's path in a field of its own.")
+    parser.add_argument('--log_file', default=None,
+        help="File to append the log to, instead of stderr.")
+    parser.add_argument('--log_rate', type=int, default=logger.DEFAULT_RATE,
+        help="Maximum messages about single objects logged a second at " +
+        "each level below errors. Use 0 to log every one.")
+
+
+def _configure_logging(args):
+    level = logging.INFO
+    if args.quiet:
+        level = logging.WARNING
+    elif args.verbose:
+        level = logging.DEBUG
+    logger.configure(level, args.log_format == 'json', path=args.log_file,
+        rate=args.log_rate)
+
+
+def _shard_argument(text):
+    try:
+        return parse_shard(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def _throttle(args):
+    if not (args.max_ops or args.max_concurrency or args.adaptive):
+        return None
+    max_concurrency = args.max_concurrency or 64
+    concurrency = args.max_concurrency
+    if args.adaptive:
+        # Start low and let AIMD find the server's limit
+        concurrency = min(4, max_concurrency)
+    return Throttle(args.max_ops, concurrency, args.adaptive,
+        max_concurrency, args.target_latency, irods_wrapper.OVERLOAD_ERRORS)
+
+
+if __name__ == "__main__":
+
+    # 'plan' and 'apply' split a run in two: the changes are worked out and
+    # written to a change-set first, then replayed later. Without either, a
+    # run plans and applies in one go.
+    command = None
+    argv = sys.argv[1:]
+    if argv and argv[0] in ('plan', 'apply', 'status', 'merge'):
+        command, argv = argv[0], argv[1:]
+
+    # 'status' and 'merge' report on and combine the progress journals of a
+    # run split into --shard i/N tasks
+    if command in ('status', 'merge'):
+        parser = argparse.ArgumentParser(prog='main.py ' + command,
+            description="Show how far each shard of a sharded run has got."
+            if command == 'status' else "Merge the progress journals of " +
+            "every shard of a sharded run into one.")
+        parser.add_argument('--progress_file', '-p', default='progress.db',
+            help="Progress file path the shards were given.")
+        parser.add_argument('--shards', '-n', type=int, required=True,
+            help="Number of shards, N in --shard i/N.")
+        args = parser.parse_args(argv)
+        if command == 'status':
+            status(args.progress_file, args.shards)
+        elif not merge(args.progress_file, args.shards):
+            sys.exit(1)
+        sys.exit(0)
+
+    if command == 'apply':
+        parser = argparse.ArgumentParser(prog='main.py apply',
+            description="Apply the AVU changes in a change-set written by " +
+            "'main.py plan'.")
+    else:
+        parser = argparse.ArgumentParser(description="Apply metadata AVUs " +
+            "to all data objects in an iRODS collection.")
+        if command == 'plan':
+            parser.prog = 'main.py plan'
+            parser.description = ("Work out the AVU changes a run would " +
+                "make and write them to a change-set, without changing " +
+                "anything.")
+        _add_planning_arguments(parser)
+    if command != 'plan':
+        _add_execution_arguments(parser)
+    _add_throttle_arguments(parser)
+    _add_backend_arguments(parser)
+    _add_metrics_arguments(parser)
+    _add_logging_arguments(parser)
+
+    if command is None:
+        parser.add_argument('--incremental', action='store_const', const=True,
+            default=False, help="Only process objects created or modified " +
+            "since the last run over the root collection which applied " +
+            "metadata without errors.")
+    if command == 'plan':
+        parser.add_argument('--changes', required=True, help="Path to " +
+            "write the change-set to. A name ending in .gz is compressed.")
+    if command == 'apply':
+        parser.add_argument('changeset', help="Path to the change-set.")
+    else:
+        parser.add_argument('root_collection', nargs=1,
+            help="Path to the root iRODS collection.")
+    args = parser.parse_args(argv)
+    # Logging is set up once, before anything logs; messages are written on
+    # a thread of their own
+    _configure_logging(args)
+    throttle = _throttle(args)
+    irods_wrapper.set_pool_options(size=args.connections,
+        keepalive=args.keepalive)
 
     import time
     start_time = time.time()
-    run(args.root_collection[0], args.config, args.including_collections,
-        args.overwrite, WORKERS, args.catalogue_file[0], args.progress_file[0],
-        args.resume, args.refresh)
-    print("--- %s seconds ---" % (time.time() - start_time))
\ No newline at end of file
+    # Metrics are written as the run goes, so farm monitoring can show where
+    # a run is spending its time before it finishes
+    exporter = None
+    if args.metrics_file:
+        exporter = metrics.TextfileExporter(args.metrics_file,
+            args.metrics_interval)
+        exporter.start()
+    try:
+        if command == 'plan':
+            plan(args.root_collection[0], args.config, args.changes,
+                args.including_collections, args.overwrite, args.refresh,
+                args.catalogue_file[0], args.reuse_catalogue, throttle=throttle,
+                header_cache_file=args.header_cache,
+                header_cache_size=args.header_cache_size,
+                inference_jobs=args.inference_jobs, shard=args.shard,
+                backend=args.backend)
+        elif command == 'apply':
+            apply(args.changeset, args.workers, args.progress_file[0],
+                args.resume, args.queue_depth, args.in_flight, throttle,
+                args.backend)
+        else:
+            run(args.root_collection[0], args.config, args.including_collections,
+                args.overwrite, args.workers, args.catalogue_file[0], args.progress_file[0],
+                args.resume, args.refresh, args.queue_depth, args.in_flight,
+                throttle, args.header_cache, args.header_cache_size,
+                args.inference_jobs, args.reuse_catalogue, args.incremental,
+                args.shard, args.backend)
+    finally:
+        if exporter is not None:
+            exporter.stop()
+        if args.metrics_summary:
+            metrics.write_summary(args.metrics_summary)
+    log.info("--- %s seconds ---", time.time() - start_time)
@@ -0,0 +1,192 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import core.irods_wrapper as irods_wrapper
+import core.metrics as metrics
+
+# Headers are written in batches, since committing every insert would cost
+# an fsync per file.
+COMMIT_INTERVAL = 100
+DEFAULT_MAX_BYTES = 1024 ** 3
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS headers (
+    path TEXT NOT NULL,
+    file_type TEXT NOT NULL,
+    checksum TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    modify_time TEXT NOT NULL,
+    header TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    used REAL NOT NULL,
+    PRIMARY KEY (path, file_type)
+);
+CREATE INDEX IF NOT EXISTS headers_used ON headers (used);
+'''
+
+
+class HeaderCache:
+    '''
+    On-disk cache of parsed file headers, so rerunning a configuration over
+    files that haven't changed doesn't stream every header out of iRODS
+    again.
+    * Entries are keyed by iRODS path and file type, and are only used while
+      the data object's checksum, size and modify time still match.
+    * Those fingerprints are fetched one collection at a time, like the
+      executor's metadata snapshots, so checking the cache costs
+      O(collections) queries rather than one per file.
+    * Once the cached headers take up more than 'max_bytes', the least
+      recently used ones are evicted.
+    It is safe to share between threads.
+
+    @param db_path: Path to the SQLite database file
+    @param irods_session: iRODSSession object used to look up fingerprints.
+        A new session is created, and cleaned up by 'close', if one isn't
+        provided
+    @param max_bytes: Maximum total size of the cached headers, in bytes
+    @param max_collections: Number of collections' fingerprints kept in
+        memory
+    '''
+    def __init__(self, db_path, irods_session=None,
+            max_bytes=DEFAULT_MAX_BYTES, max_collections=16):
+        self.max_bytes = max_bytes
+        self.max_collections = max_collections
+        self.session = irods_session
+        self._owns_session = irods_session is None
+        self._fingerprints = OrderedDict() # parent -> {path: fingerprint}
+        self._fetching = {} # parent -> Event set once queried
+        self._pending = 0
+        self._lock = threading.RLock()
+        self._session_lock = threading.Lock()
+
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        self._bytes = self._db.execute(
+            'SELECT COALESCE(SUM(bytes), 0) FROM headers').fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._lock, self._session_lock:
+            self._db.commit()
+            self._db.close()
+            if self._owns_session and self.session is not None:
+                self.session.cleanup()
+                self.session = None
+
+    def fingerprint(self, path):
+        """Return the (checksum, size, modify time) of a data object, or None
+        if it can't be found.
+
+        The lock is never held while a collection's fingerprints are
+        queried: threads which need the same collection wait for the one
+        querying it, and the rest carry on."""
+
+        parent = path.rsplit('/', 1)[0] or '/'
+        while True:
+            with self._lock:
+                fingerprints = self._fingerprints.get(parent)
+                if fingerprints is not None:
+                    self._fingerprints.move_to_end(parent)
+                    return fingerprints.get(path)
+                waiting = self._fetching.get(parent)
+                if waiting is None:
+                    self._fetching[parent] = threading.Event()
+                    break
+            waiting.wait()
+
+        fingerprints = None
+        try:
+            fingerprints = irods_wrapper.query_fingerprints(self._session(),
+                parent)
+        finally:
+            with self._lock:
+                if fingerprints is not None:
+                    self._fingerprints[parent] = fingerprints
+                    while len(self._fingerprints) > self.max_collections:
+                        self._fingerprints.popitem(last=False)
+                self._fetching.pop(parent).set()
+        return fingerprints.get(path)
+
+    def _session(self):
+        with self._session_lock:
+            if self.session is None:
+                self.session = irods_wrapper.create_session()
+            return self.session
+
+    def get(self, path, file_type, load):
+        """Return the parsed header of a file, from the cache if the file is
+        unchanged since it was stored, or by calling 'load' otherwise.
+
+        @param path: iRODS path of the file
+        @param file_type: Infer type, such as 'sequence' or 'variant'
+        @param load: Function taking the path and returning the parsed
+            header, or None if it can't be read. Failures aren't cached
+        @return: Header dictionary, or None"""
+
+        fingerprint = self.fingerprint(path)
+        if fingerprint is None:
+            metrics.HEADER_CACHE_MISSES.inc()
+            return load(path)
+
+        with self._lock:
+            row = self._db.execute('SELECT checksum, size, modify_time, '
+                'header FROM headers WHERE path = ? AND file_type = ?',
+                (path, file_type)).fetchone()
+            if row is not None and tuple(row[:3]) == fingerprint:
+                self._db.execute('UPDATE headers SET used = ? WHERE path = ? '
+                    'AND file_type = ?', (time.time(), path, file_type))
+                self._written()
+                metrics.HEADER_CACHE_HITS.inc()
+                return json.loads(row[3])
+
+        metrics.HEADER_CACHE_MISSES.inc()
+        header = load(path)
+        if header is not None:
+            self._store(path, file_type, fingerprint, header)
+        return header
+
+    def _store(self, path, file_type, fingerprint, header):
+        text = json.dumps(header, separators=(',', ':'))
+        size = len(path) + len(text)
+        with self._lock:
+            old = self._db.execute('SELECT bytes FROM headers WHERE path = ? '
+                'AND file_type = ?', (path, file_type)).fetchone()
+            if old is not None:
+                self._bytes -= old[0]
+            self._db.execute('INSERT OR REPLACE INTO headers VALUES '
+                '(?, ?, ?, ?, ?, ?, ?, ?)', (path, file_type) + fingerprint +
+                (text, size, time.time()))
+            self._bytes += size
+            if self._bytes > self.max_bytes:
+                self._evict()
+            self._written()
+
+    def _evict(self):
+        """Delete least recently used headers until the cache is back under
+        90% of its size limit, so eviction doesn't run on every insert."""
+
+        target = self.max_bytes * 0.9
+        rows = self._db.execute('SELECT path, file_type, bytes FROM headers '
+            'ORDER BY used')
+        doomed = []
+        for path, file_type, size in rows:
+            if self._bytes <= target:
+                break
+            doomed.append((path, file_type))
+            self._bytes -= size
+        self._db.executemany('DELETE FROM headers WHERE path = ? AND '
+            'file_type = ?', doomed)
+
+    def _written(self):
+        self._pending += 1
+        if self._pending >= COMMIT_INTERVAL:
+            self._db.commit()
+            self._pending = 0
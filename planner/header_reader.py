@@ -0,0 +1,255 @@
+"""Reads the header of a SAM, BAM, CRAM, VCF or BCF file straight out of an
+open data object, decoding only as many bytes as the header takes instead of
+handing the whole file to samtools or bcftools."""
+
+import bz2
+import lzma
+import re
+import struct
+import zlib
+
+# Bytes fetched from iRODS per read. BGZF blocks are at most 64 KiB, and most
+# headers fit in the first one.
+READ_SIZE = 64 * 1024
+
+_GZIP_MAGIC = b'\x1f\x8b'
+
+# CRAM block compression methods the standard library can decode. Headers
+# are written with gzip in practice; rANS and the like are only used for
+# record data.
+_CRAM_DECOMPRESSORS = {
+    0: lambda data: data,
+    1: lambda data: zlib.decompress(data, 31),
+    2: bz2.decompress,
+    3: lzma.decompress
+}
+_CRAM_FILE_HEADER_BLOCK = 0
+
+_BCF_IDX = re.compile(r',IDX=[0-9]+>$', re.MULTILINE)
+
+
+class HeaderFormatError(Exception):
+    """The file isn't a file this module can read the header of."""
+
+
+class _Reader:
+    """Hands out exact numbers of bytes from an iterator of chunks, pulling
+    more chunks only as needed. Chunks are appended to one buffer, whose
+    bytes are only dropped once most of it has been handed out, so reading
+    a large header costs time linear in its size."""
+
+    def __init__(self, chunks, data=b''):
+        self._chunks = chunks
+        self._data = bytearray(data)
+        self._offset = 0
+
+    def take(self, size):
+        while len(self._data) - self._offset < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                raise HeaderFormatError("File ends inside its header")
+            if self._offset > len(self._data) // 2:
+                del self._data[:self._offset]
+                self._offset = 0
+            self._data += chunk
+        start = self._offset
+        self._offset += size
+        return bytes(self._data[start:self._offset])
+
+    def byte(self):
+        return self.take(1)[0]
+
+    def int32(self):
+        return struct.unpack('<i', self.take(4))[0]
+
+    def itf8(self):
+        """CRAM's variable length 32 bit integer."""
+        first = self.byte()
+        if first < 0x80:
+            return first
+        if first < 0xC0:
+            return (first & 0x3F) << 8 | self.byte()
+        if first < 0xE0:
+            return (first & 0x1F) << 16 | int.from_bytes(self.take(2), 'big')
+        if first < 0xF0:
+            return (first & 0x0F) << 24 | int.from_bytes(self.take(3), 'big')
+        rest = self.take(4)
+        value = ((first & 0x0F) << 28 | rest[0] << 20 | rest[1] << 12 |
+            rest[2] << 4 | rest[3] & 0x0F)
+        return value - (1 << 32) if value & 0x80000000 else value
+
+    def ltf8(self):
+        """CRAM's variable length 64 bit integer. The number of leading set
+        bits in the first byte is the number of bytes which follow it."""
+        first = self.byte()
+        extra = 0
+        while extra < 8 and first & (0x80 >> extra):
+            extra += 1
+        value = first & (0xFF >> (extra + 1))
+        for byte in self.take(extra):
+            value = value << 8 | byte
+        return value
+
+
+def _chunks(stream):
+    while True:
+        chunk = stream.read(READ_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _prepend(first, chunks):
+    yield first
+    yield from chunks
+
+
+def _inflate(chunks):
+    """Decompress concatenated gzip members, which is all a BGZF file is,
+    yielding data as soon as each chunk of input is decoded."""
+
+    decompressor = zlib.decompressobj(31)
+    for chunk in chunks:
+        while chunk:
+            try:
+                data = decompressor.decompress(chunk)
+            except zlib.error as e:
+                raise HeaderFormatError("Invalid BGZF block: {}".format(e))
+            if data:
+                yield data
+            chunk = b''
+            if decompressor.eof:
+                chunk = decompressor.unused_data
+                decompressor = zlib.decompressobj(31)
+
+
+def _bam_header(chunks):
+    reader = _Reader(_inflate(chunks))
+    if reader.take(4) != b'BAM\x01':
+        raise HeaderFormatError("Not a BAM file")
+    length = reader.int32()
+    return reader.take(length)
+
+
+def _cram_header(reader):
+    major = reader.take(6)[4]
+    reader.take(20) # file ID
+    if major < 2:
+        raise HeaderFormatError("CRAM {} isn't supported".format(major))
+
+    # The first container only holds the SAM header block. Its length,
+    # reference, alignment and record counts don't matter here.
+    reader.take(4)
+    for _ in range(4):
+        reader.itf8()
+    reader.ltf8()
+    reader.ltf8()
+    reader.itf8() # number of blocks
+    for _ in range(reader.itf8()):
+        reader.itf8() # landmarks
+    if major >= 3:
+        reader.take(4) # CRC32
+
+    method = reader.byte()
+    content_type = reader.byte()
+    reader.itf8() # content ID
+    size = reader.itf8()
+    reader.itf8() # uncompressed size
+    if content_type != _CRAM_FILE_HEADER_BLOCK:
+        raise HeaderFormatError("CRAM file doesn't start with a header")
+    if method not in _CRAM_DECOMPRESSORS:
+        raise HeaderFormatError("Unsupported CRAM header compression "
+            "method {}".format(method))
+    block = _CRAM_DECOMPRESSORS[method](reader.take(size))
+
+    length = struct.unpack('<i', block[:4])[0]
+    return block[4:4 + length]
+
+
+def _leading_lines(chunks, prefix, last=None):
+    """Return the lines at the top of a text file which start with 'prefix',
+    stopping early after a line starting with 'last'. Chunks are appended to
+    one bytearray, so a long header isn't copied on every read."""
+
+    data = bytearray()
+    start = 0
+    for chunk in chunks:
+        data += chunk
+        while True:
+            end = data.find(b'\n', start)
+            if end == -1:
+                break
+            line = data[start:end]
+            if not line.startswith(prefix):
+                return bytes(data[:start])
+            start = end + 1
+            if last is not None and line.startswith(last):
+                return bytes(data[:start])
+    if not data[start:].startswith(prefix):
+        return bytes(data[:start])
+    return bytes(data)
+
+
+def _decode(header):
+    try:
+        return header.rstrip(b'\x00').decode('UTF-8')
+    except UnicodeDecodeError as e:
+        raise HeaderFormatError("Header isn't valid UTF-8: {}".format(e))
+
+
+def read_alignment_header(stream):
+    """Return the SAM header text of a SAM, BAM or CRAM file.
+
+    @param stream: Binary file-like object positioned at the start of the
+        file, such as an open iRODS data object
+    @return: Header text
+    @raise HeaderFormatError: If the header can't be decoded"""
+
+    chunks = _chunks(stream)
+    first = next(chunks, b'')
+    if first.startswith(_GZIP_MAGIC):
+        header = _bam_header(_prepend(first, chunks))
+    elif first.startswith(b'CRAM'):
+        header = _cram_header(_Reader(chunks, first))
+    elif first.startswith(b'@'):
+        header = _leading_lines(_prepend(first, chunks), b'@')
+    else:
+        raise HeaderFormatError("Not a SAM, BAM or CRAM file")
+
+    return _decode(header)
+
+
+def read_variant_header(stream):
+    """Return the header text and sample names of a VCF file, plain or BGZF
+    compressed, or a BCF file, reading no further than the #CHROM line.
+
+    @param stream: Binary file-like object positioned at the start of the
+        file, such as an open iRODS data object
+    @return: (header text, list of sample names)
+    @raise HeaderFormatError: If the header can't be decoded"""
+
+    chunks = _chunks(stream)
+    first = next(chunks, b'')
+    chunks = _prepend(first, chunks)
+    if first.startswith(_GZIP_MAGIC):
+        chunks = _inflate(chunks)
+        first = next(chunks, b'')
+        chunks = _prepend(first, chunks)
+
+    if first.startswith(b'BCF\x02'):
+        reader = _Reader(chunks)
+        reader.take(5) # magic and minor version
+        length = struct.unpack('<I', reader.take(4))[0]
+        # htslib numbers each dictionary entry of a BCF header with an IDX
+        # field, which bcftools leaves out when printing the header as VCF
+        text = _BCF_IDX.sub('>', _decode(reader.take(length)))
+    elif first.startswith(b'##'):
+        text = _decode(_leading_lines(chunks, b'#', b'#CHROM'))
+    else:
+        raise HeaderFormatError("Not a VCF or BCF file")
+
+    columns = text.rstrip('\n').rsplit('\n', 1)[-1]
+    if not columns.startswith('#CHROM'):
+        raise HeaderFormatError("Header has no #CHROM line")
+    # Samples follow the eight fixed columns and FORMAT
+    return text, columns.split('\t')[9:]
@@ -1,30 +1,45 @@
 import subprocess
-import sys
 import os
 import re
-from tokenize import generate_tokens
-from io import StringIO
 
+from irods.exception import iRODSException
 from pysam import libcalignmentfile
 
+import core.irods_wrapper as irods_wrapper
+import core.logger as logger
+import planner.header_reader as header_reader
+
+log = logger.get_logger('Inferrer')
+
+# Quoted strings (with backslash escapes) are matched whole, so only
+# symbols outside them are left to split on.
+_QUOTED = r'"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\''
+_splitters = {}
+
+
 def _split_by_symbol(string, symbol):
     """Splits a string of elements divided by a symbol into a list. Unlike
     the csv module, this ignores symbols in quoted strings even if the
-    quotation mark isn't immediately before or after a symbol.
+    quotation mark isn't immediately before or after a symbol. Quotes can be
+    escaped with a backslash. An unquoted '#', such as in a URL, is an
+    ordinary character."""
 
-    The symbol range is limited by the Python tokeniser."""
+    if '"' not in string and "'" not in string:
+        return string.split(symbol)
 
-    # The function doesn't have to do any quote detection itself, the
-    # Python tokeniser just handles quoted strings better than the csv library.
+    splitter = _splitters.get(symbol)
+    if splitter is None:
+        splitter = re.compile('{}|({})'.format(_QUOTED, re.escape(symbol)))
+        _splitters[symbol] = splitter
 
-    symbols = [-1] # list of comma positions
-    # For each token (t) indicating a symbol, get its position (t[2][1])
-    # and add it to the symbols list
-    symbols.extend(t[2][1] for t in generate_tokens(
-        StringIO(string).readline) if t[1] == symbol)
-    symbols.append(len(string))
-    # Creates a list of slices of the string based on symbol locations
-    return [ string[symbols[i]+1:symbols[i+1]] for i in range(len(symbols)-1)]
+    fields = []
+    start = 0
+    for match in splitter.finditer(string):
+        if match.group(1) is not None:
+            fields.append(string[start:match.start()])
+            start = match.end()
+    fields.append(string[start:])
+    return fields
 
 
 def parse_variant_header(header):
@@ -74,20 +89,45 @@ def parse_variant_header(header):
     return header_dict
 
 
-def get_sequence_header(irods_path):
-    """Extract the header from a SAM type file in iRODS and convert it into
-    a Python dictionary. Returns None if header extraction fails."""
+def _read_sequence_header(session, irods_path):
+    """Read a SAM, BAM or CRAM header in-process through an iRODS session.
+    Returns None if the data object can't be opened or decoded."""
 
     try:
-        header = subprocess.check_output(['samtools', 'view', '-H',
-            'irods:' + irods_path]).decode("UTF-8")
-    except subprocess.CalledProcessError:
-        print("Failed to extract {} header. It's possible the file no longer " +
-            "exists, or is not a valid sequence file.".format(irods_path),
-            file=sys.stderr)
-
+        with irods_wrapper.throttled():
+            with session.data_objects.open(irods_path, 'r') as stream:
+                return header_reader.read_alignment_header(stream)
+    except (header_reader.HeaderFormatError, iRODSException, OSError) as e:
+        log.warning("Couldn't read %s header directly (%s), using samtools "
+            "instead.", irods_path, e, extra={'path': irods_path})
         return None
 
+
+def get_sequence_header(irods_path, session=None):
+    """Extract the header from a SAM type file in iRODS and convert it into
+    a Python dictionary. Returns None if header extraction fails.
+
+    @param irods_path: iRODS path of the file
+    @param session: iRODSSession object. If given, only the header is read
+        out of the data object through this session. Otherwise, or if that
+        fails, samtools reads it through the iRODS htslib plugin"""
+
+    header = None
+    if session is not None:
+        header = _read_sequence_header(session, irods_path)
+
+    if header is None:
+        try:
+            with irods_wrapper.throttled():
+                header = subprocess.check_output(['samtools', 'view', '-H',
+                    'irods:' + irods_path]).decode("UTF-8")
+        except subprocess.CalledProcessError:
+            log.error("Failed to extract %s header. It's possible the file "
+                "no longer exists, or is not a valid sequence file.",
+                irods_path, extra={'path': irods_path})
+
+            return None
+
     header_dict = libcalignmentfile.AlignmentHeader.from_text(header).as_dict()
 
     # Used to suggest whether a @CO line should be treated as a dictionary or
@@ -132,9 +172,9 @@ def get_sequence_header(irods_path):
             elif 'SN' in header_dict[key][0].keys():
                 identifier = 'SN'
             else:
-                print("Couldn't find ID or SN in sequence file header row, " +
-                    "using first key in the row instead. File: {}"
-                    .format(irods_path), file=sys.stderr)
+                log.warning("Couldn't find ID or SN in sequence file header "
+                    "row, using first key in the row instead. File: %s",
+                    irods_path, extra={'path': irods_path})
                 identifier = header_dict[key][0].keys()[0]
 
             new_dict = {}
@@ -145,24 +185,57 @@ def get_sequence_header(irods_path):
 
     return header_dict
 
-def get_variant_header(irods_path):
+def _read_variant_header(session, irods_path):
+    """Read a VCF or BCF header and its sample names in one pass through an
+    iRODS session. Returns None if the data object can't be opened or
+    decoded."""
+
+    try:
+        with irods_wrapper.throttled():
+            with session.data_objects.open(irods_path, 'r') as stream:
+                return header_reader.read_variant_header(stream)
+    except (header_reader.HeaderFormatError, iRODSException, OSError) as e:
+        log.warning("Couldn't read %s header directly (%s), using bcftools "
+            "instead.", irods_path, e, extra={'path': irods_path})
+        return None
+
+
+def get_variant_header(irods_path, session=None):
     """Extract the header from a VCF type file in iRODS and convert it into
-    a Python dictionary. Stores the file's sample names under 'sample_names'.
-    Returns None if header extraction fails."""
+    a Python dictionary. Stores the file's sample names under 'sample_names',
+    one per line. Returns None if header extraction fails.
+
+    @param irods_path: iRODS path of the file
+    @param session: iRODSSession object. If given, the header and sample
+        names are read out of the data object through this session in a
+        single pass. Otherwise, or if that fails, bcftools reads them through
+        the iRODS htslib plugin"""
+
+    if session is not None:
+        result = _read_variant_header(session, irods_path)
+        if result is not None:
+            header, samples = result
+            header_dict = parse_variant_header(header)
+            # Formatted like 'bcftools query -l' output
+            header_dict['sample_names'] = ''.join(sample + '\n'
+                for sample in samples)
+            return header_dict
 
     try:
-        header = subprocess.check_output(['bcftools', 'view', '-h',
-            'irods:' + irods_path]).decode("UTF-8")
-        samples = subprocess.check_output(['bcftools', 'query', '-l',
-            'irods:' + irods_path]).decode("UTF-8")
+        with irods_wrapper.throttled():
+            header = subprocess.check_output(['bcftools', 'view', '-h',
+                'irods:' + irods_path]).decode("UTF-8")
+        with irods_wrapper.throttled():
+            samples = subprocess.check_output(['bcftools', 'query', '-l',
+                'irods:' + irods_path]).decode("UTF-8")
     except subprocess.CalledProcessError:
-        print("Failed to extract {} header. It's possible the file no longer " +
-        "exists, or is not a valid variant file.".format(irods_path),
-        file=sys.stderr)
+        log.error("Failed to extract %s header. It's possible the file no "
+            "longer exists, or is not a valid variant file.", irods_path,
+            extra={'path': irods_path})
 
         return None
     except FileNotFoundError:
-        print("bcftools not found. Please use the 'hgi_base' anaconda " +
+        log.error("bcftools not found. Please use the 'hgi_base' anaconda "
             "environment or add the bcftools binary to the PATH.")
 
         return None
@@ -0,0 +1,122 @@
+"""Mapping targets from the configuration file ('SQ.*.LN', 'RG.?.SM', ...)
+compiled into accessor functions once, when the configuration is loaded,
+instead of being re-split and re-interpreted for every file."""
+
+# Returned by accessors when the target isn't in the header
+NOT_FOUND = object()
+
+# Separator between the values of a wildcard column or a stringified row
+SEPARATOR = '    '
+
+
+def stringify(value):
+    """Convert a simple dictionary into a string of key=value pairs. Other
+    values are returned unchanged. Nested dictionaries won't work."""
+
+    if not isinstance(value, dict):
+        return value
+    return SEPARATOR.join("{}={}".format(key, item) for key, item in
+        value.items()).strip()
+
+
+class HeaderView:
+    """A parsed header, plus columnar views of its sections built the first
+    time a wildcard needs them. Each column is every row's value for one
+    tag (the lengths of the @SQ lines, say), already joined into a string,
+    so several mappings on the same section share one pass over it.
+
+    @param header: Header dictionary, as returned by the inferrers"""
+
+    __slots__ = ('header', '_columns', '_sections')
+
+    def __init__(self, header):
+        self.header = header
+        self._columns = {} # (section steps, tag) -> joined string
+        self._sections = set() # steps of the sections already built
+
+    def column(self, steps, section, tag):
+        """Return the values of 'tag' in every row of a section, joined, or
+        NOT_FOUND if any row lacks it."""
+
+        if steps not in self._sections:
+            self._build_columns(steps, section)
+        return self._columns.get((steps, tag), NOT_FOUND)
+
+    def _build_columns(self, steps, section):
+        columns = {}
+        rows = 0
+        for row in section.values():
+            rows += 1
+            if not isinstance(row, dict):
+                continue
+            for tag, value in row.items():
+                columns.setdefault(tag, []).append(str(value))
+
+        for tag, values in columns.items():
+            # A column has to cover every row to be meaningful
+            if len(values) == rows:
+                self._columns[(steps, tag)] = SEPARATOR.join(values).strip()
+        self._sections.add(steps)
+
+
+def _descend(value, steps):
+    """Follow 'steps' down the header. '?' takes the first entry."""
+    for step in steps:
+        if step == '?':
+            value = value[next(iter(value))]
+        else:
+            value = value[step]
+    return value
+
+
+def compile_target(target):
+    """Compile a mapping target into a function taking a HeaderView and
+    returning the targeted value, or NOT_FOUND.
+
+    * 'HD.VN' descends the header one key at a time, where '?' takes the
+      first key at that level.
+    * 'SQ.*.LN' gives the 'LN' value of every row under 'SQ', as a column
+      separated by four spaces.
+    * 'SQ.*' gives every row under 'SQ', stringified.
+
+    @param target: Target string from the configuration file
+    @return: Accessor function"""
+
+    parts = tuple(target.split('.'))
+
+    if '*' not in parts:
+        def access(view):
+            try:
+                return _descend(view.header, parts)
+            except (KeyError, TypeError, StopIteration):
+                return NOT_FOUND
+        return access
+
+    wildcard = parts.index('*')
+    steps = parts[:wildcard]
+    # Anything after the column tag is ignored
+    tag = parts[wildcard + 1] if wildcard + 1 < len(parts) else None
+
+    def access_column(view):
+        try:
+            section = _descend(view.header, steps)
+        except (KeyError, TypeError, StopIteration):
+            return NOT_FOUND
+        if not isinstance(section, dict):
+            # A wildcard over a single value is just that value, but there's
+            # nothing under it to take a column from
+            return NOT_FOUND if tag is not None else section
+        if tag is None:
+            return stringify(section)
+        return view.column(steps, section, tag)
+    return access_column
+
+
+def compile_mapping(mapping):
+    """Compile a 'mapping' entry of the configuration file.
+
+    @param mapping: Dictionary of {attribute: target string}
+    @return: List of (attribute, target string, accessor) tuples"""
+
+    return [(attribute, target, compile_target(target)) for attribute, target
+        in mapping.items()]
@@ -0,0 +1,188 @@
+import fnmatch
+import re
+
+_GLOB_CHARS = re.compile(r'[*?\[]')
+
+
+def is_regex(pattern):
+    """Configuration patterns surrounded by forward slashes are regexes."""
+    return pattern[0] == "/" and pattern[-1] == "/"
+
+
+def _combine(regexes):
+    """Compile a list of regex strings into one alternation, or return None
+    if they can't be combined safely. Regexes with groups are never passed
+    in, since backreferences would point at the wrong group once merged."""
+
+    if not regexes:
+        return None
+    try:
+        return re.compile('|'.join('(?:{})'.format(r) for r in regexes))
+    except re.error:
+        # Inline flags like (?i) are only allowed at the start of a regex
+        return None
+
+
+def _literal_ends(pattern):
+    """Return the literal text before the first and after the last glob
+    metacharacter of a glob."""
+
+    first = _GLOB_CHARS.search(pattern).start()
+    last = max(pattern.rfind(char) for char in '*?]')
+    return pattern[:first], pattern[last + 1:]
+
+
+class _Bucket:
+    """Globs sharing a literal prefix or suffix. 'simple' globs match any
+    path with that literal; the others are only tested after a single
+    alternation of all of them matches."""
+
+    def __init__(self):
+        self.simple = []
+        self.tests = []
+        self.filter = None
+
+    def finalise(self):
+        if len(self.tests) > 1:
+            self.filter = _combine([compiled.pattern for _, compiled in
+                self.tests])
+
+    def match(self, path, matched):
+        matched.extend(self.simple)
+        if not self.tests or (self.filter is not None and
+                self.filter.match(path) is None):
+            return
+        for pattern, compiled in self.tests:
+            if compiled.match(path):
+                matched.append(pattern)
+
+
+class PatternMatcher:
+    """Configuration patterns compiled once into indexes, so every pattern
+    matching a path can be found in a single pass instead of testing each
+    one with fnmatch or re.search.
+
+    * '*' always matches, and plain literals are exact dictionary lookups.
+    * Every other glob is indexed by the literal text it ends with (such as
+      '.cram' for '*.cram' or '*/run?/*.cram'), or failing that the literal
+      text it starts with (such as '/seq/' for '/seq/*'). Only globs whose
+      suffix or prefix matches the path are considered, and globs which are
+      just that literal and a '*' need no further test. The rest of a bucket
+      is prefiltered with one alternation.
+    * Globs with no literal ends are translated to regexes. Those, and regex
+      patterns without groups, are merged into alternations which reject
+      non-matching paths in a single search. Patterns only get tested one
+      by one after a prefilter matches.
+
+    @param patterns: Configuration patterns, in file order"""
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        # Later patterns in the file take precedence, and are applied first
+        self._rank = {pattern: rank for rank, pattern in
+            enumerate(reversed(self.patterns))}
+
+        self._always = []
+        self._exact = {}
+        # literal length -> {literal: _Bucket}
+        self._suffixes = {}
+        self._prefixes = {}
+        self._searches = [] # (pattern, compiled regex)
+        combinable_globs = []
+        combinable_regexes = []
+        self._grouped_regexes = False
+
+        for pattern in self.patterns:
+            if is_regex(pattern):
+                regex = pattern[1:-1]
+                compiled = re.compile(regex)
+                self._searches.append((pattern, compiled))
+                if compiled.groups == 0:
+                    combinable_regexes.append(regex)
+                else:
+                    self._grouped_regexes = True
+                continue
+
+            if pattern == '*':
+                self._always.append(pattern)
+                continue
+            if not _GLOB_CHARS.search(pattern):
+                self._exact.setdefault(pattern, []).append(pattern)
+                continue
+
+            head, tail = _literal_ends(pattern)
+            compiled = re.compile(fnmatch.translate(pattern))
+            if tail or head:
+                if tail:
+                    bucket = self._suffixes.setdefault(len(tail), {}) \
+                        .setdefault(tail, _Bucket())
+                    simple = pattern == '*' + tail
+                else:
+                    bucket = self._prefixes.setdefault(len(head), {}) \
+                        .setdefault(head, _Bucket())
+                    simple = pattern == head + '*'
+                if simple:
+                    bucket.simple.append(pattern)
+                else:
+                    bucket.tests.append((pattern, compiled))
+            else:
+                self._searches.append((pattern, compiled))
+                combinable_globs.append(compiled.pattern)
+
+        # Globs must match the whole path while regexes can match anywhere,
+        # so they're prefiltered separately. fnmatch.translate anchors its
+        # output with \Z, and re.match anchors the start.
+        self._glob_filter = _combine(combinable_globs)
+        self._regex_filter = _combine(combinable_regexes)
+        self._has_globs = bool(combinable_globs)
+        self._has_regexes = bool(combinable_regexes)
+        for index in (self._suffixes, self._prefixes):
+            for buckets in index.values():
+                for bucket in buckets.values():
+                    bucket.finalise()
+        self._suffix_items = tuple(self._suffixes.items())
+        self._prefix_items = tuple(self._prefixes.items())
+
+    def _searched(self, path):
+        """Patterns needing a regex test that match the path."""
+
+        globs_possible = self._has_globs and (self._glob_filter is None or
+            self._glob_filter.match(path) is not None)
+        regexes_possible = self._grouped_regexes or (self._has_regexes and
+            (self._regex_filter is None or
+            self._regex_filter.search(path) is not None))
+
+        if not globs_possible and not regexes_possible:
+            return []
+
+        matched = []
+        for pattern, compiled in self._searches:
+            if is_regex(pattern):
+                if regexes_possible and compiled.search(path):
+                    matched.append(pattern)
+            elif globs_possible and compiled.match(path):
+                matched.append(pattern)
+        return matched
+
+    def match(self, path):
+        """Return every pattern matching the path, in the order their AVUs
+        should be applied (the reverse of the order in the file)."""
+
+        matched = list(self._always)
+        matched.extend(self._exact.get(path, ()))
+        path_length = len(path)
+        for length, suffixes in self._suffix_items:
+            if length <= path_length:
+                bucket = suffixes.get(path[path_length - length:])
+                if bucket is not None:
+                    bucket.match(path, matched)
+        for length, prefixes in self._prefix_items:
+            bucket = prefixes.get(path[:length])
+            if bucket is not None:
+                bucket.match(path, matched)
+        if self._searches:
+            matched.extend(self._searched(path))
+
+        if len(matched) > 1:
+            matched.sort(key=self._rank.__getitem__)
+        return matched
@@ -1,7 +1,7 @@
 from dataclasses import dataclass
-from typing import Optional, Set
+from typing import Optional, Tuple
 
-@dataclass(eq=True, frozen=True)
+@dataclass(eq=True, frozen=True, slots=True)
 class AVU:
     attribute: str
     value: str
@@ -13,8 +13,80 @@ class AVU:
         if self.unit is not None:
             object.__setattr__(self, 'unit', str(self.unit))
 
-@dataclass
-class Plan:
+@dataclass(eq=True, frozen=True, slots=True)
+class Change:
+    """The AVUs to remove from and add to one object, already diffed against
+    its existing metadata. The executor applies it as given."""
     path: str
     is_collection: bool
-    metadata: Set[AVU]
+    to_add: Tuple[AVU, ...] = ()
+    to_remove: Tuple[AVU, ...] = ()
+
+# Static AVU tuples unpickled in this process, so plans sent from another
+# process share them again
+_interned = {}
+
+def _intern(static):
+    return _interned.setdefault(static, static)
+
+def _rebuild_plan(path, is_collection, rule_set, static, inferred,
+        positions):
+    plan = Plan(path, is_collection, rule_set=rule_set, static=_intern(static))
+    plan.inferred = inferred
+    plan.positions = positions
+    return plan
+
+class Plan:
+    """The AVUs planned for one iRODS object. Static AVUs are a tuple shared
+    by every plan matching the same set of configuration rules ('rule_set'
+    is that set's id), so a plan only owns its path and any AVUs inferred
+    from the file itself. Each inferred AVU has a position among the static
+    ones, that of the infer entry it came from, so 'metadata' gives the
+    full list in configuration order."""
+    __slots__ = ('path', 'is_collection', 'rule_set', 'static', 'inferred',
+        'positions')
+
+    def __init__(self, path: str, is_collection: bool, metadata=None,
+            rule_set: Optional[int] = None, static: Tuple[AVU, ...] = ()):
+        self.path = path
+        self.is_collection = is_collection
+        self.rule_set = rule_set
+        self.static = static
+        self.inferred = list(metadata) if metadata else ()
+        self.positions = [0] * len(self.inferred) if metadata else ()
+
+    @property
+    def metadata(self):
+        metadata = []
+        start = 0
+        for position, avu in zip(self.positions, self.inferred):
+            metadata.extend(self.static[start:position])
+            metadata.append(avu)
+            start = position
+        metadata.extend(self.static[start:])
+        return metadata
+
+    def add_inferred(self, avu, position=None):
+        """Add an AVU inferred from the file, before the static AVU at
+        'position', or after them all if that's None. Positions must not
+        decrease."""
+        if not self.inferred:
+            self.inferred = []
+            self.positions = []
+        self.inferred.append(avu)
+        self.positions.append(len(self.static) if position is None else
+            position)
+
+    def __eq__(self, other):
+        if not isinstance(other, Plan):
+            return NotImplemented
+        return (self.path, self.is_collection, self.metadata) == \
+            (other.path, other.is_collection, other.metadata)
+
+    def __repr__(self):
+        return "Plan(path={!r}, is_collection={!r}, metadata={!r})".format(
+            self.path, self.is_collection, self.metadata)
+
+    def __reduce__(self):
+        return (_rebuild_plan, (self.path, self.is_collection, self.rule_set,
+            self.static, self.inferred, self.positions))
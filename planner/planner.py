@@ -1,18 +1,30 @@
 import argparse
 import sys
 import re
-import fnmatch
 
 from yaml import safe_load
 
 import core.irods_wrapper as irods_wrapper
 import core.logger as logger
+import core.metrics as metrics
+import core.pipeline as pipeline
+from core.progress import ProgressJournal
 import planner.inferrers as inferrers
+from .mapping import NOT_FOUND, HeaderView, compile_mapping, stringify
+from .matcher import PatternMatcher
 from .object_class import Plan, AVU
 from config import ENV_FILE
 
+log = logger.get_logger('Planner')
+
 VALID_INFERS = ['sequence', 'variant']
 
+# Infer type -> function reading and parsing a file's header
+HEADER_READERS = {
+    'sequence': inferrers.get_sequence_header,
+    'variant': inferrers.get_variant_header
+}
+
 def verify_infer(infer):
     """Check whether an infer method referenced in a configuration file
     exists."""
@@ -29,7 +41,6 @@ def verify_config(yaml_file):
     @param file: Path to the configuration file.
     @return: True if config appears valid, problem string otherwise."""
 
-    log = logger.init_logger(logger.DEFAULT_LOGGER, 'Planner')
     log.info("Verifying configuration file...")
 
     with open(yaml_file) as file:
@@ -94,137 +105,171 @@ def verify_config(yaml_file):
     return True
 
 
-def _stringify_dict(dictionary):
-    """Convert a simple dictionary into a string. Nested dictionaries won't
-    work."""
-
-    if type(dictionary) != dict:
-        # TODO: Throw an error instead?
-        return dictionary
-
-    _string = ''
-    for _key, _value in dictionary.items():
-        _string += "{}={}    ".format(_key, _value)
-    dictionary = _string.strip()
-
-    return dictionary
-
-
-def _resolve_wildcard(header, target):
-    """Return string of values from the header based on a column defined by
-    the wildcard.
+def get_header(path, file_type, header_cache=None, session=None):
+    """Return the parsed header of a file, or None if it can't be read.
 
-    @param header: Dictionary representation of file header
-    @param target: List of header indices (ie ["SQ", "5", "LN"])
-    @return: Value string"""
-
-    wildcard_space = header # where in the header the wildcard applies to
-    wildcard_index = 0 # index of the wildcard in the target
-    try:
-        for index, subtarget in enumerate(target):
-            if subtarget == '*':
-                wildcard_index = index
-                break
-            wildcard_space = wildcard_space[subtarget]
-    except KeyError:
-        return False
-
-    try:
-        wildcard_target = target[wildcard_index+1]
-    except IndexError:
-        wildcard_target = None
-
-    # The only iterable type the value can be is a dictionary.
-    if type(wildcard_space) != dict:
-        if len(wildcard_target) != 0:
-            # If the user is trying to find go another level deeper but the
-            # target isn't a dictionary, raise a KeyError.
-            raise KeyError
-        # If the wildcard matches a non-dictionary value, just return that
-        return wildcard_target
-
-    target_string = ""
-    _wildcard_space = wildcard_space
-
-    if wildcard_target == None:
-        # Wildcard is the final index, so it gets the whole row as a dictionary.
-        target_string = _stringify_dict(wildcard_space)
-    else:
-        # Wildcard is in the middle, so it gets a column of header values
-        for header_row in wildcard_space.values():
-            target_string += "{}    ".format(header_row[wildcard_target])
+    @param path: iRODS path of the file
+    @param file_type: File type as defined by the 'infer' entry in the YAML
+        configuration file
+    @param header_cache: Optional HeaderCache to reuse headers from
+        previous runs
+    @param session: Optional iRODSSession to read the header through,
+        instead of starting a subprocess"""
 
-        target_string = target_string.strip()
+    def read(path):
+        with metrics.HEADER_FETCH_SECONDS.time():
+            return HEADER_READERS[file_type](path, session)
 
-    return target_string
+    if header_cache is None:
+        return read(path)
+    return header_cache.get(path, file_type, read)
 
 
-def infer_file(plan, mapping, file_type):
+def infer_file(plan, mapping, file_type, header=None, position=None):
     """Adds AVUs to a plan object pointing at a file based on file metadata.
 
     @param plan: Plan object
     @param mapping: Dictionary corresponding to a list of 'mapping' entries
-        in the YAML configuration file
+        in the YAML configuration file, or the same compiled with
+        'mapping.compile_mapping'
     @param file_type: File type as defined by the 'infer' entry in the YAML
         configuration file
+    @param header: The file's parsed header or HeaderView, if it has already
+        been read
+    @param position: Number of the plan's static AVUs which come before the
+        infer entry in the configuration. By default, after them all
     @return: Modified Plan object"""
 
-    log = logger.init_logger(logger.DEFAULT_LOGGER, 'Planner')
-
-    if file_type == 'variant':
-        header = inferrers.get_variant_header(plan.path)
-    elif file_type == 'sequence':
-        header = inferrers.get_sequence_header(plan.path)
-
-    for key in mapping.keys():
-        target = mapping[key].split('.')
-
-        target_value = header
-        try:
-            if '*' in target:
-                target_value = _resolve_wildcard(header, target)
-            else:
-                # Iteratively descend the header dictionary
-                for subtarget in target:
-                    if subtarget == '?':
-                        target_value = target_value[
-                            list(target_value.keys())[0]]
-                    else:
-                        target_value = target_value[subtarget]
-        except KeyError:
+    if header is None:
+        header = get_header(plan.path, file_type)
+    if header is None:
+        # The reader has already reported why
+        return plan
+    if not isinstance(header, HeaderView):
+        header = HeaderView(header)
+    if isinstance(mapping, dict):
+        mapping = compile_mapping(mapping)
+
+    for key, target, access in mapping:
+        target_value = access(header)
+        if target_value is NOT_FOUND:
             # TODO: Abort execution? Continue after omitting bad target?
-            log.warning("Metadata target {} not found in {}."
-                .format(mapping[key], plan.path))
+            log.warning("Metadata target %s not found in %s.", target,
+                plan.path, extra={'path': plan.path})
             continue
 
-        if target_value == False:
-            log.warning("Metadata target {} not found in {}."
-                .format(mapping[key], plan.path))
-            continue
+        plan.add_inferred(AVU(key, stringify(target_value)), position)
 
-        if type(target_value) == dict:
-            try:
-                target_value = _stringify_dict(target_value)
-            except KeyError:
-                continue
+    return plan
 
-        plan.metadata.append(AVU(key, target_value))
 
-    return plan
+def _compile_rule_set(rule_set_id, patterns, config):
+    """Resolve the AVUs for a combination of matching patterns once, so
+    every plan matching the same patterns shares one tuple of static AVUs.
+
+    @param rule_set_id: Integer identifying this combination
+    @param patterns: Matching patterns, highest precedence first
+    @param config: Parsed configuration file
+    @return: (rule set id, static AVU tuple, [(infer type, compiled mapping,
+        position among the static AVUs), ...])"""
+
+    static = []
+    infers = []
+
+    for pattern in patterns:
+        for entry in config[pattern]:
+            if 'attribute' in entry.keys():
+                # Fixed AVUs, in configuration order
+                static.append(AVU(entry['attribute'], entry['value'],
+                    entry.get('unit')))
+
+            elif 'infer' in entry.keys():
+                # Dynamic AVUs go where their entry is, and could set any
+                # attribute
+                if entry['infer'] in VALID_INFERS:
+                    infers.append((entry['infer'],
+                        compile_mapping(entry['mapping']), len(static)))
+
+    return (rule_set_id, tuple(static), infers)
+
+
+def _iter_catalogue(catalogue, include_collections):
+    """Normalise a catalogue into a stream of (iRODS path, is collection)
+    tuples. Accepts either the dictionary returned by
+    'irods_wrapper.get_irods_catalogue' or an iterable of tuples such as
+    'irods_wrapper.iter_irods_catalogue'."""
+
+    if isinstance(catalogue, dict):
+        for path in catalogue['objects']:
+            yield (path, False)
+        if include_collections:
+            for path in catalogue.get('collections', []):
+                yield (path, True)
+        return
+
+    for path, is_collection in catalogue:
+        if is_collection and not include_collections:
+            continue
+        yield (path, is_collection)
+
+
+def _plan(path, is_collection, rule_set, header_cache=None, session=None):
+    """Build the plan for one path from its rule set, reading the file's
+    headers if any infer entries apply to it.
+
+    @param path: iRODS path
+    @param is_collection: True if the path is a collection
+    @param rule_set: (rule set id, static AVUs, infer entries) tuple
+    @param header_cache: Optional HeaderCache
+    @param session: Optional iRODSSession to read headers through
+    @return: Plan object"""
+
+    rule_set_id, static, infers = rule_set
+    plan_object = Plan(path, is_collection, rule_set=rule_set_id,
+        static=static)
+
+    log.debug("Planning AVUs for %s...", path, extra={'path': path})
+    metrics.PLANS.inc()
+
+    # Several infer entries can need the same header, but each file's header
+    # is only read once
+    headers = {}
+    for file_type, mapping, position in infers:
+        # Dynamic AVUs
+        if file_type not in headers:
+            header = get_header(path, file_type, header_cache, session)
+            headers[file_type] = header if header is None else \
+                HeaderView(header)
+        if headers[file_type] is None:
+            continue
+        plan_object = infer_file(plan_object, mapping, file_type,
+            headers[file_type], position)
+
+    return plan_object
 
 
-def generate_plans(catalogue, yaml_file, progress_file, resume,
-        include_collections=False):
+def generate_plans(catalogue, yaml_file, progress_file=None, resume=False,
+        include_collections=False, header_cache=None, session=None,
+        inference_jobs=1):
     """Generates AVU dictionaries for iRODS objects based on the definitions
-    in a config file.
+    in a config file. The catalogue is consumed lazily, so the first plan is
+    yielded as soon as the first path is listed.
 
     @param catalogue: Lists of iRODS paths in a dictionary {'objects': <list>,
-    'collections': <list>}
+    'collections': <list>}, or an iterable of (iRODS path, is collection)
+    tuples
     @param yaml_file: Path to the configuration file
-    @param ignore_collections: If True, only data objects will be returned
-    @return: (iRODS path, AVU dictionary) tuples, as a generator"""
-
-    log = logger.init_logger(logger.DEFAULT_LOGGER, "Planner")
+    @param progress_file: ProgressJournal of already processed paths, or the
+        path to one
+    @param resume: If True, paths recorded in the progress journal are
+        skipped
+    @param include_collections: If False, only data objects will be returned
+    @param header_cache: Optional HeaderCache, so headers of files unchanged
+        since a previous run aren't read again
+    @param session: Optional iRODSSession to read headers through
+    @param inference_jobs: Number of paths whose headers are read and
+        parsed concurrently, on a pool of threads
+    @return: Plan objects, as a generator"""
 
     valid = verify_config(yaml_file)
     if valid != True:
@@ -234,62 +279,41 @@ def generate_plans(catalogue, yaml_file, progress_file, resume,
     with open(yaml_file) as file:
         config = safe_load(file)
 
-    if not include_collections:
-        _catalogue = {'objects': catalogue['objects']}
-    else:
-        _catalogue = catalogue
+    matcher = PatternMatcher(config.keys())
+    # Matching patterns -> (rule set id, static AVUs, infer entries)
+    rule_sets = {}
 
+    entries = _iter_catalogue(catalogue, include_collections)
+    journal = None
     if resume:
-        print("Resuming from progress file...")
-        with open(progress_file, 'rt') as f:
-            # _catalogue['objects'] = list(set(_catalogue['objects']) - set(line.strip() for line in f)) This doesnt work for some reason
-            progress_file_set = set(line.strip() for line in f)
-            _catalogue['objects'] = list(set(_catalogue['objects']) - progress_file_set)
-            if include_collections:
-                _catalogue['collections'] = list(set(_catalogue['collections']) - progress_file_set)
-
-    for object_type in _catalogue.keys():
-        for path in _catalogue[object_type]:
-            if object_type == 'objects':
-                plan_object = Plan(path, False, [])
-            elif object_type == 'collections':
-                plan_object = Plan(path, True, [])
-
-            print("Planning AVUs for {}...".format(path))
-
-            avu_dict = {}
-            # Prior to Python 3.7, dictionaries did not have an enforced
-            # persistent order, so this might not work properly in older
-            # versions.
-            for pattern in reversed(list(config.keys())):
-                if pattern[0] == "/" and pattern[-1] == "/":
-                    if not re.search(pattern[1:-1], path):
-                        # regex pattern didn't match
-                        continue
-                else:
-                    if not fnmatch.fnmatch(path, pattern):
-                        # glob pattern didn't match
-                        continue
-
-                for entry in config[pattern]:
-                    if 'attribute' in entry.keys():
-                        # Fixed AVUs
-                        attribute = entry['attribute']
-                        value = entry['value']
-                        unit = None
-                        if 'unit' in entry.keys():
-                            unit = entry['unit']
-
-                        plan_object.metadata.append(AVU(attribute, value, unit))
-
-                    elif 'infer' in entry.keys():
-                        # Dynamic AVUs
-                        if entry['infer'] == 'variant':
-                            plan_object = infer_file(plan_object,
-                                entry['mapping'], 'variant')
-
-                        elif entry['infer'] == 'sequence':
-                            plan_object = infer_file(plan_object,
-                                entry['mapping'], 'sequence')
-
-            yield plan_object
+        log.info("Resuming from progress journal...")
+        journal = progress_file
+        if not isinstance(journal, ProgressJournal):
+            journal = ProgressJournal(progress_file)
+        # Looked up in the journal a chunk at a time, rather than loading
+        # every path already done into memory
+        entries = journal.pending(entries, key=lambda entry: entry[0])
+
+    def matched_paths():
+        for path, is_collection in entries:
+            matched = tuple(matcher.match(path))
+            metrics.PATTERN_MATCHES.inc(len(matched))
+            rule_set = rule_sets.get(matched)
+            if rule_set is None:
+                rule_set = _compile_rule_set(len(rule_sets), matched, config)
+                rule_sets[matched] = rule_set
+            yield (path, is_collection, rule_set)
+
+    def plan(item):
+        path, is_collection, rule_set = item
+        return _plan(path, is_collection, rule_set, header_cache, session)
+
+    # Headers are read for up to 'inference_jobs' paths at once, so a run is
+    # limited by iRODS bandwidth rather than each read's latency. Plans
+    # still come out in catalogue order.
+    try:
+        yield from pipeline.bounded_map(plan, matched_paths(),
+            inference_jobs, ordered=True)
+    finally:
+        if journal is not None and journal is not progress_file:
+            journal.close()
@@ -0,0 +1,121 @@
+"""Scripted stand-in for baton-do, for testing core.baton without a zone.
+
+    python3 test/fake_baton.py STATE
+
+STATE is a JSON file holding the zone:
+
+    {"collections": {path: {"avus": [...], "modified": ISO time}},
+     "data_objects": {path: {"avus": [...], "modified": ISO time}}}
+
+It answers 'list' and 'metamod' operations as baton-do does, one JSON line
+per request, and writes the zone back to STATE when its input closes. It
+counts how many times it was started in STATE's "starts". A 'crash'
+operation makes it exit at once with status 1, without saving, an 'echo'
+operation is answered twice, a 'hang' operation is never answered, and a
+'slow' operation is answered after its arguments' "seconds"."""
+
+import json
+import sys
+import time
+
+USER_FILE_DOES_NOT_EXIST = -310000
+
+
+class _Missing(Exception):
+    pass
+
+
+def _parent(path):
+    return path.rsplit('/', 1)[0] or '/'
+
+
+def _item(zone, path, is_collection, arguments):
+    entry = zone['collections' if is_collection else 'data_objects'].get(
+        path)
+    if entry is None:
+        raise _Missing(path)
+    if is_collection:
+        item = {'collection': path}
+    else:
+        item = {'collection': _parent(path),
+            'data_object': path.rsplit('/', 1)[1]}
+    if arguments.get('avu'):
+        item['avus'] = entry.get('avus', [])
+    if arguments.get('timestamp') and 'modified' in entry:
+        item['timestamps'] = [{'modified': entry['modified']}]
+    return item
+
+
+def _path(target):
+    if 'data_object' in target:
+        return target['collection'].rstrip('/') + '/' + \
+            target['data_object'], False
+    return target['collection'], True
+
+
+def _list(zone, target, arguments):
+    path, is_collection = _path(target)
+    item = _item(zone, path, is_collection, arguments)
+    if is_collection and arguments.get('contents'):
+        item['contents'] = [_item(zone, child, False, arguments) for child
+            in sorted(zone['data_objects']) if _parent(child) == path]
+        item['contents'].extend(_item(zone, child, True, arguments) for child
+            in sorted(zone['collections']) if child != path and
+            _parent(child) == path)
+    return item
+
+
+def _metamod(zone, target, arguments):
+    path, is_collection = _path(target)
+    entry = zone['collections' if is_collection else 'data_objects'].get(
+        path)
+    if entry is None:
+        raise _Missing(path)
+    avus = entry.setdefault('avus', [])
+    for avu in target['avus']:
+        if arguments['operation'] == 'add':
+            if avu not in avus:
+                avus.append(avu)
+        elif avu in avus:
+            avus.remove(avu)
+    return target
+
+
+def main(state_file):
+    with open(state_file) as file:
+        zone = json.load(file)
+    zone['starts'] = zone.get('starts', 0) + 1
+    with open(state_file, 'w') as file:
+        json.dump(zone, file)
+
+    for line in sys.stdin:
+        envelope = json.loads(line)
+        operation = envelope['operation']
+        if operation == 'crash':
+            sys.exit(1)
+        if operation == 'hang':
+            time.sleep(60)
+        if operation == 'slow':
+            time.sleep(envelope['arguments']['seconds'])
+            envelope['result'] = {'single': {}}
+            print(json.dumps(envelope), flush=True)
+            continue
+        if operation == 'echo':
+            print(json.dumps(envelope), flush=True)
+            print(json.dumps(envelope), flush=True)
+            continue
+        try:
+            handler = {'list': _list, 'metamod': _metamod}[operation]
+            envelope['result'] = {'single': handler(zone,
+                envelope['target'], envelope.get('arguments', {}))}
+        except _Missing as e:
+            envelope['error'] = {'code': USER_FILE_DOES_NOT_EXIST,
+                'message': "Path '{}' does not exist".format(e)}
+        print(json.dumps(envelope), flush=True)
+
+    with open(state_file, 'w') as file:
+        json.dump(zone, file)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1])
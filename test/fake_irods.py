@@ -0,0 +1,618 @@
+"""An in-memory stand-in for the parts of python-irodsclient's iRODSSession
+that Asclepius uses, so the catalogue, planner and executor can be tested and
+benchmarked without a live zone.
+
+Every method that would be a server round-trip on a real session increments
+'FakeSession.round_trips', sleeps for the session's latency, and fails with
+the session's failure rate. Trees of millions of objects can be made with
+'add_synthetic_tree', whose data objects are only built when listed or used.
+A GenQuery on one collection, or one collection's subcollections, doesn't
+scan the whole zone."""
+
+import hashlib
+import io
+import random
+import re
+import time
+from datetime import datetime, timezone
+from collections import OrderedDict
+
+import irods.exception
+from irods.meta import iRODSMeta
+from irods.meta import AVUOperation
+from irods.models import Collection, CollectionMeta, DataObject, \
+    DataObjectMeta
+
+
+class _FakeDataRecord:
+    __slots__ = ('name', 'content', 'size', 'checksum', 'modify_time', 'meta')
+
+    def __init__(self, name, content=b'', modify_time=0, checksum=None):
+        self.name = name
+        self.content = content
+        self.size = len(content)
+        self.checksum = checksum or \
+            'sha2:' + hashlib.sha256(content).hexdigest()
+        # python-irodsclient returns iCAT timestamps as UTC datetimes
+        if not isinstance(modify_time, datetime):
+            modify_time = datetime.fromtimestamp(modify_time, timezone.utc)
+        self.modify_time = modify_time
+        self.meta = []
+
+
+class _SyntheticData:
+    """The data objects of a synthetic collection, named by formatting
+    'name' with 0 to 'count' - 1, which all share the same content and start
+    with the same AVUs. Records are built whenever they are listed or looked
+    up, so of a generated object only AVUs which changed are kept, by its
+    index. They're kept as tuples interned per collection, since a run
+    gives most objects the same AVUs. Objects added by name are kept
+    whole."""
+
+    def __init__(self, count, name, content, avus, modify_time):
+        self._count = count
+        self._name = name
+        self._content = content
+        self._avus = tuple(tuple(avu) for avu in avus)
+        self._modify_time = datetime.fromtimestamp(modify_time,
+            timezone.utc)
+        self._checksum = 'sha2:' + hashlib.sha256(content).hexdigest()
+        self._changed = {}
+        self._interned = {}
+        self._added = {}
+        self._pattern = re.compile(re.escape(name).replace(r'\{\}',
+            '(0|[1-9][0-9]*)') + '$')
+
+    def _build(self, index, name):
+        record = _FakeDataRecord(name, self._content, self._modify_time,
+            self._checksum)
+        record.meta = [iRODSMeta(*avu) for avu in
+            self._changed.get(index, self._avus)]
+        return record
+
+    def _index(self, name):
+        match = self._pattern.match(name)
+        if match is None or int(match.group(1)) >= self._count:
+            return None
+        return int(match.group(1))
+
+    def __len__(self):
+        return self._count + sum(1 for name in self._added
+            if self._index(name) is None)
+
+    def __getitem__(self, name):
+        record = self._added.get(name)
+        if record is None:
+            index = self._index(name)
+            if index is None:
+                raise KeyError(name)
+            record = self._build(index, name)
+        return record
+
+    def __setitem__(self, name, record):
+        self._added[name] = record
+
+    def store_meta(self, record):
+        """Keep the AVUs of a record looked up by name, which only changed
+        its own copy of them."""
+        index = self._index(record.name)
+        if index is None or record.name in self._added:
+            return
+        avus = tuple((avu.name, avu.value, avu.units) for avu in record.meta)
+        avus = self._interned.setdefault(avus, avus)
+        if avus == self._avus:
+            self._changed.pop(index, None)
+        else:
+            self._changed[index] = avus
+
+    def values(self):
+        for index in range(self._count):
+            name = self._name.format(index)
+            yield self._added.get(name) or self._build(index, name)
+        for name, record in list(self._added.items()):
+            if self._index(name) is None:
+                yield record
+
+
+class _FakeCollectionRecord:
+    def __init__(self, path, modify_time=0):
+        self.path = path
+        self.modify_time = datetime.fromtimestamp(modify_time, timezone.utc)
+        self.data = OrderedDict()
+        self.meta = []
+
+
+class FakeMetaCollection:
+    """Mimics irods.meta.iRODSMetaCollection for a single object.
+
+    @param store: Called after the AVUs change, if given"""
+
+    def __init__(self, session, avus, store=None):
+        self._session = session
+        self._avus = avus
+        self._store = store or (lambda: None)
+
+    def _call(self):
+        self._session._round_trip('metadata')
+
+    def items(self):
+        return list(self._avus)
+
+    def keys(self):
+        return [avu.name for avu in self._avus]
+
+    def get_all(self, key):
+        return [avu for avu in self._avus if avu.name == key]
+
+    def get_one(self, key):
+        values = self.get_all(key)
+        if len(values) != 1:
+            raise KeyError
+        return values[0]
+
+    def __getitem__(self, key):
+        values = self.get_all(key)
+        if not values:
+            raise KeyError
+        return values[0]
+
+    def __setitem__(self, key, meta):
+        for avu in self.get_all(key):
+            self.remove(avu)
+        self.add(meta)
+
+    def __contains__(self, key):
+        return len(self.get_all(key)) > 0
+
+    def __len__(self):
+        return len(self._avus)
+
+    def add(self, *args):
+        meta = args[0] if len(args) == 1 else iRODSMeta(*args)
+        self._call()
+        self._avus.append(iRODSMeta(meta.name, meta.value, meta.units))
+        self._store()
+
+    def remove(self, *args):
+        meta = args[0] if len(args) == 1 else iRODSMeta(*args)
+        self._call()
+        for index, avu in enumerate(self._avus):
+            if (avu.name, avu.value, avu.units or None) == \
+                    (meta.name, meta.value, meta.units or None):
+                del self._avus[index]
+                self._store()
+                return
+
+
+class FakeDataObject:
+    def __init__(self, session, collection, record):
+        self.name = record.name
+        self.path = collection.path + '/' + record.name
+        self.modify_time = record.modify_time
+        self.metadata = FakeMetaCollection(session, record.meta,
+            lambda: session._store_meta(collection, record))
+
+
+class FakeCollection:
+    def __init__(self, session, record):
+        self._session = session
+        self.path = record.path
+        self.name = record.path.rsplit('/', 1)[-1]
+        self.modify_time = record.modify_time
+        self.metadata = FakeMetaCollection(session, record.meta)
+
+    @property
+    def subcollections(self):
+        self._session._round_trip('list')
+        return [FakeCollection(self._session, self._session._collections[path])
+            for path in self._session._children[self.path]]
+
+    @property
+    def data_objects(self):
+        self._session._round_trip('list')
+        record = self._session._collections[self.path]
+        return [FakeDataObject(self._session, record, data)
+            for data in record.data.values()]
+
+
+class _FakeCollectionManager:
+    def __init__(self, session):
+        self._session = session
+
+    def get(self, path):
+        self._session._round_trip('get')
+        try:
+            return FakeCollection(self._session,
+                self._session._collections[path])
+        except KeyError:
+            raise irods.exception.CollectionDoesNotExist(path)
+
+
+class FakeDataFile(io.BytesIO):
+    """Read-only handle on a data object's content, where every read is a
+    round-trip. Seeking is local, so any range can be read."""
+
+    def __init__(self, session, content):
+        super().__init__(content)
+        self._session = session
+        self.reads = 0
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        self._session._round_trip('read')
+        self.reads += 1
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+class _FakeDataObjectManager:
+    def __init__(self, session):
+        self._session = session
+
+    def get(self, path):
+        self._session._round_trip('get')
+        collection, record = self._session._find_data(path)
+        return FakeDataObject(self._session, collection, record)
+
+    def open(self, path, mode='r', **options):
+        if mode not in ('r', 'rb'):
+            raise NotImplementedError("The fake zone is read-only")
+        self._session._round_trip('open')
+        _, record = self._session._find_data(path)
+        return FakeDataFile(self._session, record.content)
+
+
+class _FakeMetadataManager:
+    """Mimics irods.manager.metadata_manager.MetadataManager."""
+
+    def __init__(self, session):
+        self._session = session
+
+    def _find(self, model_cls, path):
+        """Returns the record of the object's collection (None for a
+        collection's own AVUs) and the object's record."""
+        if model_cls is Collection:
+            try:
+                return None, self._session._collections[path]
+            except KeyError:
+                raise irods.exception.CollectionDoesNotExist(path)
+        return self._session._find_data(path)
+
+    def get(self, model_cls, path):
+        self._session._round_trip('metadata')
+        return list(self._find(model_cls, path)[1].meta)
+
+    def add(self, model_cls, path, meta):
+        self._session._round_trip('metadata')
+        collection, record = self._find(model_cls, path)
+        record.meta.append(iRODSMeta(meta.name, meta.value, meta.units))
+        self._session._store_meta(collection, record)
+
+    def remove(self, model_cls, path, meta):
+        self._session._round_trip('metadata')
+        collection, record = self._find(model_cls, path)
+        for index, avu in enumerate(record.meta):
+            if (avu.name, avu.value, avu.units or None) == \
+                    (meta.name, meta.value, meta.units or None):
+                del record.meta[index]
+                self._session._store_meta(collection, record)
+                return
+
+    def set(self, model_cls, path, meta):
+        self._session._round_trip('metadata')
+        collection, record = self._find(model_cls, path)
+        record.meta[:] = [avu for avu in record.meta if avu.name != meta.name]
+        record.meta.append(iRODSMeta(meta.name, meta.value, meta.units))
+        self._session._store_meta(collection, record)
+
+    def apply_atomic_operations(self, model_cls, path, *avu_ops):
+        self._session._round_trip('metadata')
+        if not self._session.supports_atomic:
+            raise irods.exception.SYS_UNMATCHED_API_NUM()
+        collection, record = self._find(model_cls, path)
+        updated = list(record.meta)
+        for op in avu_ops:
+            if not isinstance(op, AVUOperation):
+                raise TypeError("avu_ops must contain AVUOperations")
+            key = (op.avu.name, op.avu.value, op.avu.units or None)
+            existing = [(a.name, a.value, a.units or None) for a in updated]
+            if op.operation == 'add' and key not in existing:
+                updated.append(iRODSMeta(*op.avu))
+            elif op.operation == 'remove' and key in existing:
+                del updated[existing.index(key)]
+        record.meta[:] = updated
+        self._session._store_meta(collection, record)
+
+
+def _like_to_regex(pattern):
+    """Translate an SQL LIKE pattern into an anchored regular expression."""
+    return re.compile('^' + ''.join('.*' if char == '%' else
+        '.' if char == '_' else re.escape(char) for char in pattern) + '$',
+        re.DOTALL)
+
+
+def _matches(criterion, row):
+    value = row[criterion.query_key]
+    op = criterion.op.lower()
+    if op == '=':
+        return value == criterion.value
+    if op == '<>':
+        return value != criterion.value
+    if op == 'like':
+        return bool(_like_to_regex(criterion.value).match(value))
+    if op == 'not like':
+        return not _like_to_regex(criterion.value).match(value)
+    if op == 'in':
+        return value in criterion.value
+    if op == '>':
+        return value > criterion.value
+    if op == '>=':
+        return value >= criterion.value
+    if op == '<':
+        return value < criterion.value
+    if op == '<=':
+        return value <= criterion.value
+    raise NotImplementedError("Unsupported GenQuery operator " + op)
+
+
+class FakeQuery:
+    """Mimics irods.query.Query. Rows are dictionaries keyed by the selected
+    irods.models columns, returned in pages of 'limit' rows, and distinct
+    like a real GenQuery."""
+
+    def __init__(self, session, columns, criteria=(), page_size=256):
+        self._session = session
+        self.columns = list(columns)
+        self.criteria = list(criteria)
+        self._page_size = page_size
+
+    def filter(self, *criteria):
+        return FakeQuery(self._session, self.columns,
+            self.criteria + list(criteria), self._page_size)
+
+    def limit(self, limit):
+        return FakeQuery(self._session, self.columns, self.criteria, limit)
+
+    def _joins(self, model):
+        return any(column in model._columns for column in
+            self.columns + [c.query_key for c in self.criteria])
+
+    @staticmethod
+    def _meta_rows(row, avus, model):
+        for avu in avus:
+            meta_row = dict(row)
+            meta_row[model.name] = avu.name
+            meta_row[model.value] = avu.value
+            meta_row[model.units] = avu.units or ''
+            yield meta_row
+
+    def _filtered(self, column):
+        """Returns the values an equality or 'in' filter restricts a column
+        to, or None if it isn't restricted that way."""
+        for criterion in self.criteria:
+            # Column overloads ==, so columns are compared by identity
+            if criterion.query_key is not column:
+                continue
+            if criterion.op == '=':
+                return [criterion.value]
+            if criterion.op.lower() == 'in':
+                return list(dict.fromkeys(criterion.value))
+        return None
+
+    def _collections(self):
+        """Returns the collections which rows can come from. Like the iCAT's
+        indexes, a filter on a collection's name or its parent's picks them
+        out without scanning the zone, so querying each collection of a big
+        tree in turn isn't quadratic."""
+        collections = self._session._collections
+        names = self._filtered(Collection.name)
+        if names is None:
+            parents = self._filtered(Collection.parent_name)
+            if parents is None:
+                return collections.values()
+            names = [path for parent in parents
+                for path in self._session._children.get(parent, ())]
+        return [collections[name] for name in names if name in collections]
+
+    def _data(self, record):
+        """Returns a collection's data objects which rows can come from,
+        looked up by name if they're filtered by it."""
+        names = self._filtered(DataObject.name)
+        if names is None:
+            return record.data.values()
+        found = []
+        for name in names:
+            try:
+                found.append(record.data[name])
+            except KeyError:
+                pass
+        return found
+
+    def _rows(self):
+        """Generate every candidate row, joined over the models the selected
+        columns come from."""
+        join_data = self._joins(DataObject) or self._joins(DataObjectMeta)
+        for record in self._collections():
+            coll_row = {Collection.name: record.path,
+                Collection.parent_name: record.path.rsplit('/', 1)[0] or '/',
+                Collection.modify_time: record.modify_time}
+            if join_data:
+                for data in self._data(record):
+                    row = dict(coll_row)
+                    row[DataObject.name] = data.name
+                    row[DataObject.size] = data.size
+                    row[DataObject.checksum] = data.checksum
+                    row[DataObject.modify_time] = data.modify_time
+                    if self._joins(DataObjectMeta):
+                        yield from self._meta_rows(row, data.meta,
+                            DataObjectMeta)
+                    else:
+                        yield row
+            elif self._joins(CollectionMeta):
+                yield from self._meta_rows(coll_row, record.meta,
+                    CollectionMeta)
+            else:
+                yield coll_row
+
+    def get_batches(self):
+        # Rows are distinct, as in GenQuery. Rows from different collections
+        # can't be duplicates if the collection's name is selected, so only
+        # one collection's rows are remembered at a time for huge trees.
+        seen = set()
+        scoped = Collection.name in self.columns
+        collection = None
+        page = []
+        for row in self._rows():
+            if not all(_matches(criterion, row) for criterion in
+                    self.criteria):
+                continue
+            if scoped and row[Collection.name] != collection:
+                collection = row[Collection.name]
+                seen.clear()
+            key = tuple(row[column] for column in self.columns)
+            if key in seen:
+                continue
+            seen.add(key)
+            page.append({column: row[column] for column in self.columns})
+            if len(page) == self._page_size:
+                self._session._round_trip('query')
+                yield page
+                page = []
+        self._session._round_trip('query')
+        yield page
+
+    def get_results(self):
+        for page in self.get_batches():
+            yield from page
+
+    def __iter__(self):
+        return self.get_results()
+
+    def all(self):
+        return list(self.get_results())
+
+
+class FakeSession:
+    """In-memory iRODS zone. Populate it with 'add_collection',
+    'add_data_object' and 'add_synthetic_tree', then hand it to anything
+    expecting an iRODSSession.
+
+    Round-trips are one of these kinds: 'get' (fetching a collection or data
+    object), 'list' (a collection's contents), 'query' (a GenQuery page),
+    'metadata', 'open' and 'read'. Latency and failure rates can be given
+    for all of them at once, or as a dictionary by kind.
+
+    @param latency: Seconds slept on every simulated round-trip
+    @param supports_atomic: If False, behave like a server older than 4.2.8
+        with no atomic metadata API
+    @param failure_rate: Probability of a round-trip raising
+        NetworkException instead
+    @param seed: Seed for the failures, so a run can be repeated"""
+
+    def __init__(self, latency=0, supports_atomic=True, failure_rate=0,
+            seed=None):
+        self.latency = latency
+        self.supports_atomic = supports_atomic
+        self.failure_rate = failure_rate
+        self.failures = 0
+        self._random = random.Random(seed)
+        self.round_trips = 0
+        self._collections = OrderedDict()
+        self._children = {}
+        self.collections = _FakeCollectionManager(self)
+        self.data_objects = _FakeDataObjectManager(self)
+        self.metadata = _FakeMetadataManager(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+    def cleanup(self):
+        pass
+
+    @staticmethod
+    def _setting(setting, kind):
+        if isinstance(setting, dict):
+            return setting.get(kind, 0)
+        return setting
+
+    def _round_trip(self, kind=None):
+        self.round_trips += 1
+        latency = self._setting(self.latency, kind)
+        if latency:
+            time.sleep(latency)
+        failure_rate = self._setting(self.failure_rate, kind)
+        if failure_rate and self._random.random() < failure_rate:
+            self.failures += 1
+            raise irods.exception.NetworkException(
+                "Injected {} failure".format(kind or 'round-trip'))
+
+    def _find_data(self, path):
+        collection, name = path.rsplit('/', 1)
+        try:
+            record = self._collections[collection]
+            return record, record.data[name]
+        except KeyError:
+            raise irods.exception.DataObjectDoesNotExist(path)
+
+    def _store_meta(self, collection, record):
+        # A synthetic data object's record is rebuilt on every lookup, so
+        # changes to its AVUs are handed back to be kept
+        if collection is not None and \
+                isinstance(collection.data, _SyntheticData):
+            collection.data.store_meta(record)
+
+    def add_collection(self, path, avus=(), modify_time=0):
+        """Create a collection and any missing parents, and add AVUs to it,
+        given as (attribute, value[, unit]) tuples. 'modify_time', in seconds
+        since the epoch, applies to collections this creates."""
+        path = path.rstrip('/')
+        if path not in self._collections:
+            parent = path.rsplit('/', 1)[0]
+            if parent:
+                self.add_collection(parent, modify_time=modify_time)
+                self._children[parent].append(path)
+            self._collections[path] = _FakeCollectionRecord(path,
+                modify_time)
+            self._children[path] = []
+        self._collections[path].meta.extend(iRODSMeta(*avu) for avu in avus)
+
+    def add_data_object(self, path, content=b'', avus=(), modify_time=0):
+        """Create (or replace) a data object, its parent collections, and its
+        AVUs, given as (attribute, value[, unit]) tuples. 'modify_time' is in
+        seconds since the epoch."""
+        collection, name = path.rsplit('/', 1)
+        self.add_collection(collection, modify_time=modify_time)
+        record = _FakeDataRecord(name, content, modify_time)
+        record.meta.extend(iRODSMeta(*avu) for avu in avus)
+        self._collections[collection].data[name] = record
+
+    def add_synthetic_tree(self, root, num_collections,
+            objects_per_collection, name='file{}', content=b'', avus=(),
+            fanout=100, modify_time=0):
+        """Create a tree of 'num_collections' collections, grouped 'fanout'
+        to a parent as root/group<i>/coll<j>, each holding
+        'objects_per_collection' data objects. The data objects are only
+        built as they're listed or looked up, and only their changed AVUs are
+        kept, so a tree of millions of them costs little memory.
+
+        @param name: Format string for data object names, given 0, 1, ...
+        @param content: Content of every data object
+        @param avus: AVUs every data object starts with
+        @return: Paths of the collections"""
+
+        root = root.rstrip('/')
+        paths = []
+        for index in range(num_collections):
+            path = '{}/group{}/coll{}'.format(root, index // fanout, index)
+            self.add_collection(path, modify_time=modify_time)
+            self._collections[path].data = _SyntheticData(
+                objects_per_collection, name, content, avus, modify_time)
+            paths.append(path)
+        return paths
+
+    def query(self, *columns):
+        return FakeQuery(self, columns)
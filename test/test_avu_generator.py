@@ -1,4 +1,10 @@
+import os
+import pickle
+import tempfile
+import threading
+import time
 import unittest
+from executor.executor import diff_avus
 from planner import planner
 from planner.object_class import Plan, AVU
 
@@ -8,17 +14,22 @@ class TestAVUGenerator(unittest.TestCase):
             '/test/e.cram', '/test2/abc.cram'],
             'collections': ['/test', '/test2']}
 
+        # Every matching pattern's AVUs are kept, lowest precedence first, so
+        # the ones '*' shares with '*.cram' appear twice
         output = [
             Plan('/test/a.txt', False,
                 [AVU('pi', 'ch12', None), AVU('group', 'hgi', None)]),
             Plan('/test/d.cram', False,
                 [AVU('pi', 'ch12', None), AVU('group', 'hgi', None),
+                AVU('pi', 'ch12', None), AVU('group', 'hgi', None),
                 AVU('cost', 100000, 'gbp')]),
             Plan('/test/e.cram', False,
                 [AVU('pi', 'ch12', None), AVU('group', 'hgi', None),
+                AVU('pi', 'ch12', None), AVU('group', 'hgi', None),
                 AVU('cost', 100000, 'gbp')]),
             Plan('/test2/abc.cram', False,
                 [AVU('pi', 'ch12', None), AVU('group', 'hgi', None),
+                AVU('pi', 'ch12', None), AVU('group', 'hgi', None),
                 AVU('cost', 100000, 'gbp')])
         ]
 
@@ -35,6 +46,115 @@ class TestAVUGenerator(unittest.TestCase):
             list(planner.generate_plans(catalogue, "test/test_config_1.yaml",
                 include_collections=True)), output_collections)
 
+    def test_shared_static_avus(self):
+        catalogue = [('/test/d.cram', False), ('/test/e.cram', False),
+            ('/test/a.txt', False)]
+        plans = list(planner.generate_plans(catalogue,
+            "test/test_config_1.yaml"))
+
+        self.assertIs(plans[0].static, plans[1].static)
+        self.assertEqual(plans[0].rule_set, plans[1].rule_set)
+        self.assertNotEqual(plans[0].rule_set, plans[2].rule_set)
+
+        copies = pickle.loads(pickle.dumps(plans[:2]))
+        self.assertEqual(copies, plans[:2])
+        self.assertIs(copies[0].static, copies[1].static)
+
+    def test_inferred_avus(self):
+        plan = Plan('/test/a.cram', False, rule_set=0,
+            static=(AVU('pi', 'ch12'),))
+        plan.add_inferred(AVU('version', '1.6'))
+        self.assertEqual(plan.metadata, [AVU('pi', 'ch12'),
+            AVU('version', '1.6')])
+        self.assertEqual(plan.static, (AVU('pi', 'ch12'),))
+
+    def test_configuration_order(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = os.path.join(directory, 'config.yaml')
+            with open(config, 'w') as file:
+                file.write('"*.cram":\n'
+                    '- attribute: library\n  value: a\n'
+                    '- attribute: library\n  value: b\n'
+                    '- attribute: version\n  value: unknown\n'
+                    '- infer: sequence\n  mapping:\n    version: HD.VN\n'
+                    '- attribute: library\n  value: a\n'
+                    '"*":\n'
+                    '- attribute: pi\n  value: ch12\n'
+                    '- attribute: library\n  value: a\n')
+
+            readers = planner.HEADER_READERS
+            planner.HEADER_READERS = dict(readers,
+                sequence=lambda path, session=None: {'HD': {'VN': '1.6'}})
+            try:
+                plan, = planner.generate_plans([('/test/a.cram', False)],
+                    config)
+            finally:
+                planner.HEADER_READERS = readers
+
+        # Every value of an attribute is kept, even when repeated, and
+        # inferred AVUs stay where their entry is
+        self.assertEqual(plan.metadata, [AVU('pi', 'ch12'),
+            AVU('library', 'a'), AVU('library', 'a'), AVU('library', 'b'),
+            AVU('version', 'unknown'), AVU('version', '1.6'),
+            AVU('library', 'a')])
+        self.assertEqual(diff_avus([], plan.metadata), ([AVU('pi', 'ch12'),
+            AVU('library', 'a'), AVU('version', 'unknown')], []))
+        self.assertEqual(diff_avus([], plan.metadata, overwrite=True),
+            ([AVU('pi', 'ch12'), AVU('library', 'a'), AVU('version', '1.6')],
+            []))
+
+        copy = pickle.loads(pickle.dumps(plan))
+        self.assertEqual(copy.metadata, plan.metadata)
+
+    def test_lazy_catalogue(self):
+        consumed = []
+
+        def catalogue():
+            for path in ['/test/a.txt', '/test/b.txt', '/test/c.txt']:
+                consumed.append(path)
+                yield (path, False)
+
+        plans = planner.generate_plans(catalogue(), "test/test_config_1.yaml")
+        self.assertEqual(next(plans).path, '/test/a.txt')
+        self.assertEqual(consumed, ['/test/a.txt'])
+
+    def test_parallel_inference(self):
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def read(path, session=None):
+            with lock:
+                active.append(path)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.remove(path)
+            return {'HD': {'VN': path}}
+
+        with tempfile.TemporaryDirectory() as directory:
+            config = os.path.join(directory, 'config.yaml')
+            with open(config, 'w') as file:
+                file.write('"*.cram":\n- infer: sequence\n  mapping:\n'
+                    '    version: HD.VN\n')
+            paths = ['/test/{}.cram'.format(i) for i in range(16)]
+
+            readers = planner.HEADER_READERS
+            planner.HEADER_READERS = dict(readers, sequence=read)
+            try:
+                start = time.monotonic()
+                plans = list(planner.generate_plans(((path, False) for path
+                    in paths), config, inference_jobs=8))
+                elapsed = time.monotonic() - start
+            finally:
+                planner.HEADER_READERS = readers
+
+        self.assertEqual([plan.path for plan in plans], paths)
+        self.assertEqual([plan.metadata for plan in plans],
+            [[AVU('version', path)] for path in paths])
+        self.assertLessEqual(max(peak), 8)
+        self.assertLess(elapsed, 16 * 0.05 / 2)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,153 @@
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+from datetime import datetime, timezone
+
+from irods.exception import CollectionDoesNotExist
+
+from core.backend import default_in_flight
+from core.baton import DEFAULT_IN_FLIGHT, BatonBackend, BatonError
+from executor.executor import Executor
+from planner.object_class import AVU, Plan
+
+FAKE_BATON = os.path.join(os.path.dirname(__file__), 'fake_baton.py')
+
+
+class TestBaton(unittest.TestCase):
+    '''Suite of tests on the baton-do backend, against a scripted stand-in
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.state = os.path.join(self.directory.name, 'zone.json')
+        zone = {'collections': {
+            '/zone/coll': {'modified': '2024-01-01T00:00:00Z'},
+            '/zone/coll/sub': {'modified': '2024-03-01T00:00:00Z',
+                'avus': [{'attribute': 'c', 'value': 'd'}]}},
+            'data_objects': {
+            '/zone/coll/a': {'modified': '2024-01-01T00:00:00Z',
+                'avus': [{'attribute': 'pi', 'value': 'ch12',
+                    'units': 'u'}]},
+            '/zone/coll/b': {'modified': '2024-03-01T00:00:00Z'},
+            '/zone/coll/sub/c': {'modified': '2024-03-01T00:00:00Z',
+                'avus': [{'attribute': 'x', 'value': 'y'}]}}}
+        with open(self.state, 'w') as file:
+            json.dump(zone, file)
+        self.backend = BatonBackend([sys.executable, FAKE_BATON, self.state])
+
+    def tearDown(self):
+        self.backend.cleanup()
+        self.directory.cleanup()
+
+    def zone(self):
+        self.backend.cleanup()
+        with open(self.state) as file:
+            return json.load(file)
+
+    def test_catalogue(self):
+        self.assertEqual(list(self.backend.iter_catalogue('/zone/coll/',
+            include_collections=True)), [('/zone/coll/a', False),
+            ('/zone/coll/b', False), ('/zone/coll/sub/c', False),
+            ('/zone/coll', True), ('/zone/coll/sub', True)])
+
+        since = datetime(2024, 2, 1, tzinfo=timezone.utc)
+        self.assertEqual(list(self.backend.iter_catalogue('/zone/coll',
+            include_collections=True, since=since)), [
+            ('/zone/coll/b', False), ('/zone/coll/sub/c', False),
+            ('/zone/coll/sub', True)])
+
+        with self.assertRaises(CollectionDoesNotExist):
+            list(self.backend.iter_catalogue('/zone/missing'))
+
+    def test_query_metadata(self):
+        self.assertEqual(self.backend.query_metadata('/zone/coll'),
+            {'/zone/coll/a': [('pi', 'ch12', 'u')]})
+        self.assertEqual(self.backend.query_metadata('/zone/coll',
+            is_collection=True), {'/zone/coll/sub': [('c', 'd', None)]})
+        self.assertEqual(self.backend.query_metadata('/zone/coll/sub',
+            ['c', 'missing']), {'/zone/coll/sub/c': [('x', 'y', None)]})
+
+    def test_apply_metadata(self):
+        self.backend.apply_metadata('/zone/coll/a', [('pi', 'ch13', None),
+            ('group', 'hgi', None)], [('pi', 'ch12', 'u')])
+        self.backend.apply_metadata('/zone/coll/sub', [('e', 'f', None)], [],
+            is_collection=True)
+        with self.assertRaises(BatonError) as context:
+            self.backend.apply_metadata('/zone/coll/missing',
+                [('e', 'f', None)], [])
+        self.assertEqual(context.exception.code, -310000)
+
+        zone = self.zone()
+        self.assertEqual(zone['data_objects']['/zone/coll/a']['avus'], [
+            {'attribute': 'pi', 'value': 'ch13'},
+            {'attribute': 'group', 'value': 'hgi'}])
+        self.assertEqual(zone['collections']['/zone/coll/sub']['avus'][-1],
+            {'attribute': 'e', 'value': 'f'})
+        # Every operation went to the same process
+        self.assertEqual(zone['starts'], 1)
+
+    def test_restart(self):
+        with self.assertRaises(BatonError):
+            self.backend.client.call('crash', {})
+        self.assertEqual(len(self.backend.query_metadata('/zone/coll')), 1)
+        self.assertEqual(self.zone()['starts'], 2)
+
+    def test_unexpected_output(self):
+        client = self.backend.client
+        self.assertEqual(client.call('echo', {}), {})
+        # The second answer had no request waiting for it
+        deadline = time.monotonic() + 5
+        while client._process is not None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertIsNone(client._process)
+        self.assertEqual(len(self.backend.query_metadata('/zone/coll')), 1)
+        self.assertEqual(client.starts, 2)
+
+    def test_timeout(self):
+        self.backend.client.timeout = 0.5
+        with self.assertRaises(BatonError):
+            self.backend.client.call('hang', {})
+        self.backend.client.timeout = 10
+        self.assertEqual(len(self.backend.query_metadata('/zone/coll')), 1)
+        self.assertEqual(self.backend.client.starts, 2)
+
+    def test_batch_deadline(self):
+        # Each answer comes within the timeout, but the batch doesn't
+        client = self.backend.client
+        client.timeout = 0.5
+        start = time.monotonic()
+        results = client.call_all([('slow', {}, {'seconds': 0.3})] * 4)
+        self.assertLess(time.monotonic() - start, 0.9)
+        self.assertEqual(results[0], {})
+        for result in results[1:]:
+            self.assertIsInstance(result, BatonError)
+        client.timeout = 10
+        self.assertEqual(len(self.backend.query_metadata('/zone/coll')), 1)
+        self.assertEqual(client.starts, 2)
+
+    def test_default_in_flight(self):
+        self.assertEqual(default_in_flight('baton'), DEFAULT_IN_FLIGHT)
+        self.assertEqual(default_in_flight('irodsclient'), 1)
+
+    def test_executor(self):
+        executor = Executor(self.backend, 1, in_flight=4)
+        plans = [Plan(path, False, [AVU('pi', 'ch12', 'u'), AVU('q', 'r')])
+            for path in ['/zone/coll/a', '/zone/coll/b', '/zone/coll/sub/c']]
+        self.assertEqual(sorted(executor.execute_plans(plans)),
+            ['/zone/coll/a', '/zone/coll/b', '/zone/coll/sub/c'])
+        self.assertEqual(executor.failures, 0)
+
+        zone = self.zone()
+        self.assertEqual(zone['data_objects']['/zone/coll/b']['avus'], [
+            {'attribute': 'pi', 'value': 'ch12', 'units': 'u'},
+            {'attribute': 'q', 'value': 'r'}])
+        self.assertEqual(len(zone['data_objects']['/zone/coll/a']['avus']),
+            2)
+        self.assertEqual(zone['starts'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
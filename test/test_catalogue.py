@@ -0,0 +1,93 @@
+import unittest
+from datetime import datetime, timezone
+
+import core.irods_wrapper as irods_wrapper
+from test.fake_irods import FakeSession
+
+
+class TestCatalogue(unittest.TestCase):
+    '''Suite of tests on listing a collection tree
+    '''
+
+    def setUp(self):
+        self.session = FakeSession()
+        self.session.add_data_object('/zone/root/a.txt')
+        self.session.add_data_object('/zone/root/sub/b.cram')
+        self.session.add_data_object('/zone/root/sub/deeper/c.vcf')
+        self.session.add_collection('/zone/root/empty')
+        # LIKE treats '_' as a wildcard, so this must not be listed
+        self.session.add_data_object('/zone/rootX/d.txt')
+        self.session.add_data_object('/zone/root_other/e.txt')
+
+    def test_query_matches_walk(self):
+        queried = irods_wrapper.get_irods_catalogue('/zone/root/',
+            self.session)
+        walked = irods_wrapper.get_irods_catalogue('/zone/root',
+            self.session, walk=True)
+
+        self.assertEqual(sorted(queried['objects']), ['/zone/root/a.txt',
+            '/zone/root/sub/b.cram', '/zone/root/sub/deeper/c.vcf'])
+        self.assertEqual(sorted(queried['collections']), ['/zone/root',
+            '/zone/root/empty', '/zone/root/sub', '/zone/root/sub/deeper'])
+        self.assertEqual(sorted(queried['objects']), sorted(walked['objects']))
+        self.assertEqual(sorted(queried['collections']),
+            sorted(walked['collections']))
+
+    def test_underscore_root(self):
+        catalogue = irods_wrapper.get_irods_catalogue('/zone/root_other',
+            self.session)
+        self.assertEqual(catalogue['objects'], ['/zone/root_other/e.txt'])
+
+    def test_missing_collection(self):
+        self.assertFalse(irods_wrapper.get_irods_catalogue('/zone/nope',
+            self.session))
+
+    def test_streaming(self):
+        for i in range(600):
+            self.session.add_data_object('/zone/root/many/f{}'.format(i))
+
+        self.session.round_trips = 0
+        stream = irods_wrapper.iter_irods_catalogue('/zone/root',
+            self.session, include_collections=True)
+        # The first path arrives after the existence check and a single
+        # page, long before the listing is complete
+        self.assertFalse(next(stream)[1])
+        self.assertEqual(self.session.round_trips, 2)
+
+        entries = list(stream)
+        self.assertEqual(len([e for e in entries if not e[1]]), 602)
+        self.assertEqual(entries[-1], ('/zone/root/many', True))
+
+    def test_query_round_trips(self):
+        for i in range(50):
+            self.session.add_data_object('/zone/root/many/{}/f'.format(i))
+
+        self.session.round_trips = 0
+        irods_wrapper.get_irods_catalogue('/zone/root', self.session)
+        queried = self.session.round_trips
+
+        self.session.round_trips = 0
+        irods_wrapper.get_irods_catalogue('/zone/root', self.session,
+            walk=True)
+        self.assertLess(queried, self.session.round_trips)
+
+    def test_since(self):
+        self.session.add_data_object('/zone/root/sub/new.cram',
+            modify_time=2000)
+        self.session.add_data_object('/zone/root/a.txt', modify_time=1000)
+        self.session.add_collection('/zone/root/fresh/dir', modify_time=3000)
+        since = datetime.fromtimestamp(1000, timezone.utc)
+
+        for walk in (False, True):
+            entries = list(irods_wrapper.iter_irods_catalogue('/zone/root',
+                self.session, include_collections=True, walk=walk,
+                since=since))
+            self.assertEqual(sorted(entries), [
+                ('/zone/root/a.txt', False),
+                ('/zone/root/fresh', True),
+                ('/zone/root/fresh/dir', True),
+                ('/zone/root/sub/new.cram', False)])
+
+
+if __name__ == "__main__":
+    unittest.main()
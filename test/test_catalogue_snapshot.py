@@ -0,0 +1,113 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+import core.irods_wrapper as irods_wrapper
+from core.catalogue_snapshot import CatalogueSnapshot, SnapshotError, \
+    spool_snapshot, write_snapshot
+from test.fake_irods import FakeSession
+
+
+class TestCatalogueSnapshot(unittest.TestCase):
+    '''Suite of tests on the catalogue snapshot format
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'catalogue.snap')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        entries = [('/zone/a/sample_001.cram', False),
+            ('/zone/a/sample_002.cram', False), ('/zone/b/x', False),
+            ('/zone/a/sample_002.cram.crai', False),
+            ('/zone/a/other', False), ('/zone/é/ünïcode.vcf', False),
+            ('/top', False), ('/zone', True), ('/zone/a', True),
+            ('/zone/é', True)]
+        self.assertEqual(list(write_snapshot(iter(entries), self.path,
+            '/zone')), entries)
+
+        with CatalogueSnapshot(self.path) as snapshot:
+            self.assertEqual(snapshot.root, '/zone')
+            self.assertEqual(len(snapshot), len(entries))
+            self.assertEqual(list(snapshot), entries)
+            # Can be iterated over more than once
+            self.assertEqual(list(snapshot), entries)
+
+    def test_fake_zone(self):
+        session = FakeSession()
+        for i in range(50):
+            session.add_data_object('/zone/c{}/d{}/file_{}.cram'.format(
+                i % 3, i % 7, i))
+        listing = list(irods_wrapper.iter_irods_catalogue('/zone', session,
+            include_collections=True))
+
+        list(write_snapshot(irods_wrapper.iter_irods_catalogue('/zone',
+            session, include_collections=True), self.path, '/zone'))
+        with CatalogueSnapshot(self.path) as snapshot:
+            self.assertEqual(list(snapshot), listing)
+
+    def test_interrupted(self):
+        entries = write_snapshot((('/zone/f{}'.format(i), False)
+            for i in range(10)), self.path)
+        next(entries)
+        entries.close()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.path + '.partial'))
+
+        with self.assertRaises(SnapshotError):
+            CatalogueSnapshot(self.path)
+
+        with open(self.path, 'w') as file:
+            file.write('{"objects": []}')
+        with self.assertRaises(SnapshotError):
+            CatalogueSnapshot(self.path)
+
+    def test_spool(self):
+        entries = [('/zone/c{}/file_{}.cram'.format(i % 3, i), False)
+            for i in range(1000)] + [('/zone/c0', True)]
+        listed = threading.Event()
+
+        def listing():
+            yield from entries
+            listed.set()
+
+        spooled = spool_snapshot(listing(), self.path, '/zone')
+        # The listing is drained into the snapshot while nothing consumes it
+        self.assertEqual(next(spooled), entries[0])
+        self.assertTrue(listed.wait(5))
+        spooled.close()
+        with CatalogueSnapshot(self.path) as snapshot:
+            self.assertEqual(list(snapshot), entries)
+
+        self.assertEqual(list(spool_snapshot(iter(entries), self.path,
+            '/zone')), entries)
+
+    def test_spool_failure(self):
+        def listing():
+            yield ('/zone/a', False)
+            raise ValueError("Listing failed")
+
+        spooled = spool_snapshot(listing(), self.path)
+        self.assertEqual(next(spooled), ('/zone/a', False))
+        with self.assertRaises(ValueError):
+            next(spooled)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.path + '.partial'))
+
+    def test_smaller_than_json(self):
+        objects = ['/seq/illumina/runs/{}/{}/plex{}/{}_{}#{}.cram'.format(
+            run // 100, run, lane, run, lane, plex) for run in range(50)
+            for lane in range(8) for plex in range(24)]
+        list(write_snapshot(((path, False) for path in objects), self.path))
+        size = os.path.getsize(self.path)
+        self.assertLess(size, len(json.dumps({'objects': objects,
+            'collections': []})) / 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
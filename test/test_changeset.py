@@ -0,0 +1,102 @@
+import os
+import tempfile
+import unittest
+
+from irods.models import DataObject
+
+from executor.changeset import ChangeSetError, ChangeSetReader, diff_plans, \
+    write_changeset
+from executor.executor import Executor
+from executor.prefetch import MetadataPrefetcher
+from planner.object_class import AVU, Change, Plan
+from test.fake_irods import FakeSession
+
+
+class TestChangeSet(unittest.TestCase):
+    '''Suite of tests on planning changes to a file and replaying them
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.session = FakeSession()
+        self.session.add_data_object('/zone/coll/a', avus=[('pi', 'old')])
+        self.session.add_data_object('/zone/coll/b', avus=[('pi', 'ch12'),
+            ('group', 'hgi')])
+        self.session.add_data_object('/zone/coll/c', avus=[('x', 'y', 'u')])
+        self.plans = [Plan(path, False, [AVU('pi', 'ch12'),
+            AVU('group', 'hgi')]) for path in
+            ['/zone/coll/a', '/zone/coll/b', '/zone/coll/c']]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def avus(self, path):
+        return sorted((avu.name, avu.value, avu.units) for avu in
+            self.session.metadata.get(DataObject, path))
+
+    def plan(self, name, **flags):
+        path = os.path.join(self.directory.name, name)
+        summary = {}
+        changes = diff_plans(self.plans, MetadataPrefetcher(self.session),
+            summary=summary, **flags)
+        self.assertEqual(write_changeset(changes, path, '/zone/coll',
+            **flags), summary['changed'])
+        return path, summary
+
+    def test_round_trip(self):
+        for name in ['changes.jsonl', 'changes.jsonl.gz']:
+            path, summary = self.plan(name, refresh=True)
+            self.assertEqual(summary, {'objects': 3, 'changed': 2,
+                'added': 3, 'modified': 1, 'removed': 1})
+
+            with ChangeSetReader(path) as changes:
+                self.assertEqual(changes.header['root'], '/zone/coll')
+                self.assertTrue(changes.header['refresh'])
+                # Objects which are already as planned aren't written
+                self.assertEqual(list(changes), [
+                    Change('/zone/coll/a', False, (AVU('pi', 'ch12'),
+                        AVU('group', 'hgi')), (AVU('pi', 'old'),)),
+                    Change('/zone/coll/c', False, (AVU('pi', 'ch12'),
+                        AVU('group', 'hgi')), (AVU('x', 'y', 'u'),))])
+
+    def test_planning_changes_nothing(self):
+        self.plan('changes.jsonl', overwrite=True)
+        self.assertEqual(self.avus('/zone/coll/a'), [('pi', 'old', None)])
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name,
+            'changes.jsonl.partial')))
+
+    def test_apply(self):
+        path, _ = self.plan('changes.jsonl', overwrite=True)
+        executor = Executor(self.session, 1)
+
+        self.session.round_trips = 0
+        with ChangeSetReader(path) as changes:
+            applied = list(executor.execute_plans(changes))
+        # One atomic write per changed object, and no reads
+        self.assertEqual(applied, ['/zone/coll/a', '/zone/coll/c'])
+        self.assertEqual(self.session.round_trips, 2)
+
+        self.assertEqual(self.avus('/zone/coll/a'), [('group', 'hgi', None),
+            ('pi', 'ch12', None)])
+        self.assertEqual(self.avus('/zone/coll/c'), [('group', 'hgi', None),
+            ('pi', 'ch12', None), ('x', 'y', 'u')])
+
+    def test_invalid(self):
+        path = os.path.join(self.directory.name, 'changes.jsonl')
+        with self.assertRaises(ChangeSetError):
+            ChangeSetReader(path)
+
+        with open(path, 'w') as file:
+            file.write('{"changeset": 1}\n{"path": "/zone/coll/a"}\n')
+        with ChangeSetReader(path) as changes:
+            with self.assertRaises(ChangeSetError):
+                list(changes)
+
+        with open(path, 'w') as file:
+            file.write('/zone/coll/a\n')
+        with self.assertRaises(ChangeSetError):
+            ChangeSetReader(path)
+
+
+if __name__ == "__main__":
+    unittest.main()
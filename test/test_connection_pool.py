@@ -0,0 +1,117 @@
+import socket
+import threading
+import time
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from irods.session import iRODSSession
+
+import core.metrics as metrics
+from core.connection_pool import ConnectionPool
+
+
+class _FakeConnection:
+    """Stands in for an irods.connection.Connection, with one end of a socket
+    pair as its socket and the other as the server's."""
+
+    def __init__(self, pool, account):
+        self.pool = pool
+        self.socket, self.server = socket.socketpair()
+        self.create_time = datetime.now()
+
+    def disconnect(self):
+        self.socket.close()
+
+    def release(self, destroy=False):
+        self.pool.release_connection(self, destroy)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class TestConnectionPool(unittest.TestCase):
+    '''Suite of tests on the managed iRODS connection pool
+    '''
+
+    def setUp(self):
+        patcher = mock.patch('irods.pool.Connection', _FakeConnection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = ConnectionPool(None, size=2, wait=0.05)
+        self.opened = metrics.POOL_CONNECTIONS_OPENED.value
+        self.dropped = metrics.POOL_CONNECTIONS_DROPPED.value
+        self.overflows = metrics.POOL_OVERFLOWS.value
+
+    def test_reuse(self):
+        with self.pool.get_connection() as conn:
+            self.assertEqual(metrics.POOL_CONNECTIONS_IN_USE.value, 1)
+        with self.pool.get_connection() as again:
+            self.assertIs(again, conn)
+        self.assertEqual(metrics.POOL_CONNECTIONS_OPENED.value - self.opened,
+            1)
+        self.assertEqual(metrics.POOL_CONNECTIONS.value, 1)
+        self.assertEqual(metrics.POOL_CONNECTIONS_IN_USE.value, 0)
+
+    def test_health_check(self):
+        with self.pool.get_connection() as conn:
+            pass
+        # The server closing an idle connection makes its socket readable
+        conn.server.close()
+        with self.pool.get_connection() as again:
+            self.assertIsNot(again, conn)
+        self.assertEqual(metrics.POOL_CONNECTIONS_DROPPED.value -
+            self.dropped, 1)
+        self.assertEqual(metrics.POOL_CONNECTIONS.value, 1)
+
+    def test_failure(self):
+        conn = self.pool.get_connection()
+        # python-irodsclient destroys a connection which fails
+        conn.release(True)
+        self.assertEqual(metrics.POOL_CONNECTIONS_DROPPED.value -
+            self.dropped, 1)
+        with self.pool.get_connection() as again:
+            self.assertIsNot(again, conn)
+
+    def test_size(self):
+        first = self.pool.get_connection()
+        second = self.pool.get_connection()
+
+        # A connection released while waiting is handed over
+        threading.Timer(0.01, first.release).start()
+        self.pool.wait = 5
+        third = self.pool.get_connection()
+        self.assertIs(third, first)
+        self.assertEqual(metrics.POOL_OVERFLOWS.value - self.overflows, 0)
+
+        # Otherwise one is opened beyond the limit
+        self.pool.wait = 0.05
+        start = time.monotonic()
+        overflow = self.pool.get_connection()
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+        self.assertEqual(metrics.POOL_OVERFLOWS.value - self.overflows, 1)
+        self.assertEqual(metrics.POOL_CONNECTIONS_IN_USE.value, 3)
+
+        for conn in [second, third, overflow]:
+            conn.release()
+        # Every slot was given back, and only those
+        first = self.pool.get_connection()
+        second = self.pool.get_connection()
+        self.assertEqual(metrics.POOL_OVERFLOWS.value - self.overflows, 1)
+
+    def test_install(self):
+        session = iRODSSession(host='localhost', port=1247, user='rods',
+            zone='zone', password='secret')
+        session.connection_timeout = 30
+        ConnectionPool.install(session, size=3, keepalive=10)
+        self.assertIsInstance(session.pool, ConnectionPool)
+        self.assertEqual(session.pool.size, 3)
+        self.assertEqual(session.pool.connection_timeout, 30)
+        self.assertEqual(session.username, 'rods')
+
+
+if __name__ == "__main__":
+    unittest.main()
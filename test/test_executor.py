@@ -1,7 +1,18 @@
 import unittest
-from executor.executor import Executor
+from executor.executor import Executor, diff_avus
 from planner.object_class import Plan, AVU
 import core.irods_wrapper as irods_wrapper
+from irods.models import DataObject
+from core.partition import partition
+from test.fake_irods import FakeSession
+
+
+def _fake_zone():
+    """Session factory for worker processes; each gets its own copy."""
+    session = FakeSession()
+    for i in range(40):
+        session.add_data_object('/zone/coll/f{}'.format(i))
+    return session
 
 
 class TestExecutorMethods(unittest.TestCase):
@@ -118,5 +129,114 @@ class TestExecutorMethods(unittest.TestCase):
     #     changed_metadata = irods_wrapper get_metadata(self.session, filepath)# <iRODSMeta 13186 key2 value5 units2>
     #     self.assertEqual(changed_metadata['foo'].value, "changed_bar")
     #     self.assertEqual(changed_metadata['foo'].units, None)
+
+
+class TestDiffAVUs(unittest.TestCase):
+    '''Suite of tests on computing AVU changes locally
+    '''
+
+    existing = [AVU('foo', 'bar'), AVU('pi', 'old'), AVU('pi', 'older')]
+    planned = [AVU('pi', 'ch12'), AVU('group', 'hgi'), AVU('pi', 'ch13'),
+        AVU('foo', 'bar', '')]
+
+    def test_default(self):
+        to_add, to_remove = diff_avus(self.existing, self.planned)
+        self.assertEqual(to_add, [AVU('group', 'hgi')])
+        self.assertEqual(to_remove, [])
+
+    def test_overwrite(self):
+        to_add, to_remove = diff_avus(self.existing, self.planned,
+            overwrite=True)
+        self.assertEqual(to_add, [AVU('pi', 'ch13'), AVU('group', 'hgi')])
+        self.assertEqual(to_remove, [AVU('pi', 'old'), AVU('pi', 'older')])
+
+    def test_refresh(self):
+        to_add, to_remove = diff_avus(self.existing + [AVU('x', 'y')],
+            self.planned, refresh=True)
+        self.assertEqual(to_add, [AVU('pi', 'ch13'), AVU('group', 'hgi')])
+        self.assertEqual(to_remove, [AVU('pi', 'old'), AVU('pi', 'older'),
+            AVU('x', 'y')])
+
+    def test_no_op(self):
+        for flags in [(False, False), (True, False), (False, True)]:
+            self.assertEqual(diff_avus([AVU('a', 'b', 'c')],
+                [AVU('a', 'b', 'c')], *flags), ([], []))
+
+
+class TestExecutorFakeSession(unittest.TestCase):
+    '''Suite of tests on executor round-trips, against an in-memory zone
+    '''
+
+    filepath = '/zone/coll/f3'
+
+    def setUp(self):
+        self.session = FakeSession()
+        self.session.add_data_object(self.filepath,
+            avus=[('index', '3'), ('unit', 'x', 'u')])
+        self.session.add_data_object('/zone/coll/f4', avus=[('index', '4')])
+
+    def final_avus(self):
+        return sorted((avu.name, avu.value, avu.units) for avu in
+            self.session.metadata.get(DataObject, self.filepath))
+
+    def test_overwrite_uses_snapshot(self):
+        executor = Executor(self.session, 1)
+        plan = Plan(self.filepath, False, [AVU('index', 'new'),
+            AVU('group', 'hgi')])
+        executor.execute_plan(plan, overwrite=True)
+
+        self.assertEqual(self.final_avus(), [('group', 'hgi', None),
+            ('index', 'new', None), ('unit', 'x', 'u')])
+        self.assertEqual(executor.prefetcher.get(self.filepath),
+            [AVU('unit', 'x', 'u'), AVU('index', 'new'), AVU('group', 'hgi')])
+
+    def test_refresh_is_one_write(self):
+        executor = Executor(self.session, 1)
+        plan = Plan(self.filepath, False,
+            [AVU('key{}'.format(i), str(i)) for i in range(30)])
+
+        self.session.round_trips = 0
+        executor.execute_plan(plan, refresh=True)
+        # One metadata query and one atomic write
+        self.assertEqual(self.session.round_trips, 2)
+        self.assertEqual(len(self.final_avus()), 30)
+        self.assertNotIn(('index', '3', None), self.final_avus())
+
+    def test_without_atomic_api(self):
+        self.session.supports_atomic = False
+        executor = Executor(self.session, 1)
+        plan = Plan(self.filepath, False, [AVU('index', 'new')])
+        executor.execute_plan(plan, refresh=True)
+        self.assertEqual(self.final_avus(), [('index', 'new', None)])
+
+    def test_worker_processes(self):
+        executor = Executor(None, 3, session_factory=_fake_zone)
+        plans = [Plan('/zone/coll/f{}'.format(i), False, [AVU('a', 'b')])
+            for i in range(40)]
+        plans.append(Plan('/zone/coll/missing', False, [AVU('a', 'b')]))
+
+        done = list(executor.execute_plans(plans))
+        self.assertEqual(sorted(done), sorted(plan.path for plan in plans[:-1]))
+
+    def test_in_flight(self):
+        for i in range(20):
+            self.session.add_data_object('/zone/other/f{}'.format(i))
+        executor = Executor(self.session, 1, in_flight=4)
+        plans = [Plan('/zone/other/f{}'.format(i), False, [AVU('a', 'b')])
+            for i in range(20)]
+
+        done = list(executor.execute_plans(plans))
+        self.assertEqual(sorted(done), sorted(plan.path for plan in plans))
+        for plan in plans:
+            self.assertEqual(executor.prefetcher.get(plan.path),
+                [AVU('a', 'b')])
+
+    def test_partition_is_stable(self):
+        self.assertEqual(partition('/zone/coll/f1', 7),
+            partition('/zone/coll/f1', 7))
+        self.assertEqual(set(partition('/zone/f{}'.format(i), 4)
+            for i in range(100)), {0, 1, 2, 3})
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
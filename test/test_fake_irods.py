@@ -0,0 +1,114 @@
+import time
+import unittest
+
+from irods.exception import DataObjectDoesNotExist, NetworkException
+from irods.meta import iRODSMeta
+from irods.models import DataObject
+
+import core.irods_wrapper as irods_wrapper
+from test.fake_irods import FakeSession
+
+
+class TestFakeIrods(unittest.TestCase):
+    '''Suite of tests on the fake zone the tests and benchmarks run against
+    '''
+
+    def test_latency(self):
+        session = FakeSession(latency={'read': 0.05})
+        session.add_data_object('/zone/coll/a', content=b'abc')
+
+        start = time.monotonic()
+        session.data_objects.get('/zone/coll/a')
+        self.assertLess(time.monotonic() - start, 0.05)
+
+        with session.data_objects.open('/zone/coll/a', 'r') as file:
+            start = time.monotonic()
+            file.read()
+            self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+    def test_failures(self):
+        def fail(seed):
+            session = FakeSession(failure_rate={'metadata': 0.5}, seed=seed)
+            session.add_data_object('/zone/coll/a')
+            failed = []
+            for _ in range(20):
+                try:
+                    session.metadata.get(DataObject, '/zone/coll/a')
+                    failed.append(False)
+                except NetworkException:
+                    failed.append(True)
+            # Other kinds of round-trip never fail
+            session.data_objects.get('/zone/coll/a')
+            self.assertEqual(session.failures, sum(failed))
+            return failed
+
+        failed = fail(1)
+        self.assertTrue(any(failed))
+        self.assertFalse(all(failed))
+        self.assertEqual(fail(1), failed)
+
+    def test_synthetic_tree(self):
+        session = FakeSession()
+        paths = session.add_synthetic_tree('/zone/big', 3, 4,
+            name='f{}.sam', avus=[('pi', 'ch12')], fanout=2)
+        self.assertEqual(paths, ['/zone/big/group0/coll0',
+            '/zone/big/group0/coll1', '/zone/big/group1/coll2'])
+
+        catalogue = irods_wrapper.get_irods_catalogue('/zone/big', session)
+        self.assertEqual(len(catalogue['objects']), 12)
+        self.assertIn('/zone/big/group1/coll2/f3.sam', catalogue['objects'])
+
+        for name in ['f4.sam', 'f01.sam', 'g1.sam']:
+            with self.assertRaises(DataObjectDoesNotExist):
+                session.data_objects.get('/zone/big/group0/coll0/' + name)
+
+        # Changes to a synthetic object's metadata are kept
+        path = '/zone/big/group0/coll1/f2.sam'
+        session.metadata.add(DataObject, path, iRODSMeta('group', 'hgi'))
+        self.assertEqual(sorted((avu.name, avu.value) for avu in
+            session.metadata.get(DataObject, path)),
+            [('group', 'hgi'), ('pi', 'ch12')])
+        self.assertEqual(len(session.metadata.get(DataObject,
+            '/zone/big/group0/coll1/f1.sam')), 1)
+
+    def test_synthetic_queries(self):
+        session = FakeSession()
+        session.add_synthetic_tree('/zone/big', 3, 4, name='f{}.sam',
+            avus=[('pi', 'ch12')], fanout=2)
+        for name in ['f1.sam', 'f3.sam']:
+            obj = session.data_objects.get('/zone/big/group0/coll1/' + name)
+            obj.metadata.add('group', 'hgi')
+        session.metadata.add(DataObject, '/zone/big/group1/coll2/f1.sam',
+            iRODSMeta('group', 'hgi'))
+
+        # Indexed by collection, and by name within one
+        metadata = irods_wrapper.query_metadata(session,
+            '/zone/big/group0/coll1')
+        self.assertEqual(len(metadata), 4)
+        self.assertEqual(metadata['/zone/big/group0/coll1/f3.sam'],
+            [('pi', 'ch12', None), ('group', 'hgi', None)])
+        self.assertEqual(irods_wrapper.query_metadata(session,
+            '/zone/big/group0/coll1', ['f1.sam', 'f9.sam']),
+            {'/zone/big/group0/coll1/f1.sam': [('pi', 'ch12', None),
+            ('group', 'hgi', None)]})
+        self.assertEqual(irods_wrapper.query_metadata(session,
+            '/zone/big/group0', is_collection=True), {})
+
+        # Only changed AVUs are kept, and objects with the same ones share
+        # them
+        data = session._collections['/zone/big/group0/coll1'].data
+        self.assertEqual(sorted(data._changed), [1, 3])
+        self.assertIs(data._changed[1], data._changed[3])
+
+    def test_ranged_reads(self):
+        session = FakeSession()
+        session.add_data_object('/zone/coll/a', content=b'0123456789')
+        with session.data_objects.open('/zone/coll/a', 'r') as file:
+            file.seek(4)
+            self.assertEqual(file.read(3), b'456')
+            self.assertEqual(file.bytes_read, 3)
+            self.assertEqual(file.reads, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import planner.planner as planner
+from planner.header_cache import HeaderCache
+from test.fake_irods import FakeSession
+
+
+class TestHeaderCache(unittest.TestCase):
+    '''Suite of tests on the persistent header cache
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.directory.name, 'headers.db')
+        self.session = FakeSession()
+        for i in range(5):
+            self.session.add_data_object('/zone/coll/f{}.cram'.format(i),
+                b'header ' + str(i).encode(), modify_time=1000)
+        self.reads = []
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read(self, path, session=None):
+        self.reads.append(path)
+        return {'RG': {'1': {'ID': '1', 'SM': path}}, 'HD': {'VN': '1.6'}}
+
+    def test_hit_skips_reader(self):
+        with HeaderCache(self.db_path, self.session) as cache:
+            first = cache.get('/zone/coll/f1.cram', 'sequence', self.read)
+        with HeaderCache(self.db_path, self.session) as cache:
+            second = cache.get('/zone/coll/f1.cram', 'sequence', self.read)
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.reads, ['/zone/coll/f1.cram'])
+
+    def test_one_query_per_collection(self):
+        with HeaderCache(self.db_path, self.session) as cache:
+            self.session.round_trips = 0
+            for i in range(5):
+                cache.get('/zone/coll/f{}.cram'.format(i), 'sequence',
+                    self.read)
+            self.assertEqual(self.session.round_trips, 1)
+
+    def test_query_outside_lock(self):
+        self.session.add_data_object('/zone/other/f0.cram', b'header')
+        with HeaderCache(self.db_path, self.session) as cache:
+            cached = cache.fingerprint('/zone/coll/f0.cram')
+            self.session.latency = {'query': 0.5}
+            thread = threading.Thread(target=cache.fingerprint,
+                args=('/zone/other/f0.cram',))
+            thread.start()
+            time.sleep(0.05)
+
+            # The cached collection is answered while the other is queried
+            start = time.monotonic()
+            self.assertEqual(cache.fingerprint('/zone/coll/f0.cram'), cached)
+            self.assertLess(time.monotonic() - start, 0.1)
+            self.assertTrue(thread.is_alive())
+
+            # Other threads wanting the queried collection wait for it
+            self.session.round_trips = 0
+            self.assertIsNotNone(cache.fingerprint('/zone/other/f0.cram'))
+            thread.join()
+            self.assertEqual(self.session.round_trips, 0)
+
+    def test_changed_file(self):
+        path = '/zone/coll/f1.cram'
+        with HeaderCache(self.db_path, self.session) as cache:
+            cache.get(path, 'sequence', self.read)
+            # Same content, touched later
+            self.session.add_data_object(path, b'header 1',
+                modify_time=2000)
+        with HeaderCache(self.db_path, self.session) as cache:
+            cache.get(path, 'sequence', self.read)
+            self.session.add_data_object(path, b'new header',
+                modify_time=2000)
+        with HeaderCache(self.db_path, self.session) as cache:
+            cache.get(path, 'sequence', self.read)
+            cache.get(path, 'sequence', self.read)
+
+        self.assertEqual(self.reads, [path] * 3)
+
+    def test_file_types(self):
+        path = '/zone/coll/f1.cram'
+        with HeaderCache(self.db_path, self.session) as cache:
+            cache.get(path, 'sequence', self.read)
+            cache.get(path, 'variant', self.read)
+            cache.get(path, 'variant', self.read)
+        self.assertEqual(self.reads, [path] * 2)
+
+    def test_failures_not_cached(self):
+        with HeaderCache(self.db_path, self.session) as cache:
+            for _ in range(2):
+                self.assertIsNone(cache.get('/zone/coll/f1.cram', 'sequence',
+                    lambda path: self.reads.append(path)))
+            # Missing objects can't be fingerprinted, so aren't cached
+            for _ in range(2):
+                cache.get('/zone/coll/missing.cram', 'sequence', self.read)
+        self.assertEqual(len(self.reads), 4)
+
+    def test_eviction(self):
+        size = len(json.dumps(self.read('/zone/coll/f0.cram'),
+            separators=(',', ':'))) + len('/zone/coll/f0.cram')
+        self.reads = []
+        with HeaderCache(self.db_path, self.session,
+                max_bytes=size * 3) as cache:
+            for i in range(5):
+                cache.get('/zone/coll/f{}.cram'.format(i), 'sequence',
+                    self.read)
+            self.reads = []
+            # The oldest headers were evicted, the newest kept
+            cache.get('/zone/coll/f4.cram', 'sequence', self.read)
+            cache.get('/zone/coll/f0.cram', 'sequence', self.read)
+        self.assertEqual(self.reads, ['/zone/coll/f0.cram'])
+
+    def test_one_read_per_plan(self):
+        config = os.path.join(self.directory.name, 'config.yaml')
+        with open(config, 'w') as file:
+            file.write('"*.cram":\n'
+                '- infer: sequence\n  mapping:\n    version: HD.VN\n'
+                '- infer: sequence\n  mapping:\n    sample: RG.1.SM\n')
+
+        readers = planner.HEADER_READERS
+        planner.HEADER_READERS = dict(readers, sequence=self.read)
+        try:
+            with HeaderCache(self.db_path, self.session) as cache:
+                plans = list(planner.generate_plans(
+                    [('/zone/coll/f1.cram', False)], config,
+                    header_cache=cache))
+        finally:
+            planner.HEADER_READERS = readers
+
+        self.assertEqual(self.reads, ['/zone/coll/f1.cram'])
+        self.assertEqual([(avu.attribute, avu.value) for avu in
+            plans[0].metadata], [('version', '1.6'),
+            ('sample', '/zone/coll/f1.cram')])
+
+
+if __name__ == '__main__':
+    unittest.main()
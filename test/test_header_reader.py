@@ -0,0 +1,200 @@
+import io
+import os
+import tempfile
+import unittest
+
+import pysam
+
+import planner.header_reader as header_reader
+import planner.inferrers as inferrers
+from test.fake_irods import FakeSession
+
+HEADER = {
+    'HD': {'VN': '1.6', 'SO': 'coordinate'},
+    'SQ': [{'SN': 'chr1', 'LN': 1000, 'M5': '0' * 32},
+        {'SN': 'chr2', 'LN': 2000, 'M5': '1' * 32}],
+    'RG': [{'ID': 'rg1', 'SM': 'sample1', 'PL': 'ILLUMINA'}],
+    'PG': [{'ID': 'bwa', 'PN': 'bwa', 'VN': '0.7.17'}],
+    'CO': ['free text comment', 'key:value other:thing']
+}
+
+
+def _write(directory, name, mode, header):
+    path = os.path.join(directory, name)
+    with pysam.AlignmentFile(path, mode, header=header):
+        pass
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+class TestHeaderReader(unittest.TestCase):
+    '''Suite of tests on reading alignment headers in-process
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.session = FakeSession()
+        self.text = str(pysam.AlignmentHeader.from_dict(HEADER))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _add(self, name, mode, header=HEADER):
+        path = '/zone/coll/' + name
+        self.session.add_data_object(path,
+            _write(self.directory.name, name, mode, header))
+        return path
+
+    def test_formats(self):
+        for name, mode in [('a.sam', 'w'), ('a.bam', 'wb'),
+                ('a.cram', 'wc')]:
+            with self.subTest(name):
+                path = self._add(name, mode)
+                with self.session.data_objects.open(path, 'r') as stream:
+                    text = header_reader.read_alignment_header(stream)
+                self.assertEqual(pysam.AlignmentHeader.from_text(text)
+                    .as_dict(), HEADER)
+
+    def test_same_dict_as_samtools(self):
+        # get_sequence_header used to parse 'samtools view -H' output, which
+        # is the header text
+        expected = {
+            'HD': {'VN': '1.6', 'SO': 'coordinate'},
+            'SQ': {'chr1': HEADER['SQ'][0], 'chr2': HEADER['SQ'][1]},
+            'RG': {'rg1': HEADER['RG'][0]},
+            'PG': {'bwa': HEADER['PG'][0]},
+            'CO': {'0': 'free text comment',
+                '1': {'key': 'value', 'other': 'thing'}}
+        }
+        for name, mode in [('b.bam', 'wb'), ('b.cram', 'wc')]:
+            with self.subTest(name):
+                path = self._add(name, mode)
+                self.assertEqual(inferrers.get_sequence_header(path,
+                    self.session), expected)
+
+    def test_large_header(self):
+        header = dict(HEADER, SQ=[{'SN': 'contig{}'.format(i), 'LN': i + 1}
+            for i in range(20000)])
+        path = self._add('large.bam', 'wb', header)
+        with self.session.data_objects.open(path, 'r') as stream:
+            text = header_reader.read_alignment_header(stream)
+            reads = stream.reads
+        self.assertEqual(len(pysam.AlignmentHeader.from_text(text)
+            .as_dict()['SQ']), 20000)
+        # Spans several BGZF blocks and reads
+        self.assertGreater(reads, 1)
+
+    def test_only_header_read(self):
+        path = self._add('c.bam', 'wb')
+        content = self.session._find_data(path)[1].content
+        self.session.add_data_object(path, content + b'\0' *
+            (10 * header_reader.READ_SIZE))
+        with self.session.data_objects.open(path, 'r') as stream:
+            header_reader.read_alignment_header(stream)
+            self.assertEqual(stream.reads, 1)
+
+    def test_invalid(self):
+        for content in [b'', b'not a header', b'\x1f\x8bgarbage',
+                b'CRAM\x03\x00']:
+            with self.subTest(content):
+                with self.assertRaises(header_reader.HeaderFormatError):
+                    header_reader.read_alignment_header(io.BytesIO(content))
+
+    def test_small_chunks(self):
+        data = bytes(range(256)) * 4096
+        reader = header_reader._Reader(iter([data[i:i + 100] for i in
+            range(0, len(data), 100)]))
+        for i in range(0, len(data), 1024):
+            self.assertEqual(reader.take(1024), data[i:i + 1024])
+            # Bytes already handed out don't pile up
+            self.assertLess(len(reader._data), 2200)
+        self.assertEqual(reader.take(0), b'')
+        self.assertEqual(header_reader._Reader(iter([data[i:i + 100] for i in
+            range(0, len(data), 100)])).take(len(data)), data)
+
+    def test_itf8(self):
+        cases = [(b'\x00', 0), (b'\x7f', 127), (b'\x80\xff', 255),
+            (b'\xc0\x40\x00', 0x4000), (b'\xe0\x20\x00\x00', 0x200000),
+            (b'\xff\xff\xff\xff\x0f', -1)]
+        for data, value in cases:
+            with self.subTest(data):
+                reader = header_reader._Reader(iter([data]))
+                self.assertEqual(reader.itf8(), value)
+
+    def test_ltf8(self):
+        cases = [(b'\x05', 5), (b'\x81\x00', 256),
+            (b'\xff' + (2 ** 40).to_bytes(8, 'big'), 2 ** 40)]
+        for data, value in cases:
+            with self.subTest(data):
+                reader = header_reader._Reader(iter([data]))
+                self.assertEqual(reader.ltf8(), value)
+
+
+class TestVariantHeaderReader(unittest.TestCase):
+    '''Suite of tests on reading variant headers and samples in-process
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.session = FakeSession()
+        self.header = pysam.VariantHeader()
+        self.header.contigs.add('chr1', length=1000)
+        self.header.add_line('##FORMAT=<ID=GT,Number=1,Type=String,'
+            'Description="Genotype, with a comma">')
+        self.header.add_line('##source=test')
+        for sample in ['S1', 'S2', 'S3']:
+            self.header.add_sample(sample)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _add(self, name, mode):
+        path = os.path.join(self.directory.name, name)
+        with pysam.VariantFile(path, mode, header=self.header) as file:
+            record = file.new_record(contig='chr1', start=10, alleles=('A',
+                'T'))
+            file.write(record)
+        with open(path, 'rb') as file:
+            self.session.add_data_object('/zone/coll/' + name, file.read())
+        return '/zone/coll/' + name
+
+    def test_formats(self):
+        expected = inferrers.parse_variant_header(str(self.header))
+        expected['sample_names'] = 'S1\nS2\nS3\n'
+        for name, mode in [('a.vcf', 'w'), ('a.vcf.gz', 'wz'),
+                ('a.bcf', 'wb')]:
+            with self.subTest(name):
+                path = self._add(name, mode)
+                header = inferrers.get_variant_header(path, self.session)
+                self.assertEqual(header, expected)
+                self.assertEqual(header['FORMAT']['GT']['Description'],
+                    '"Genotype, with a comma"')
+                self.assertEqual(header['source'], 'test')
+
+    def test_stops_at_columns(self):
+        path = self._add('b.vcf', 'w')
+        with self.session.data_objects.open(path, 'r') as stream:
+            text, samples = header_reader.read_variant_header(stream)
+        self.assertTrue(text.endswith('S3\n'))
+        self.assertNotIn('chr1\t11', text)
+        self.assertEqual(samples, ['S1', 'S2', 'S3'])
+
+    def test_long_header(self):
+        text = (b'##fileformat=VCFv4.2\n' + b''.join(b'##contig=<ID=c%d>\n'
+            % i for i in range(20000)) + b'#CHROM\tPOS\tID\n')
+        chunks = [text[i:i + 100] for i in range(0, len(text), 100)]
+        header = header_reader._leading_lines(iter(chunks + [b'c0\t1\t.\n']),
+            b'#', b'#CHROM')
+        self.assertIsInstance(header, bytes)
+        self.assertEqual(header, text)
+
+    def test_invalid(self):
+        for content in [b'', b'@HD\tVN:1.6\n', b'##fileformat=VCFv4.2\n',
+                b'BCF\x02\x02\xff\x00']:
+            with self.subTest(content):
+                with self.assertRaises(header_reader.HeaderFormatError):
+                    header_reader.read_variant_header(io.BytesIO(content))
+
+
+if __name__ == '__main__':
+    unittest.main()
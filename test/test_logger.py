@@ -0,0 +1,68 @@
+import io
+import json
+import logging
+import unittest
+
+import core.logger as logger
+
+
+class TestLogger(unittest.TestCase):
+    '''Suite of tests on configuring logging once for a run
+    '''
+
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.addCleanup(logger.shutdown)
+
+    def lines(self):
+        logger.shutdown()
+        return self.stream.getvalue().splitlines()
+
+    def test_handlers_added_once(self):
+        logger.configure(stream=self.stream)
+        for _ in range(5):
+            log = logger.init_logger(logger.DEFAULT_LOGGER, 'Planner')
+        log.info("Verifying configuration file...")
+        lines = self.lines()
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].endswith(
+            "Planner: Verifying configuration file..."))
+
+    def test_json_lines(self):
+        logger.configure(json_lines=True, stream=self.stream)
+        logger.get_logger('Executor').error("Failed to apply metadata to "
+            "%s: %s", '/zone/a', 'boom', extra={'path': '/zone/a',
+            'error': 'boom'})
+        entry = json.loads(self.lines()[0])
+        self.assertEqual(entry['level'], 'ERROR')
+        self.assertEqual(entry['component'], 'Executor')
+        self.assertEqual(entry['message'],
+            "Failed to apply metadata to /zone/a: boom")
+        self.assertEqual(entry['path'], '/zone/a')
+        self.assertIn('time', entry)
+
+    def test_rate_limit(self):
+        logger.configure(level=logging.DEBUG, stream=self.stream, rate=2)
+        log = logger.get_logger('Planner')
+        for i in range(10):
+            log.debug("Planning AVUs for %s...", i, extra={'path': str(i)})
+            log.error("Failed %s", i, extra={'path': str(i)})
+        log.info("Run-wide messages aren't limited")
+        lines = self.lines()
+
+        self.assertEqual(sum("Planning" in line for line in lines), 2)
+        self.assertEqual(sum("Failed" in line for line in lines), 10)
+        self.assertIn("8 similar DEBUG messages suppressed", lines[-1])
+
+    def test_quiet(self):
+        logger.configure(level=logging.WARNING, stream=self.stream)
+        log = logger.get_logger('CLI')
+        log.info("Using catalogue snapshot")
+        log.warning("3 objects failed")
+        lines = self.lines()
+        self.assertEqual(len(lines), 1)
+        self.assertIn("CLI: 3 objects failed", lines[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+
+from planner import planner
+from planner.mapping import NOT_FOUND, HeaderView, compile_mapping, \
+    compile_target
+from planner.object_class import AVU, Plan
+
+HEADER = {
+    'HD': {'VN': '1.6', 'SO': 'coordinate'},
+    'SQ': {'chr1': {'SN': 'chr1', 'LN': 1000},
+        'chr2': {'SN': 'chr2', 'LN': 2000, 'M5': 'abc'}},
+    'RG': {'rg1': {'ID': 'rg1', 'SM': 's1'}, 'rg2': {'ID': 'rg2'}},
+    'source': ['caller', 'annotator'],
+    'sample_names': 'S1\nS2\n'
+}
+
+
+def access(target, header=HEADER):
+    return compile_target(target)(HeaderView(header))
+
+
+class TestMapping(unittest.TestCase):
+    '''Suite of tests on compiled mapping targets
+    '''
+
+    def test_descend(self):
+        self.assertEqual(access('HD.VN'), '1.6')
+        self.assertEqual(access('RG.?.SM'), 's1')
+        self.assertEqual(access('sample_names'), 'S1\nS2\n')
+        self.assertEqual(access('HD'), HEADER['HD'])
+
+    def test_missing(self):
+        for target in ['HD.XX', 'XX', 'HD.VN.x', 'RG.?.XX', 'source.?']:
+            with self.subTest(target):
+                self.assertIs(access(target), NOT_FOUND)
+        self.assertIs(access('HD.?', {'HD': {}}), NOT_FOUND)
+
+    def test_wildcard_column(self):
+        self.assertEqual(access('SQ.*.LN'), '1000    2000')
+        self.assertEqual(access('SQ.*.SN'), 'chr1    chr2')
+        # Every row needs the tag
+        self.assertIs(access('SQ.*.M5'), NOT_FOUND)
+        self.assertIs(access('RG.*.SM'), NOT_FOUND)
+        self.assertIs(access('XX.*.LN'), NOT_FOUND)
+        self.assertIs(access('HD.VN.*.x'), NOT_FOUND)
+
+    def test_wildcard_rows(self):
+        self.assertEqual(access('HD.*'), 'VN=1.6    SO=coordinate')
+        self.assertEqual(access('HD.VN.*'), '1.6')
+
+    def test_shared_columns(self):
+        class Section(dict):
+            scans = 0
+
+            def values(self):
+                Section.scans += 1
+                return super().values()
+
+        view = HeaderView({'SQ': Section(HEADER['SQ'])})
+        self.assertEqual(compile_target('SQ.*.LN')(view), '1000    2000')
+        self.assertEqual(compile_target('SQ.*.SN')(view), 'chr1    chr2')
+        self.assertIs(compile_target('SQ.*.M5')(view), NOT_FOUND)
+        # Every column was built in one pass over the section
+        self.assertEqual(Section.scans, 1)
+
+    def test_infer_file(self):
+        mapping = {'version': 'HD.VN', 'lengths': 'SQ.*.LN',
+            'order': 'HD.*', 'missing': 'HD.XX'}
+        for compiled in [mapping, compile_mapping(mapping)]:
+            plan = planner.infer_file(Plan('/a.cram', False), compiled,
+                'sequence', HEADER)
+            self.assertEqual(plan.metadata, [AVU('version', '1.6'),
+                AVU('lengths', '1000    2000'),
+                AVU('order', 'VN=1.6    SO=coordinate')])
+
+    def test_large_section(self):
+        contigs = 100000
+        header = {'SQ': {'c{}'.format(i): {'SN': 'c{}'.format(i), 'LN': i}
+            for i in range(contigs)}}
+        column = access('SQ.*.LN', header)
+        self.assertEqual(column.split(), [str(i) for i in range(contigs)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import random
+import unittest
+from bench.reference import naive_match
+from planner.matcher import PatternMatcher
+
+
+class TestPatternMatcher(unittest.TestCase):
+    '''Suite of tests on compiled configuration patterns
+    '''
+
+    patterns = ['*', '*.cram', '*.vcf.gz', '/seq/*', '/seq/run1/a.cram',
+        '*/run?/*', '*.[bc]ram', r'/\.([sb]|cr)am$/', r'/(a)\1/', '/^/seq/',
+        '/(?i)VCF/', 'run*', '/x/']
+
+    def test_precedence(self):
+        matcher = PatternMatcher(['*', '*.cram', '/seq/*'])
+        self.assertEqual(matcher.match('/seq/a.cram'),
+            ['/seq/*', '*.cram', '*'])
+        self.assertEqual(matcher.match('/other/a.txt'), ['*'])
+
+    def test_matches_naive_loop(self):
+        names = ['a.cram', 'b.bam', 'c.vcf.gz', 'aa.txt', 'x.VCF', 'd.sam',
+            'run', 'e']
+        dirs = ['/seq', '/seq/run1', '/seq/run22', '/other', '/x', '']
+        rng = random.Random(1)
+        for _ in range(500):
+            patterns = rng.sample(self.patterns[:-1], 8) + ['/x/']
+            matcher = PatternMatcher(patterns)
+            for directory in dirs:
+                for name in names:
+                    path = directory + '/' + name
+                    self.assertEqual(matcher.match(path),
+                        naive_match(patterns, path), (patterns, path))
+
+
+if __name__ == "__main__":
+    unittest.main()
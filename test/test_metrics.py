@@ -0,0 +1,102 @@
+import json
+import os
+import tempfile
+import unittest
+
+import core.metrics as metrics
+from core.metrics import Registry, TextfileExporter
+from executor.executor import Executor
+from planner.object_class import AVU, Plan
+from test.test_executor import _fake_zone
+
+
+class TestMetrics(unittest.TestCase):
+    '''Suite of tests on run metrics and their exporters
+    '''
+
+    def setUp(self):
+        self.registry = Registry()
+        self.pages = self.registry.histogram('pages_seconds', "Pages.",
+            buckets=(0.1, 1))
+        self.added = self.registry.counter('added_total', "Added.")
+        self.depth = self.registry.gauge('depth', "Depth.")
+
+    def test_prometheus(self):
+        for value in [0.05, 0.1, 0.5, 3]:
+            self.pages.observe(value)
+        self.added.inc(2)
+        self.depth.set_function(lambda: 7)
+
+        self.assertEqual(self.registry.prometheus(),
+            '# HELP pages_seconds Pages.\n'
+            '# TYPE pages_seconds histogram\n'
+            'pages_seconds_bucket{le="0.1"} 2\n'
+            'pages_seconds_bucket{le="1"} 3\n'
+            'pages_seconds_bucket{le="+Inf"} 4\n'
+            'pages_seconds_sum 3.65\n'
+            'pages_seconds_count 4\n'
+            '# HELP added_total Added.\n'
+            '# TYPE added_total counter\n'
+            'added_total 2\n'
+            '# HELP depth Depth.\n'
+            '# TYPE depth gauge\n'
+            'depth 7\n')
+
+    def test_quantile(self):
+        self.assertIsNone(self.pages.quantile(0.5))
+        for _ in range(4):
+            self.pages.observe(0.05)
+        for _ in range(4):
+            self.pages.observe(0.5)
+        self.assertAlmostEqual(self.pages.quantile(0.5), 0.1)
+        self.assertAlmostEqual(self.pages.quantile(0.75), 0.55)
+
+    def test_drain_and_merge(self):
+        self.pages.observe(0.5)
+        self.added.inc(3)
+        drained = self.registry.drain()
+        self.assertEqual(self.added.value, 0)
+        self.assertEqual(self.pages.count, 0)
+
+        other = Registry()
+        other.counter('added_total', "Added.").inc()
+        other.histogram('pages_seconds', "Pages.", buckets=(0.1, 1))
+        other.merge(drained)
+        other.merge(drained)
+        self.assertEqual(other.metrics['added_total'].value, 7)
+        self.assertEqual(other.metrics['pages_seconds'].count, 2)
+
+    def test_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'asclepius.prom')
+            with TextfileExporter(path, 0.01, self.registry):
+                self.added.inc()
+            with open(path) as file:
+                self.assertIn('added_total 1\n', file.read())
+
+            path = os.path.join(directory, 'summary.json')
+            metrics.write_summary(path, self.registry)
+            with open(path) as file:
+                summary = json.load(file)
+            self.assertEqual(summary['counters'], {'added_total': 1})
+            self.assertEqual(summary['histograms'], {'pages_seconds':
+                {'count': 0}})
+
+    def test_worker_metrics(self):
+        # Workers count in their own processes and send their counts back
+        added = metrics.AVUS_ADDED.value
+        applied = metrics.OBJECTS_APPLIED.value
+        writes = metrics.METADATA_WRITE_SECONDS.count
+
+        executor = Executor(None, 2, session_factory=_fake_zone)
+        plans = [Plan('/zone/coll/f{}'.format(i), False, [AVU('a', 'b'),
+            AVU('c', 'd')]) for i in range(10)]
+        self.assertEqual(len(list(executor.execute_plans(plans))), 10)
+
+        self.assertEqual(metrics.AVUS_ADDED.value - added, 20)
+        self.assertEqual(metrics.OBJECTS_APPLIED.value - applied, 10)
+        self.assertEqual(metrics.METADATA_WRITE_SECONDS.count - writes, 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
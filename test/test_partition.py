@@ -0,0 +1,51 @@
+import unittest
+
+from core.partition import in_shard, parse_shard, partition, shard_file, \
+    shard_of
+
+
+class TestShards(unittest.TestCase):
+    '''Suite of tests on splitting a catalogue into shards
+    '''
+
+    paths = ['/zone/coll/f{}'.format(i) for i in range(1000)]
+
+    def test_parse(self):
+        self.assertEqual(parse_shard('2/8'), (2, 8))
+        for text in ['0/8', '9/8', '2', 'a/b', '1/2/3']:
+            with self.assertRaises(ValueError):
+                parse_shard(text)
+
+    def test_shards_cover_catalogue_once(self):
+        shards = [list(in_shard(self.paths, (index, 4)))
+            for index in range(1, 5)]
+        self.assertEqual(sorted(sum(shards, [])), sorted(self.paths))
+        for shard in shards:
+            # Order is kept, and no shard is badly lopsided
+            self.assertEqual(shard, sorted(shard, key=self.paths.index))
+            self.assertGreater(len(shard), 200)
+
+    def test_shard_spreads_over_workers(self):
+        # Sharding and worker partitioning use different hashes, so one
+        # shard's paths still reach every worker
+        shard = list(in_shard(self.paths, (1, 4)))
+        self.assertEqual(set(partition(path, 4) for path in shard),
+            {0, 1, 2, 3})
+
+    def test_stable(self):
+        entries = [(path, False) for path in self.paths]
+        self.assertEqual(list(in_shard(entries, (3, 7),
+            key=lambda entry: entry[0])), [(path, False) for path in
+            self.paths if shard_of(path, 7) == 3])
+        self.assertEqual(shard_of('/zone/coll/f1', 7),
+            shard_of('/zone/coll/f1', 7))
+
+    def test_shard_file(self):
+        self.assertEqual(shard_file('run/progress.db', (2, 8)),
+            'run/progress.shard-2-of-8.db')
+        self.assertEqual(shard_file('catalogue', (1, 2)),
+            'catalogue.shard-1-of-2')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import threading
+import time
+import unittest
+from core import pipeline
+
+
+class TestBuffered(unittest.TestCase):
+    '''Suite of tests on the bounded plan queue
+    '''
+
+    def test_order(self):
+        self.assertEqual(list(pipeline.buffered(iter(range(100)), 5)),
+            list(range(100)))
+        self.assertEqual(list(pipeline.buffered(iter(range(10)), 0)),
+            list(range(10)))
+
+    def test_backpressure(self):
+        produced = []
+
+        def producer():
+            for i in range(100):
+                produced.append(i)
+                yield i
+
+        stream = pipeline.buffered(producer(), 3)
+        self.assertEqual(next(stream), 0)
+        time.sleep(0.2)
+        # Three items queued, one taken by the consumer and at most one
+        # more waiting to be put
+        self.assertLessEqual(len(produced), 5)
+        stream.close()
+
+    def test_producer_error(self):
+        def producer():
+            yield 1
+            raise ValueError("bad plan")
+
+        stream = pipeline.buffered(producer(), 2)
+        self.assertEqual(next(stream), 1)
+        with self.assertRaises(ValueError):
+            next(stream)
+
+
+class TestBoundedMap(unittest.TestCase):
+    '''Suite of tests on the concurrent apply stage
+    '''
+
+    def test_in_flight_limit(self):
+        lock = threading.Lock()
+        state = {'current': 0, 'peak': 0}
+
+        def work(item):
+            with lock:
+                state['current'] += 1
+                state['peak'] = max(state['peak'], state['current'])
+            time.sleep(0.01)
+            with lock:
+                state['current'] -= 1
+            return item * 2
+
+        results = list(pipeline.bounded_map(work, range(40), 4))
+        self.assertEqual(sorted(results), [i * 2 for i in range(40)])
+        self.assertLessEqual(state['peak'], 4)
+        self.assertGreater(state['peak'], 1)
+
+    def test_ordered(self):
+        def work(item):
+            time.sleep(0.001 * (item % 3))
+            return item
+
+        self.assertEqual(list(pipeline.bounded_map(work, range(30), 5,
+            ordered=True)), list(range(30)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import threading
+import time
+import unittest
+from executor.prefetch import MetadataPrefetcher
+from planner.object_class import AVU
+from test.fake_irods import FakeSession
+
+
+class TestMetadataPrefetcher(unittest.TestCase):
+    '''Suite of tests on the existing AVU snapshot
+    '''
+
+    def setUp(self):
+        self.session = FakeSession()
+        for i in range(20):
+            self.session.add_data_object('/zone/coll/f{}'.format(i),
+                avus=[('index', str(i)), ('unit', 'x', 'u')])
+        self.session.add_data_object('/zone/coll/bare')
+        self.session.add_collection('/zone/coll/sub', avus=[('c', 'd')])
+        self.session.add_collection('/zone/coll/sub2')
+
+    def test_one_query_per_collection(self):
+        prefetcher = MetadataPrefetcher(self.session)
+        self.session.round_trips = 0
+        for i in range(20):
+            self.assertEqual(prefetcher.get('/zone/coll/f{}'.format(i)),
+                [AVU('index', str(i)), AVU('unit', 'x', 'u')])
+        self.assertEqual(prefetcher.get('/zone/coll/bare'), [])
+        self.assertEqual(self.session.round_trips, 1)
+
+    def test_collections(self):
+        prefetcher = MetadataPrefetcher(self.session)
+        self.assertEqual(prefetcher.get('/zone/coll/sub', True),
+            [AVU('c', 'd')])
+        self.assertEqual(prefetcher.get('/zone/coll/sub2', True), [])
+
+    def test_prefetch_page(self):
+        prefetcher = MetadataPrefetcher(self.session)
+        prefetcher.prefetch(['/zone/coll/f1', '/zone/coll/bare'])
+        self.session.round_trips = 0
+        self.assertEqual(prefetcher.get('/zone/coll/f1'),
+            [AVU('index', '1'), AVU('unit', 'x', 'u')])
+        self.assertEqual(prefetcher.get('/zone/coll/bare'), [])
+        self.assertEqual(self.session.round_trips, 0)
+
+    def test_concurrent_gets(self):
+        self.session.add_data_object('/zone/other/g', avus=[('a', 'b')])
+        prefetcher = MetadataPrefetcher(self.session)
+        prefetcher.get('/zone/other/g')
+        self.session.latency = {'query': 0.2}
+        self.session.round_trips = 0
+
+        results = []
+        threads = [threading.Thread(target=lambda i=i: results.append(
+            prefetcher.get('/zone/coll/f{}'.format(i)))) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        # A collection already fetched isn't held up by another's fetch
+        start = time.monotonic()
+        self.assertEqual(prefetcher.get('/zone/other/g'), [AVU('a', 'b')])
+        self.assertLess(time.monotonic() - start, 0.1)
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 4)
+        # The threads which needed the same collection waited for one fetch
+        self.assertEqual(self.session.round_trips, 1)
+
+    def test_write_while_fetching(self):
+        prefetcher = MetadataPrefetcher(self.session)
+        self.session.latency = {'query': 0.2}
+        thread = threading.Thread(target=prefetcher.get,
+            args=('/zone/coll/f0',))
+        thread.start()
+        time.sleep(0.05)
+        prefetcher.update('/zone/coll/f1', False, [AVU('index', 'new')])
+        thread.join()
+        self.assertEqual(prefetcher.get('/zone/coll/f1'),
+            [AVU('index', 'new')])
+
+
+if __name__ == "__main__":
+    unittest.main()
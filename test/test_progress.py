@@ -0,0 +1,167 @@
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime, timezone
+
+import core.progress as progress
+from core.progress import ProgressJournal
+from planner import planner
+
+
+class TestProgressJournal(unittest.TestCase):
+    '''Suite of tests on the progress journal
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'progress.db')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_resume(self):
+        with ProgressJournal(self.path, resume=False) as journal:
+            for i in range(5):
+                journal.record('/zone/f{}'.format(i))
+            journal.record('/zone/f0')
+
+        with ProgressJournal(self.path) as journal:
+            self.assertEqual(len(journal), 5)
+            self.assertIn('/zone/f3', journal)
+            self.assertNotIn('/zone/f5', journal)
+
+        with ProgressJournal(self.path, resume=False) as journal:
+            self.assertEqual(len(journal), 0)
+
+    def test_watermark(self):
+        listed = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+        with ProgressJournal(self.path) as journal:
+            self.assertIsNone(journal.watermark('/zone/root'))
+            journal.start_listing('/zone/root', listed)
+            # Nothing moves until the run over the listing succeeds
+            self.assertIsNone(journal.watermark('/zone/root'))
+            journal.advance_watermark('/zone/root')
+            journal.start_listing('/zone/root', datetime.now(timezone.utc))
+
+        # A fresh run forgets completed paths, but not watermarks
+        with ProgressJournal(self.path, resume=False) as journal:
+            self.assertEqual(journal.watermark('/zone/root'), listed)
+            self.assertIsNone(journal.watermark('/zone/other'))
+
+    def test_merge(self):
+        early = datetime(2024, 5, 1, tzinfo=timezone.utc)
+        late = datetime(2024, 6, 1, tzinfo=timezone.utc)
+        shards = []
+        for index, (paths, listed) in enumerate([(['/zone/a', '/zone/b'],
+                late), (['/zone/b', '/zone/c'], early)]):
+            path = os.path.join(self.directory.name, 'shard{}.db'.format(
+                index))
+            with ProgressJournal(path) as journal:
+                for done in paths:
+                    journal.record(done)
+                journal.start_listing('/zone', listed)
+                journal.advance_watermark('/zone')
+                # Only one shard has finished a run over this root
+                if index == 0:
+                    journal.start_listing('/other', late)
+                    journal.advance_watermark('/other')
+            shards.append(path)
+
+        with ProgressJournal(self.path) as journal:
+            journal.merge(shards)
+            self.assertEqual(len(journal), 3)
+            self.assertEqual(journal.watermarks(), {'/zone': early})
+
+        other = os.path.join(self.directory.name, 'other.db')
+        with ProgressJournal(other) as journal:
+            journal.merge(shards[:1], with_watermarks=False)
+            self.assertEqual(len(journal), 2)
+            self.assertEqual(journal.watermarks(), {})
+
+    def test_batched_commits(self):
+        interval = progress.COMMIT_INTERVAL
+        seconds = progress.COMMIT_SECONDS
+        progress.COMMIT_INTERVAL = 10
+        progress.COMMIT_SECONDS = 3600
+        try:
+            journal = ProgressJournal(self.path, resume=False)
+            for i in range(25):
+                journal.record('/zone/f{}'.format(i))
+            # Simulate a crash: another process only sees committed batches
+            with ProgressJournal(self.path) as reader:
+                self.assertEqual(len(reader), 20)
+            journal.close()
+        finally:
+            progress.COMMIT_INTERVAL = interval
+            progress.COMMIT_SECONDS = seconds
+
+        with ProgressJournal(self.path) as reader:
+            self.assertEqual(len(reader), 25)
+
+    def test_timed_commits(self):
+        seconds = progress.COMMIT_SECONDS
+        progress.COMMIT_SECONDS = 0.05
+        try:
+            journal = ProgressJournal(self.path, resume=False)
+            journal.record('/zone/f0')
+            # Committed without anything else being recorded
+            time.sleep(0.3)
+            with ProgressJournal(self.path) as reader:
+                self.assertEqual(len(reader), 1)
+            journal.close()
+        finally:
+            progress.COMMIT_SECONDS = seconds
+
+    def test_text_progress_file(self):
+        with open(self.path, 'w') as file:
+            file.write('/zone/f0\n/zone/f1\n\n/zone/é\n')
+        with ProgressJournal(self.path) as journal:
+            self.assertEqual(len(journal), 3)
+            self.assertIn('/zone/é', journal)
+        with open(self.path + '.old') as file:
+            self.assertEqual(len(file.readlines()), 4)
+
+        with open(self.path, 'wb') as file:
+            file.write(b'\xff\xfe\x00binary')
+        with self.assertRaises(ValueError):
+            ProgressJournal(self.path)
+
+    def test_pending_keeps_order(self):
+        paths = ['/zone/f{}'.format(i) for i in range(1234)]
+        with ProgressJournal(self.path, resume=False) as journal:
+            for path in paths[::3]:
+                journal.record(path)
+            expected = [path for index, path in enumerate(paths)
+                if index % 3]
+            self.assertEqual(list(journal.pending(paths)), expected)
+            self.assertEqual(list(journal.pending(((path, False) for path
+                in paths), key=lambda entry: entry[0])),
+                [(path, False) for path in expected])
+
+    def test_pending_is_lazy(self):
+        consumed = []
+
+        def paths():
+            for i in range(10000):
+                consumed.append(i)
+                yield '/zone/f{}'.format(i)
+
+        with ProgressJournal(self.path, resume=False) as journal:
+            next(journal.pending(paths()))
+        self.assertEqual(len(consumed), progress.LOOKUP_CHUNK)
+
+    def test_generate_plans_resume(self):
+        catalogue = [('/test/a.txt', False), ('/test/d.cram', False),
+            ('/test/e.cram', False)]
+        with ProgressJournal(self.path, resume=False) as journal:
+            journal.record('/test/d.cram')
+
+        plans = planner.generate_plans(catalogue, "test/test_config_1.yaml",
+            self.path, resume=True)
+        self.assertEqual([plan.path for plan in plans],
+            ['/test/a.txt', '/test/e.cram'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import pickle
+import threading
+import time
+import unittest
+from core.throttle import ConcurrencyLimiter, Throttle, TokenBucket
+
+
+class TestThrottle(unittest.TestCase):
+    '''Suite of tests on iRODS load throttling
+    '''
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(100, burst=1)
+        start = time.monotonic()
+        for _ in range(11):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    def test_concurrency_cap(self):
+        throttle = Throttle(concurrency=2)
+        lock = threading.Lock()
+        state = {'current': 0, 'peak': 0}
+
+        def call():
+            with throttle.request():
+                with lock:
+                    state['current'] += 1
+                    state['peak'] = max(state['peak'], state['current'])
+                time.sleep(0.01)
+                with lock:
+                    state['current'] -= 1
+
+        threads = [threading.Thread(target=call) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(state['peak'], 2)
+
+    def test_nested_requests(self):
+        throttle = Throttle(concurrency=1)
+        with throttle.request():
+            with throttle.request():
+                pass
+        self.assertEqual(throttle.limiter.in_flight, 0)
+
+    def test_aimd(self):
+        limiter = ConcurrencyLimiter(4, adaptive=True, maximum=8,
+            target_latency=0.1)
+        for _ in range(40):
+            limiter.acquire()
+            limiter.release(0.01)
+        self.assertEqual(limiter.limit, 8)
+
+        limiter.acquire()
+        limiter.release(1.0)
+        self.assertEqual(limiter.limit, 4)
+        # Late reports from the same slow period don't back off again
+        limiter.acquire()
+        limiter.release(1.0)
+        self.assertEqual(limiter.limit, 4)
+
+    def test_errors_shrink_limit(self):
+        throttle = Throttle(concurrency=8, adaptive=True,
+            error_types=(OSError,))
+        with self.assertRaises(OSError):
+            with throttle.request():
+                raise OSError("connection reset")
+        self.assertEqual(throttle.limiter.limit, 4)
+
+        with self.assertRaises(KeyError):
+            with throttle.request():
+                raise KeyError("not a load problem")
+        self.assertEqual(throttle.limiter.in_flight, 0)
+
+    def test_share(self):
+        throttle = Throttle(rate=100, concurrency=9, adaptive=True)
+        shared = pickle.loads(pickle.dumps(throttle.share(3)))
+        self.assertEqual(shared.bucket.rate, 100 / 3)
+        self.assertEqual(shared.limiter.limit, 3)
+        self.assertTrue(shared.limiter.adaptive)
+
+
+if __name__ == "__main__":
+    unittest.main()
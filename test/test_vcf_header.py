@@ -0,0 +1,69 @@
+import unittest
+
+import planner.inferrers as inferrers
+from bench.reference import make_header, tokenize_split
+
+
+class TestSplitBySymbol(unittest.TestCase):
+    '''Suite of tests on the quote-aware VCF header field splitter
+    '''
+
+    def test_cases(self):
+        cases = [
+            ('ID=a,Number=1', ['ID=a', 'Number=1']),
+            ('ID=a,Description="x, y",Number=1',
+                ['ID=a', 'Description="x, y"', 'Number=1']),
+            ('Description="a \\"b, c\\" d",ID=e',
+                ['Description="a \\"b, c\\" d"', 'ID=e']),
+            ("Description='a, b',ID=c", ["Description='a, b'", 'ID=c']),
+            ('Description="it\'s, fine",ID=c',
+                ['Description="it\'s, fine"', 'ID=c']),
+            ('single', ['single']),
+            ('', ['']),
+            ('a,,b,', ['a', '', 'b', ''])
+        ]
+        for string, expected in cases:
+            with self.subTest(string):
+                self.assertEqual(inferrers._split_by_symbol(string, ','),
+                    expected)
+                self.assertEqual(tokenize_split(string, ','), expected)
+
+    def test_other_symbols(self):
+        self.assertEqual(inferrers._split_by_symbol('a;"b;c";d', ';'),
+            ['a', '"b;c"', 'd'])
+
+    def test_unquoted_hash(self):
+        # The tokenizer took an unquoted '#' to start a Python comment, and
+        # stopped splitting there
+        string = 'ID=url,URL=http://host/page#part,Type=String'
+        self.assertEqual(inferrers._split_by_symbol(string, ','),
+            ['ID=url', 'URL=http://host/page#part', 'Type=String'])
+        self.assertEqual(tokenize_split(string, ','),
+            ['ID=url', 'URL=http://host/page#part,Type=String'])
+        self.assertEqual(inferrers._split_by_symbol(
+            'ID=a,Description="x #y, z",Number=1', ','),
+            ['ID=a', 'Description="x #y, z"', 'Number=1'])
+
+    def test_equivalent_lines(self):
+        header = make_header(500, 500)
+        for line in header.split('\n'):
+            if line.startswith('##') and line.endswith('>'):
+                values = line.split('=', 1)[1][1:-1]
+                self.assertEqual(inferrers._split_by_symbol(values, ','),
+                    tokenize_split(values, ','), line)
+
+    def test_equivalent_headers(self):
+        header = make_header(5000, 2000)
+        split = inferrers._split_by_symbol
+        try:
+            inferrers._split_by_symbol = tokenize_split
+            expected = inferrers.parse_variant_header(header)
+        finally:
+            inferrers._split_by_symbol = split
+        self.assertEqual(inferrers.parse_variant_header(header), expected)
+        self.assertEqual(len(expected['contig']), 5000)
+        self.assertEqual(expected['source'], ['caller', 'annotator'])
+
+
+if __name__ == '__main__':
+    unittest.main()